@@ -1,14 +1,28 @@
 import os
+import sys
 import json
+import uuid
+import shutil
+import signal
 import asyncio
-from fastapi import FastAPI, Query
+import argparse
+import threading
+import subprocess
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, UploadFile, File, Form
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from pageindex.utils import ConfigLoader, ChatGPT_API, ChatGPT_API_async, get_text_of_pages, remove_fields
-from pageindex.vector_index import get_vector_index, search_documents
+from pageindex.utils import ConfigLoader, ChatGPT_API, ChatGPT_API_async, get_text_of_pages, remove_fields, config
+from pageindex.vector_index import get_vector_index, IndexRebuilder
+from pageindex.tree import DocumentTree
+from pageindex.storage import load_result, get_node_text, result_exists
+from pageindex.catalog import get_catalog
+from pageindex.warmup import BackgroundWarmup
+from pageindex.jobs import (JobStore, JobConflict, IngestionWorkerPool, INGEST_WORKERS, PDF_EXTENSIONS, MD_EXTENSIONS,
+                            REBUILD_INDEX, DELETE_INDEX, DELETE_DOCUMENT)
+from pageindex.snapshot import SERVE_ROLE, SnapshotPublisher, get_snapshot_index
 import uvicorn
 
-app = FastAPI(title="PageIndex Retrieval API")
-
 class QueryRequest(BaseModel):
     q: str
     top_k: int = 5  # 向量检索返回的最大结果数
@@ -19,55 +33,139 @@ default_config = config_loader.load()
 MODEL_NAME = os.getenv("CHATGPT_MODEL", "gpt-4o")
 RESULTS_DIR = "results"
 UPLOAD_DIR = "uploads"
-
-
-def get_node_mapping(structure, mapping=None):
-    """从树结构中构建 node_id 到节点的映射"""
-    if mapping is None: 
-        mapping = {}
-    if isinstance(structure, list):
-        for item in structure:
-            get_node_mapping(item, mapping)
-    elif isinstance(structure, dict):
-        if 'node_id' in structure:
-            mapping[structure['node_id']] = structure
-        if 'nodes' in structure:
-            get_node_mapping(structure['nodes'], mapping)
-    return mapping
+# 多进程部署时的 API 工作进程数（>1 时启动一个写入进程和多个只读查询进程）
+API_WORKERS = int(os.getenv("PAGEINDEX_API_WORKERS", "1"))
+# 只读查询进程：检索读取共享快照，写操作作为任务提交给写入进程
+QUERY_ROLE = SERVE_ROLE == "query"
+
+
+def build_ingest_options(job_options, resume=False):
+    """根据默认配置和任务选项构建导入任务的处理配置"""
+    options = dict(vars(default_config))
+    options.update(job_options or {})
+    options.pop("resume", None)
+    options.update(
+        model=MODEL_NAME,
+        if_add_node_id="yes",
+        if_add_node_summary="yes",
+        if_build_vector_index="yes",  # 自动构建向量索引
+        resume="yes" if resume else "no",
+    )
+    return config(**options)
+
+
+def get_search_index():
+    """检索使用的索引：查询进程读取共享快照，其他情况直接使用 ChromaDB"""
+    return get_snapshot_index() if QUERY_ROLE else get_vector_index()
+
+
+def rebuild_structure_files():
+    """需要重建索引的结构文件（文档目录中已处理完成的文档）"""
+    return [entry["structure_path"] for entry in catalog.list() if entry["structure_path"]]
+
+
+def delete_index(doc_name: str) -> int:
+    """删除文档的向量索引并更新文档目录"""
+    deleted_count = get_vector_index().delete_document(doc_name)
+    catalog.mark_unindexed(doc_name)
+    return deleted_count
+
+
+def delete_document_files(doc_id: str):
+    """删除文档：向量索引、原始文件、结构文件和目录记录，文档不存在时返回 None"""
+    entry = catalog.find(doc_id)
+    if entry is None:
+        return None
+    deleted_count = get_vector_index().delete_document(entry["doc_name"])
+    catalog.delete(entry["doc_id"])
+    return entry, deleted_count
+
+
+def run_rebuild_job(options):
+    status = index_rebuilder.run(rebuild_structure_files())
+    if status["state"] != "succeeded":
+        raise RuntimeError(status.get("error") or "重建失败")
+
+
+def run_delete_document_job(options):
+    if delete_document_files(options["doc_id"]) is None:
+        raise ValueError(f"文档不存在: {options['doc_id']}")
+
+
+# 写入进程执行的非导入类任务
+WRITER_ACTIONS = {
+    REBUILD_INDEX: run_rebuild_job,
+    DELETE_INDEX: lambda options: delete_index(options["doc_name"]),
+    DELETE_DOCUMENT: run_delete_document_job,
+}
+
+# 文档目录（查询进程只读）
+catalog = get_catalog(read_only=QUERY_ROLE)
+# 写入进程在索引变化后发布只读快照
+snapshot_publisher = SnapshotPublisher() if SERVE_ROLE == "writer" else None
+# 后台导入任务队列和导入线程
+job_store = JobStore()
+ingest_workers = IngestionWorkerPool(job_store, build_ingest_options, workers=INGEST_WORKERS, results_dir=RESULTS_DIR,
+                                     actions=WRITER_ACTIONS,
+                                     on_change=snapshot_publisher.notify if snapshot_publisher else None)
+# 后台向量索引重建
+index_rebuilder = IndexRebuilder()
+# 启动预热：向量索引（查询进程为快照）、文档目录（同时补录目录之外写入的结构文件）、分词器和一次预热 embedding
+if QUERY_ROLE:
+    service_warmup = BackgroundWarmup(required=("snapshot", "catalog"), model=MODEL_NAME, vector_index=False,
+                                      snapshot=True, embedding=True)
+else:
+    service_warmup = BackgroundWarmup(model=MODEL_NAME, results_dir=RESULTS_DIR, upload_dir=UPLOAD_DIR, embedding=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 预热在后台进行，完成前 /readyz 返回 503，负载均衡只把流量转发给已预热的实例
+    service_warmup.start()
+    # 查询进程不执行任务，由写入进程领取
+    if not QUERY_ROLE:
+        ingest_workers.start()
+    yield
+    if not QUERY_ROLE:
+        ingest_workers.stop(timeout=5)
+
+
+app = FastAPI(title="PageIndex Retrieval API", lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz():
+    """存活探针：进程能响应请求即返回 ok"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探针：预热完成后返回 ok，否则返回 503（预热失败时重新开始预热）"""
+    if service_warmup.ready:
+        return {"status": "ok", "warmup": service_warmup.get_status()}
+    if service_warmup.get_status()["state"] == "failed":
+        service_warmup.start()
+    return JSONResponse(status_code=503, content={
+        "status": "error",
+        "message": "服务预热未完成",
+        "warmup": service_warmup.get_status()
+    })
 
 
 def load_document_structure(doc_name: str):
-    """加载文档的结构 JSON 文件"""
-    # 尝试多种可能的文件名格式
-    possible_names = [
-        f"{doc_name}_structure.json",
-        f"{doc_name.replace('.pdf', '')}_structure.json",
-        f"{doc_name.replace('.md', '')}_structure.json",
-    ]
-    
-    for name in possible_names:
-        path = os.path.join(RESULTS_DIR, name)
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+    """加载文档的结构 JSON 文件（按文档目录中记录的路径）"""
+    entry = catalog.find(doc_name, results_dir=RESULTS_DIR)
+    if entry and entry["structure_path"] and result_exists(entry["structure_path"]):
+        return load_result(entry["structure_path"])
     return None
 
 
 def get_document_file_path(doc_name: str):
-    """获取文档的原始文件路径"""
-    # 尝试多种可能的文件扩展名
-    for ext in ["", ".pdf", ".md", ".markdown"]:
-        path = os.path.join(UPLOAD_DIR, doc_name + ext)
-        if os.path.exists(path):
-            return path
-    
-    # 尝试不带扩展名的匹配
-    base_name = doc_name.replace("_structure.json", "")
-    for ext in ["", ".pdf", ".md", ".markdown"]:
-        path = os.path.join(UPLOAD_DIR, base_name + ext)
-        if os.path.exists(path):
-            return path
-    
+    """获取文档的原始文件路径（按文档目录中记录的路径）"""
+    entry = catalog.find(doc_name)
+    if entry and entry["source_path"] and os.path.exists(entry["source_path"]):
+        return entry["source_path"]
     return None
 
 
@@ -86,7 +184,7 @@ async def query_documents(request: QueryRequest):
     
     # 检查向量索引状态
     try:
-        vector_index = get_vector_index()
+        vector_index = get_search_index()
         stats = vector_index.get_stats()
         
         if stats["total_nodes"] == 0:
@@ -104,7 +202,7 @@ async def query_documents(request: QueryRequest):
     
     # 1. 向量检索（毫秒级，0 Token）
     try:
-        search_results = search_documents(q, top_k=top_k)
+        search_results = vector_index.search(q, top_k=top_k)
     except Exception as e:
         return {
             "answer": f"向量检索失败: {str(e)}",
@@ -141,7 +239,7 @@ async def query_documents(request: QueryRequest):
             thinking_parts.append(f"[{doc_name}] 未找到结构文件，跳过")
             continue
         
-        node_map = get_node_mapping(doc_data.get("structure", []))
+        node_map = DocumentTree.from_structure(doc_data.get("structure", []))
         doc_file_path = get_document_file_path(doc_name)
         
         for result in results:
@@ -157,8 +255,9 @@ async def query_documents(request: QueryRequest):
             node = node_map.get(node_id)
             if node:
                 # 优先使用节点中存储的文本
-                if node.get("text"):
-                    all_relevant_text += f"\n--- 文档: {doc_name}, 章节: {title} ---\n{node['text']}\n"
+                node_text = get_node_text(doc_data, node)
+                if node_text:
+                    all_relevant_text += f"\n--- 文档: {doc_name}, 章节: {title} ---\n{node_text}\n"
                 # 否则尝试从原始文件提取
                 elif doc_file_path and doc_file_path.lower().endswith(".pdf"):
                     try:
@@ -219,7 +318,7 @@ async def query_documents_raw(request: QueryRequest):
     
     # 检查向量索引状态
     try:
-        vector_index = get_vector_index()
+        vector_index = get_search_index()
         stats = vector_index.get_stats()
         
         if stats["total_nodes"] == 0:
@@ -237,7 +336,7 @@ async def query_documents_raw(request: QueryRequest):
     
     # 1. 向量检索（毫秒级，0 Token）
     try:
-        search_results = search_documents(q, top_k=top_k)
+        search_results = vector_index.search(q, top_k=top_k)
     except Exception as e:
         return {
             "status": "error",
@@ -279,7 +378,7 @@ async def query_documents_raw(request: QueryRequest):
                 })
             continue
         
-        node_map = get_node_mapping(doc_data.get("structure", []))
+        node_map = DocumentTree.from_structure(doc_data.get("structure", []))
         doc_file_path = get_document_file_path(doc_name)
         
         for result in results:
@@ -303,8 +402,9 @@ async def query_documents_raw(request: QueryRequest):
                 enriched_result["end_index"] = node.get("end_index")
                 
                 # 优先使用节点中存储的文本
-                if node.get("text"):
-                    enriched_result["text"] = node["text"]
+                node_text = get_node_text(doc_data, node)
+                if node_text:
+                    enriched_result["text"] = node_text
                 # 否则尝试从原始文件提取
                 elif doc_file_path and doc_file_path.lower().endswith(".pdf"):
                     try:
@@ -330,7 +430,7 @@ async def query_documents_raw(request: QueryRequest):
 async def get_index_stats():
     """获取向量索引统计信息"""
     try:
-        vector_index = get_vector_index()
+        vector_index = get_search_index()
         stats = vector_index.get_stats()
         return {
             "status": "ok",
@@ -345,44 +445,21 @@ async def get_index_stats():
 
 @app.post("/index/rebuild")
 async def rebuild_index():
-    """重建所有文档的向量索引"""
+    """在后台重建所有文档的向量索引，进度通过 GET /index/rebuild 查询"""
     try:
-        vector_index = get_vector_index()
-        
-        # 获取所有结构文件
-        if not os.path.exists(RESULTS_DIR):
-            return {"status": "error", "message": "results 目录不存在"}
-        
-        structure_files = [f for f in os.listdir(RESULTS_DIR) if f.endswith("_structure.json")]
+        if QUERY_ROLE:
+            job = job_store.create_action(REBUILD_INDEX, "index")
+            return {"status": "ok", "job_id": job["id"], "job": job}
+
+        # 获取所有已处理文档的结构文件
+        structure_files = rebuild_structure_files()
         
         if not structure_files:
             return {"status": "error", "message": "没有找到任何结构文件"}
         
-        rebuilt_count = 0
-        errors = []
-        
-        for filename in structure_files:
-            try:
-                filepath = os.path.join(RESULTS_DIR, filename)
-                with open(filepath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                
-                doc_name = data.get("doc_name", filename.replace("_structure.json", ""))
-                doc_description = data.get("doc_description", "")
-                structure = data.get("structure", [])
-                
-                node_count = vector_index.add_document(doc_name, structure, doc_description)
-                rebuilt_count += 1
-                print(f"已重建 {doc_name} 的索引，共 {node_count} 个节点")
-                
-            except Exception as e:
-                errors.append(f"{filename}: {str(e)}")
-        
-        return {
-            "status": "ok",
-            "rebuilt_documents": rebuilt_count,
-            "errors": errors if errors else None
-        }
+        if not index_rebuilder.start(structure_files):
+            return {"status": "error", "message": "已有重建任务在运行", "rebuild": index_rebuilder.get_status()}
+        return {"status": "ok", "rebuild": index_rebuilder.get_status()}
         
     except Exception as e:
         return {
@@ -391,12 +468,23 @@ async def rebuild_index():
         }
 
 
+@app.get("/index/rebuild")
+async def get_rebuild_status():
+    """查询向量索引重建进度（查询进程返回最近一次重建任务）"""
+    if QUERY_ROLE:
+        jobs = [job for job in job_store.list(limit=1000) if job["options"].get("action") == REBUILD_INDEX]
+        return {"status": "ok", "job": jobs[0] if jobs else None}
+    return {"status": "ok", "rebuild": index_rebuilder.get_status()}
+
+
 @app.delete("/index/{doc_name}")
 async def delete_document_index(doc_name: str):
     """删除指定文档的向量索引"""
     try:
-        vector_index = get_vector_index()
-        deleted_count = vector_index.delete_document(doc_name)
+        if QUERY_ROLE:
+            job = job_store.create_action(DELETE_INDEX, doc_name, {"doc_name": doc_name})
+            return {"status": "ok", "job_id": job["id"], "job": job}
+        deleted_count = delete_index(doc_name)
         return {
             "status": "ok",
             "deleted_nodes": deleted_count
@@ -408,6 +496,93 @@ async def delete_document_index(doc_name: str):
         }
 
 
+@app.post("/documents")
+async def upload_document(file: UploadFile = File(...), resume: bool = Form(False)):
+    """上传文档并加入后台导入队列，返回任务 ID"""
+    filename = os.path.basename(file.filename or "")
+    if not filename.lower().endswith(PDF_EXTENSIONS + MD_EXTENSIONS):
+        return {"status": "error", "message": "仅支持 PDF 和 Markdown 文件"}
+    # 每个任务的上传文件单独保存，同名文件不会覆盖仍在处理中的文件
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(UPLOAD_DIR, job_id)
+    try:
+        os.makedirs(job_dir)
+        file_path = os.path.join(job_dir, filename)
+        with open(file_path, "wb") as f:
+            while chunk := await file.read(1024 * 1024):
+                f.write(chunk)
+        job = job_store.create(file_path, filename, options={"resume": resume}, job_id=job_id, unique_output=True)
+        ingest_workers.notify()
+        return {"status": "ok", "job_id": job["id"], "job": job}
+    except JobConflict as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return {"status": "error", "message": str(e), "job_id": e.job_id}
+    except Exception as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+
+@app.get("/documents")
+async def list_documents(status: str = None):
+    """列出文档目录中的文档（默认只列出已处理完成的文档，status=all 时列出全部）"""
+    return {"status": "ok", "documents": catalog.list(status=None if status == "all" else status or "ready")}
+
+
+@app.get("/documents/{doc_id}")
+async def get_document(doc_id: str):
+    """按文档 ID 或文档名称查询文档"""
+    entry = catalog.find(doc_id)
+    if entry is None:
+        return {"status": "error", "message": f"文档不存在: {doc_id}"}
+    return {"status": "ok", "document": entry}
+
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """删除文档：原始文件、结构文件、向量索引和目录记录"""
+    try:
+        entry = catalog.find(doc_id)
+        if entry is None:
+            return {"status": "error", "message": f"文档不存在: {doc_id}"}
+        if QUERY_ROLE:
+            job = job_store.create_action(DELETE_DOCUMENT, entry["doc_id"], {"doc_id": entry["doc_id"]})
+            return {"status": "ok", "document": entry, "job_id": job["id"], "job": job}
+        entry, deleted_count = delete_document_files(entry["doc_id"])
+        return {"status": "ok", "document": entry, "deleted_nodes": deleted_count}
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+
+@app.get("/jobs")
+async def list_jobs(status: str = None, limit: int = Query(100, ge=1, le=1000)):
+    """列出导入任务"""
+    return {"status": "ok", "jobs": job_store.list(status=status, limit=limit)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询导入任务的状态和各阶段进度"""
+    job = job_store.get(job_id)
+    if job is None:
+        return {"status": "error", "message": f"任务不存在: {job_id}"}
+    return {"status": "ok", "job": job}
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消导入任务：排队中的任务立即取消，运行中的任务在当前阶段结束后停止"""
+    job = job_store.request_cancel(job_id)
+    if job is None:
+        return {"status": "error", "message": f"任务不存在: {job_id}"}
+    return {"status": "ok", "job": job}
+
+
 # 保留旧的 LLM 检索接口作为备选
 @app.post("/query/llm")
 async def query_documents_llm(request: QueryRequest):
@@ -418,27 +593,23 @@ async def query_documents_llm(request: QueryRequest):
     """
     q = request.q
     
-    # 1. 加载所有可用索引
-    if not os.path.exists(RESULTS_DIR):
-        return {"answer": "未找到任何索引文件，请先上传并处理文档。", "sources": [], "thinking": ""}
-    
-    available_indices = [f for f in os.listdir(RESULTS_DIR) if f.endswith("_structure.json")]
+    # 1. 加载所有可用索引（文档目录中已有文档名称和描述，不需要逐个解析结构文件）
+    documents = {
+        os.path.basename(entry["structure_path"]): entry for entry in catalog.list() if entry["structure_path"]
+    }
+    available_indices = list(documents)
     if not available_indices:
         return {"answer": "尚未处理任何文档。", "sources": [], "thinking": ""}
 
     # 2. 筛选相关文档
-    docs_info = []
-    for idx_file in available_indices:
-        try:
-            with open(os.path.join(RESULTS_DIR, idx_file), "r", encoding="utf-8") as f:
-                data = json.load(f)
-                docs_info.append({
-                    "filename": idx_file,
-                    "doc_name": data.get("doc_name", idx_file),
-                    "description": data.get("description", "无描述")
-                })
-        except Exception:
-            continue
+    docs_info = [
+        {
+            "filename": idx_file,
+            "doc_name": entry["doc_name"],
+            "description": entry["doc_description"] or "无描述"
+        }
+        for idx_file, entry in documents.items()
+    ]
     
     relevant_filenames = await select_relevant_docs_llm(q, docs_info, MODEL_NAME)
     
@@ -455,12 +626,12 @@ async def query_documents_llm(request: QueryRequest):
     total_thinking = ""
     
     for idx_file in relevant_filenames:
-        idx_path = os.path.join(RESULTS_DIR, idx_file)
-        if not os.path.exists(idx_path): continue
+        entry = documents.get(idx_file)
+        if entry is None or not result_exists(entry["structure_path"]): continue
+        idx_path = entry["structure_path"]
         
         try:
-            with open(idx_path, "r", encoding="utf-8") as f:
-                index_data = json.load(f)
+            index_data = load_result(idx_path)
         except Exception:
             continue
         
@@ -471,15 +642,9 @@ async def query_documents_llm(request: QueryRequest):
         if search_res.get('thinking'):
             total_thinking += f"**[{doc_display_name}]**: {search_res['thinking']}"
         
-        node_map = get_node_mapping(index_data['structure'])
+        node_map = DocumentTree.from_structure(index_data['structure'])
         
-        pdf_name = index_data.get('doc_name', idx_file.replace("_structure.json", ""))
-        pdf_path = os.path.join(UPLOAD_DIR, pdf_name)
-        if not os.path.exists(pdf_path):
-            for ext in [".pdf", ".md", ".markdown"]:
-                if os.path.exists(pdf_path + ext):
-                    pdf_path = pdf_path + ext
-                    break
+        pdf_path = entry["source_path"] or ""
 
         for node_id in search_res.get('node_list', []):
             if node_id in node_map:
@@ -488,8 +653,9 @@ async def query_documents_llm(request: QueryRequest):
                 start_p = node.get('start_index', '?')
                 all_reference_nodes.append(f"[{doc_display_name}] {title} (第{start_p}页)")
                 
-                if node.get('text'):
-                    all_relevant_text += f"--- 文档: {doc_display_name}, 章节: {title} ---{node['text']}"
+                node_text = get_node_text(index_data, node)
+                if node_text:
+                    all_relevant_text += f"--- 文档: {doc_display_name}, 章节: {title} ---{node_text}"
                 elif os.path.exists(pdf_path) and pdf_path.lower().endswith(".pdf"):
                     try:
                         page_text = get_text_of_pages(pdf_path, node['start_index'], node['end_index'], tag=False)
@@ -588,5 +754,53 @@ async def tree_search_llm(query, tree, model):
         return {"thinking": f"解析失败: {str(e)}", "node_list": []}
 
 
+def run_writer():
+    """多进程部署的写入进程：执行导入和索引维护任务，索引变化后发布只读快照"""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    catalog.sync(RESULTS_DIR, UPLOAD_DIR)
+    snapshot_publisher.start()
+    ingest_workers.start()
+    print("[writer] 写入进程已启动")
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingest_workers.stop(timeout=5)
+        snapshot_publisher.stop(timeout=5)
+
+
+def serve(host: str = "0.0.0.0", port: int = 8502, workers: int = API_WORKERS):
+    """
+    启动 API 服务
+
+    workers > 1 时启动一个写入进程（唯一打开 ChromaDB 的进程）和 workers 个只读查询进程，
+    查询进程从共享快照检索，快照更新后自动热加载
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    writer = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                              env=dict(os.environ, PAGEINDEX_SERVE_ROLE="writer"))
+    os.environ["PAGEINDEX_SERVE_ROLE"] = "query"
+    try:
+        uvicorn.run("api:app", host=host, port=port, workers=workers, app_dir=app_dir)
+    finally:
+        writer.terminate()
+        writer.wait(timeout=30)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8502)
+    if SERVE_ROLE == "writer":
+        run_writer()
+    else:
+        parser = argparse.ArgumentParser(description="PageIndex 检索 API 服务")
+        parser.add_argument("--host", type=str, default="0.0.0.0", help="监听地址")
+        parser.add_argument("--port", type=int, default=8502, help="监听端口")
+        parser.add_argument("--workers", type=int, default=API_WORKERS,
+                            help="API 工作进程数，大于 1 时使用一个写入进程加多个只读查询进程")
+        args = parser.parse_args()
+        serve(args.host, args.port, args.workers)
@@ -1,10 +1,14 @@
 import streamlit as st
 import os
 import json
+import time
 import asyncio
-from datetime import datetime
 from pageindex import page_index_main, config
 from pageindex.page_index_md import md_to_tree
+from pageindex.incremental import page_index_incremental
+from pageindex.tree import DocumentTree
+from pageindex.storage import load_result, get_node_text, result_exists, delete_result
+from pageindex.catalog import get_catalog, READY
 from pageindex.utils import ConfigLoader, ChatGPT_API, ChatGPT_API_async, get_text_of_pages, remove_fields
 from pageindex.vector_index import get_vector_index, search_documents, build_index_for_document
 import pandas as pd
@@ -64,62 +68,47 @@ def get_file_type(filename):
     }
     return type_map.get(ext, '未知类型')
 
-def get_uploaded_files_info(upload_dir):
-    """获取已上传文件的详细信息"""
+STATUS_LABELS = {'ready': '已完成', 'processing': '处理中', 'failed': '失败'}
+
+def get_uploaded_files_info(catalog):
+    """获取文档目录中文件的详细信息"""
     files_info = []
-    if os.path.exists(upload_dir):
-        for idx, filename in enumerate(os.listdir(upload_dir), 1):
-            filepath = os.path.join(upload_dir, filename)
-            if os.path.isfile(filepath):
-                stat = os.stat(filepath)
-                files_info.append({
-                    '序号': idx,
-                    '文件名': filename,
-                    '上传时间': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
-                    '文件大小': get_file_size_str(stat.st_size),
-                    '文件类型': get_file_type(filename)
-                })
+    for idx, entry in enumerate(catalog.list(status=None), 1):
+        source_path = entry['source_path']
+        filename = os.path.basename(source_path) if source_path else entry['doc_id']
+        size = os.path.getsize(source_path) if source_path and os.path.exists(source_path) else None
+        files_info.append({
+            '序号': idx,
+            '文件名': filename,
+            '上传时间': entry['created_at'].replace('T', ' '),
+            '文件大小': get_file_size_str(size) if size is not None else '-',
+            '文件类型': get_file_type(source_path or entry['doc_name']),
+            '状态': STATUS_LABELS.get(entry['status'], entry['status'])
+        })
     return files_info
 
-def check_duplicate_files(uploaded_files, upload_dir):
-    """检测重复文件"""
+def check_duplicate_files(uploaded_files, catalog):
+    """检测重复文件（与已有文档的结构文件同名）"""
     duplicates = []
-    if os.path.exists(upload_dir):
-        existing_files = set(os.listdir(upload_dir))
-        for uploaded_file in uploaded_files:
-            if uploaded_file.name in existing_files:
-                duplicates.append(uploaded_file.name)
+    for uploaded_file in uploaded_files:
+        if catalog.get(os.path.splitext(uploaded_file.name)[0]) is not None:
+            duplicates.append(uploaded_file.name)
     return duplicates
 
 
-def get_node_mapping(structure, mapping=None):
-    """从树结构中构建 node_id 到节点的映射"""
-    if mapping is None: 
-        mapping = {}
-    if isinstance(structure, list):
-        for item in structure:
-            get_node_mapping(item, mapping)
-    elif isinstance(structure, dict):
-        if 'node_id' in structure:
-            mapping[structure['node_id']] = structure
-        if 'nodes' in structure:
-            get_node_mapping(structure['nodes'], mapping)
-    return mapping
+@st.cache_resource
+def load_catalog(results_dir: str, upload_dir: str):
+    """打开文档目录，并补录目录之外写入的结构文件（每个进程一次）"""
+    catalog = get_catalog()
+    catalog.sync(results_dir, upload_dir)
+    return catalog
 
 
 def load_document_structure(doc_name: str, results_dir: str):
-    """加载文档的结构 JSON 文件"""
-    possible_names = [
-        f"{doc_name}_structure.json",
-        f"{doc_name.replace('.pdf', '')}_structure.json",
-        f"{doc_name.replace('.md', '')}_structure.json",
-    ]
-    
-    for name in possible_names:
-        path = os.path.join(results_dir, name)
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+    """加载文档的结构 JSON 文件（按文档目录中记录的路径）"""
+    entry = load_catalog(results_dir, upload_dir).find(doc_name, results_dir=results_dir)
+    if entry and entry['structure_path'] and result_exists(entry['structure_path']):
+        return load_result(entry['structure_path'])
     return None
 
 
@@ -262,6 +251,7 @@ upload_dir = "uploads"
 results_dir = "results"
 os.makedirs(upload_dir, exist_ok=True)
 os.makedirs(results_dir, exist_ok=True)
+catalog = load_catalog(results_dir, upload_dir)
 
 # 选项卡 1: 文档处理
 with tab1:
@@ -275,7 +265,7 @@ with tab1:
 
     # 重复文件检测
     if uploaded_files:
-        duplicates = check_duplicate_files(uploaded_files, upload_dir)
+        duplicates = check_duplicate_files(uploaded_files, catalog)
         if duplicates:
             st.warning(f"⚠️ 检测到重复文件！以下文件已存在于上传目录中：\n\n**{', '.join(duplicates)}**\n\n继续处理将覆盖原有文件。")
 
@@ -299,6 +289,8 @@ with tab1:
                     # 重置进度条为0
                     progress_bar.progress(0.0)
                     
+                    file_base_name = os.path.splitext(uploaded_file.name)[0]
+                    result_file_path = os.path.join(results_dir, f"{file_base_name}_structure.json")
                     try:
                         # 阶段1: 保存文件 (10%)
                         progress_bar.progress(0.1)
@@ -308,7 +300,10 @@ with tab1:
                         
                         # 阶段2: 开始处理 (20%)
                         progress_bar.progress(0.2)
+                        start_time = time.perf_counter()
+                        catalog.mark_processing(result_file_path, file_path, display_name=uploaded_file.name)
                         result = None
+                        diff_report = None
                         if file_extension == ".pdf":
                             # 阶段3: PDF解析中 (40%)
                             progress_bar.progress(0.4)
@@ -323,7 +318,14 @@ with tab1:
                                 if_add_node_text=if_add_node_text,
                                 if_build_vector_index="yes"  # 自动构建向量索引
                             )
-                            result = page_index_main(file_path, opt)
+                            previous_result = None
+                            if result_exists(result_file_path):
+                                previous_result = load_result(result_file_path, with_text=True)
+                            if previous_result and previous_result.get("page_hashes"):
+                                # 同名文档的新版本：只重新处理变化的页面
+                                result, diff_report = page_index_incremental(file_path, previous_result, opt)
+                            else:
+                                result = page_index_main(file_path, opt)
                         elif file_extension in [".md", ".markdown"]:
                             # 阶段3: Markdown解析中 (40%)
                             progress_bar.progress(0.4)
@@ -344,18 +346,26 @@ with tab1:
                         if result:
                             # 阶段5: 保存结果 (90%)
                             progress_bar.progress(0.9)
-                            file_base_name = os.path.splitext(uploaded_file.name)[0]
-                            result_file_path = os.path.join(results_dir, f"{file_base_name}_structure.json")
-                            with open(result_file_path, "w", encoding="utf-8") as f:
-                                json.dump(result, f, indent=2, ensure_ascii=False)
+                            catalog.save_document(result, result_file_path, source_path=file_path,
+                                                  seconds=time.perf_counter() - start_time,
+                                                  display_name=uploaded_file.name)
                             
                             # 阶段6: 完成 (100%)
                             progress_bar.progress(1.0)
                             with all_results_container:
                                 with st.expander(f"✅ {uploaded_file.name} 处理成功", expanded=False):
                                     st.info(f"JSON 已自动保存至: {result_file_path}")
+                                    if diff_report:
+                                        if diff_report.get("mode") == "incremental":
+                                            st.success(
+                                                f"增量更新：{len(diff_report.get('changed_pages', []))} 个变化页面，"
+                                                f"复用 {diff_report.get('reused_nodes', 0)} 个节点，"
+                                                f"更新 {len(diff_report.get('updated_nodes', []))} 个节点"
+                                            )
+                                        st.json(diff_report, expanded=False)
                                     st.json(result)
                     except Exception as e:
+                        catalog.mark_failed(result_file_path, f"{type(e).__name__}: {e}")
                         progress_bar.progress(1.0)
                         with all_results_container:
                             st.error(f"❌ {uploaded_file.name} 处理出错: {str(e)}")
@@ -367,7 +377,7 @@ with tab1:
 
     # 文件详细清单
     st.markdown("---")
-    files_info = get_uploaded_files_info(upload_dir)
+    files_info = get_uploaded_files_info(catalog)
     
     # 标题和删除按钮在同一行
     col_title, col_btn = st.columns([4, 1])
@@ -393,22 +403,24 @@ with tab1:
                 
                 for filename, selected in st.session_state.selected_files.items():
                     if selected:
-                        # 删除原始文件
-                        file_path = os.path.join(upload_dir, filename)
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                        
-                        # 删除对应的索引 JSON 文件
                         file_base_name = os.path.splitext(filename)[0]
-                        json_path = os.path.join(results_dir, f"{file_base_name}_structure.json")
-                        if os.path.exists(json_path):
-                            os.remove(json_path)
+                        entry = catalog.get(file_base_name) or catalog.get(filename)
+                        doc_name = entry['doc_name'] if entry else file_base_name
                         
                         # 删除向量索引
                         try:
-                            vector_index.delete_document(file_base_name)
+                            vector_index.delete_document(doc_name)
                         except Exception as e:
-                            st.warning(f"删除 {file_base_name} 的向量索引失败: {e}")
+                            st.warning(f"删除 {doc_name} 的向量索引失败: {e}")
+                        
+                        # 删除原始文件、索引 JSON 文件和目录记录
+                        if entry:
+                            catalog.delete(entry['doc_id'])
+                        else:
+                            file_path = os.path.join(upload_dir, filename)
+                            if os.path.exists(file_path):
+                                os.remove(file_path)
+                            delete_result(os.path.join(results_dir, f"{file_base_name}_structure.json"))
                         
                         deleted_files.append(filename)
                 
@@ -442,8 +454,9 @@ with tab1:
                 "上传时间": st.column_config.TextColumn("上传时间", width="medium"),
                 "文件大小": st.column_config.TextColumn("大小", width="small"),
                 "文件类型": st.column_config.TextColumn("类型", width="small"),
+                "状态": st.column_config.TextColumn("状态", width="small"),
             },
-            disabled=["序号", "文件名", "上传时间", "文件大小", "文件类型"],
+            disabled=["序号", "文件名", "上传时间", "文件大小", "文件类型", "状态"],
             hide_index=True,
             use_container_width=True,
             height=table_height,
@@ -544,7 +557,7 @@ with tab2:
                                 thinking_parts.append(f"[{doc_name}] 未找到结构文件")
                                 continue
                             
-                            node_map = get_node_mapping(doc_data.get("structure", []))
+                            node_map = DocumentTree.from_structure(doc_data.get("structure", []))
                             
                             for result in results:
                                 node_id = result["node_id"]
@@ -554,8 +567,9 @@ with tab2:
                                 all_reference_nodes.append(f"[{doc_name}] {title} (相似度: {score:.3f})")
                                 
                                 node = node_map.get(node_id)
-                                if node and node.get("text"):
-                                    all_relevant_text += f"\n--- 文档: {doc_name}, 章节: {title} ---\n{node['text']}\n"
+                                node_text = get_node_text(doc_data, node) if node else ""
+                                if node_text:
+                                    all_relevant_text += f"\n--- 文档: {doc_name}, 章节: {title} ---\n{node_text}\n"
                                 elif result.get("summary"):
                                     all_relevant_text += f"\n--- 文档: {doc_name}, 章节: {title} (摘要) ---\n{result['summary']}\n"
                         
@@ -634,31 +648,30 @@ with tab3:
                 try:
                     vector_index = get_vector_index()
                     
-                    structure_files = [f for f in os.listdir(results_dir) if f.endswith("_structure.json")]
+                    documents = [entry for entry in catalog.list(status=READY) if entry['structure_path']]
                     
-                    if not structure_files:
+                    if not documents:
                         st.warning("没有找到任何结构文件")
                     else:
                         progress = st.progress(0)
                         rebuilt_count = 0
                         
-                        for i, filename in enumerate(structure_files):
+                        for i, entry in enumerate(documents):
                             try:
-                                filepath = os.path.join(results_dir, filename)
-                                with open(filepath, "r", encoding="utf-8") as f:
-                                    data = json.load(f)
+                                data = load_result(entry['structure_path'])
                                 
-                                doc_name = data.get("doc_name", filename.replace("_structure.json", ""))
+                                doc_name = data.get("doc_name", entry['doc_name'])
                                 doc_description = data.get("doc_description", "")
                                 structure = data.get("structure", [])
                                 
                                 node_count = vector_index.add_document(doc_name, structure, doc_description)
+                                catalog.mark_indexed({doc_name: node_count})
                                 rebuilt_count += 1
                                 
                             except Exception as e:
-                                st.warning(f"重建 {filename} 失败: {e}")
+                                st.warning(f"重建 {entry['doc_id']} 失败: {e}")
                             
-                            progress.progress((i + 1) / len(structure_files))
+                            progress.progress((i + 1) / len(documents))
                         
                         st.success(f"✅ 索引重建完成！共处理 {rebuilt_count} 个文档")
                         st.rerun()
@@ -674,6 +687,7 @@ with tab3:
                 
                 for doc in docs:
                     vector_index.delete_document(doc)
+                    catalog.mark_unindexed(doc)
                 
                 st.success(f"✅ 已清空 {len(docs)} 个文档的索引")
                 st.rerun()
@@ -0,0 +1,114 @@
+"""
+导入耗时基准脚本
+
+在独立的子进程中多次导入各模块，统计导入耗时（中位数，不含解释器启动），并检查导入后是否已经加载了
+应当延迟导入的重量级依赖（openai、tiktoken、PDF 解析库、chromadb 等）。
+超过阈值或提前加载了重量级依赖时以非零状态退出，可以放在 CI 中防止启动时间退化。
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+DEFAULT_MODULES = [
+    "pageindex",
+    "pageindex.storage",
+    "pageindex.tree",
+    "pageindex.catalog",
+    "pageindex.jobs",
+    "pageindex.batch",
+    "pageindex.vector_index",
+    "pageindex.snapshot",
+]
+
+# 导入 pageindex 时不应加载的依赖
+HEAVY_MODULES = ["openai", "tiktoken", "PyPDF2", "pymupdf", "yaml", "chromadb"]
+
+_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, repeat: int = 5) -> dict:
+    """
+    在子进程中导入模块 repeat 次
+
+    返回:
+        {"module", "median_ms", "min_ms", "heavy_loaded"}
+    """
+    samples = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["seconds"] * 1000)
+        loaded.update(result["loaded"])
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(samples), 1),
+        "min_ms": round(min(samples), 1),
+        "heavy_loaded": sorted(loaded),
+    }
+
+
+def slowest_imports(module: str, top: int = 10) -> list:
+    """用 -X importtime 找出导入该模块时累计耗时最长的子模块"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def run_benchmark(modules=None, repeat: int = 5, max_ms: float = None, verbose: bool = False) -> bool:
+    """
+    运行基准并打印结果
+
+    参数:
+        modules: 要测量的模块，默认为 DEFAULT_MODULES
+        repeat: 每个模块的导入次数
+        max_ms: 导入耗时中位数的上限（毫秒），None 表示不检查
+        verbose: 是否打印每个模块最慢的子模块
+
+    返回:
+        是否全部通过
+    """
+    passed = True
+    print(f"{'模块':<28}{'中位数(ms)':>12}{'最小(ms)':>10}  提前加载的依赖")
+    for module in modules or DEFAULT_MODULES:
+        result = measure_import(module, repeat)
+        too_slow = max_ms is not None and result["median_ms"] > max_ms
+        failed = too_slow or bool(result["heavy_loaded"])
+        passed = passed and not failed
+        print(f"{module:<28}{result['median_ms']:>12}{result['min_ms']:>10}  "
+              f"{', '.join(result['heavy_loaded']) or '-'}{'  ❌' if failed else ''}")
+        if verbose:
+            for cumulative, name in slowest_imports(module):
+                print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+    print("\n✅ 通过" if passed else "\n❌ 未通过：导入耗时超过阈值或提前加载了重量级依赖")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="测量 pageindex 各模块的导入耗时")
+    parser.add_argument("modules", nargs="*", help="要测量的模块（默认测量主要模块）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块的导入次数")
+    parser.add_argument("--max-ms", type=float, default=None, help="导入耗时中位数上限（毫秒），超过时以非零状态退出")
+    parser.add_argument("--verbose", action="store_true", help="打印最慢的子模块")
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.modules, args.repeat, args.max_ms, args.verbose) else 1)
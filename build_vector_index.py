@@ -2,83 +2,165 @@
 批量构建向量索引脚本
 
 遍历 results 文件夹中的所有 JSON 结构文件，为每个文档构建向量索引。
+多个文档并行处理（embedding 走批量接口），处理结果记录在清单文件中（文件、内容哈希、索引时间、节点数），
+再次运行时跳过内容未变化且仍在索引中的文件，因此中断后重新运行即可从未完成的文档继续。
 """
 
 import os
 import json
 import time
-from pageindex.vector_index import get_vector_index
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pageindex.vector_index import get_vector_index, load_structure_file, INDEX_REBUILD_WORKERS
+from pageindex.storage import list_result_files, resolve_result_path
+from pageindex.catalog import get_catalog
 
 RESULTS_DIR = "results"
+MANIFEST_NAME = ".index_manifest.json"
 
 
-def build_all_indexes(doc_delay: float = 1.0):
-    """遍历 results 文件夹，为所有文档构建向量索引"""
-    
+def file_hash(path: str) -> str:
+    """计算文件内容的 SHA-256 哈希"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class IndexManifest:
+    """
+    索引清单：记录每个结构文件的内容哈希、索引时间和节点数，每处理完一个文档立即保存
+
+    参数:
+        path: 清单文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, filename: str):
+        with self._lock:
+            return self.entries.get(filename)
+
+    def record(self, filename: str, content_hash: str, doc_name: str, node_count: int):
+        with self._lock:
+            self.entries[filename] = {
+                "file": filename,
+                "content_hash": content_hash,
+                "doc_name": doc_name,
+                "indexed_at": datetime.now().isoformat(timespec="seconds"),
+                "node_count": node_count,
+            }
+            # 先写临时文件再替换，中断时不会留下不完整的清单
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.entries}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+def _build_one(vector_index, manifest: IndexManifest, filepath: str, force: bool):
+    """处理一个结构文件，返回 (状态, 节点数, 新生成的 embedding 数, 说明)"""
+    filename = os.path.basename(filepath)
+    content_hash = file_hash(resolve_result_path(filepath))
+    entry = manifest.get(filename)
+    if (not force and entry and entry["content_hash"] == content_hash
+            and vector_index.get_document_node_count(entry["doc_name"]) == entry["node_count"]):
+        return "skipped", entry["node_count"], 0, "内容未变化"
+
+    doc_name, structure, doc_description = load_structure_file(filepath)
+    if not structure:
+        return "empty", 0, 0, "结构为空"
+
+    # 复用索引中文本未变化的节点的 embedding（包括上次中断前已写入的文档）
+    result = vector_index.update_document(doc_name, structure, doc_description)
+    manifest.record(filename, content_hash, doc_name, result["nodes"])
+    get_catalog().mark_indexed({doc_name: result["nodes"]})
+    return "indexed", result["nodes"], result["embedded"], f"复用 {result['reused']} 个 embedding"
+
+
+def build_all_indexes(workers: int = INDEX_REBUILD_WORKERS, force: bool = False, results_dir: str = RESULTS_DIR,
+                      manifest_path: str = None):
+    """
+    遍历 results 文件夹，为所有文档构建向量索引
+
+    参数:
+        workers: 并行处理的文档数
+        force: 忽略清单，重新处理所有文件
+        results_dir: 结构文件目录
+        manifest_path: 清单文件路径，默认为 <results_dir>/.index_manifest.json
+    """
+
     # 检查 results 目录是否存在
-    if not os.path.exists(RESULTS_DIR):
-        print(f"错误: {RESULTS_DIR} 目录不存在")
+    if not os.path.exists(results_dir):
+        print(f"错误: {results_dir} 目录不存在")
         return
-    
+
     # 获取所有 JSON 结构文件
-    structure_files = [f for f in os.listdir(RESULTS_DIR) if f.endswith("_structure.json")]
-    
+    structure_files = list_result_files(results_dir)
+
     if not structure_files:
-        print(f"在 {RESULTS_DIR} 目录中没有找到任何结构文件")
+        print(f"在 {results_dir} 目录中没有找到任何结构文件")
         return
-    
-    print(f"找到 {len(structure_files)} 个结构文件，开始构建向量索引...\n")
-    
+
+    print(f"找到 {len(structure_files)} 个结构文件，开始构建向量索引（{workers} 个并行）...\n")
+
     # 获取向量索引实例
     vector_index = get_vector_index()
-    
-    success_count = 0
-    error_count = 0
+    manifest = IndexManifest(manifest_path or os.path.join(results_dir, MANIFEST_NAME))
+
+    counts = {"indexed": 0, "skipped": 0, "empty": 0, "failed": 0}
+    total_nodes = 0
+    total_embedded = 0
     errors = []
-    
-    for i, filename in enumerate(structure_files, 1):
-        filepath = os.path.join(RESULTS_DIR, filename)
-        print(f"[{i}/{len(structure_files)}] 正在处理: {filename}")
-        
-        try:
-            # 读取结构文件
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            # 提取文档信息
-            doc_name = data.get("doc_name", filename.replace("_structure.json", ""))
-            doc_description = data.get("doc_description", "")
-            structure = data.get("structure", [])
-            
-            if not structure:
-                print(f"  ⚠️ 跳过: 结构为空")
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(_build_one, vector_index, manifest, os.path.join(results_dir, filename), force): filename
+            for filename in structure_files
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            try:
+                status, node_count, embedded, note = future.result()
+            except Exception as e:
+                counts["failed"] += 1
+                errors.append(f"{filename}: {str(e)}")
+                print(f"[{i}/{len(structure_files)}] ❌ {filename} 失败: {str(e)}")
                 continue
-            
-            # 构建向量索引
-            node_count = vector_index.add_document(doc_name, structure, doc_description)
-            print(f"  ✅ 成功: 添加了 {node_count} 个节点")
-            success_count += 1
-            
-            # 文档之间添加延迟，避免连接池问题
-            if i < len(structure_files):
-                time.sleep(doc_delay)
-            
-        except Exception as e:
-            print(f"  ❌ 失败: {str(e)}")
-            errors.append(f"{filename}: {str(e)}")
-            error_count += 1
-    
+            counts[status] += 1
+            if status == "indexed":
+                total_nodes += node_count
+                total_embedded += embedded
+                print(f"[{i}/{len(structure_files)}] ✅ {filename}: {node_count} 个节点（{note}）")
+            else:
+                print(f"[{i}/{len(structure_files)}] ⏭️ {filename}: 跳过（{note}）")
+
+    elapsed = max(time.perf_counter() - start, 1e-6)
+
     # 打印统计信息
     print("\n" + "=" * 50)
     print("构建完成!")
-    print(f"成功: {success_count} 个文档")
-    print(f"失败: {error_count} 个文档")
-    
+    print(f"成功: {counts['indexed']} 个文档")
+    print(f"跳过: {counts['skipped']} 个未变化, {counts['empty']} 个结构为空")
+    print(f"失败: {counts['failed']} 个文档")
+    print(f"耗时: {elapsed:.1f}s, {total_nodes / elapsed:.1f} 节点/s, {total_embedded / elapsed:.1f} embedding/s")
+
     if errors:
         print("\n失败详情:")
         for error in errors:
             print(f"  - {error}")
-    
+
     # 显示索引统计
     stats = vector_index.get_stats()
     print(f"\n向量索引统计:")
@@ -87,4 +169,9 @@ def build_all_indexes(doc_delay: float = 1.0):
 
 
 if __name__ == "__main__":
-    build_all_indexes()
+    parser = argparse.ArgumentParser(description="为 results 目录中的结构文件批量构建向量索引")
+    parser.add_argument("--workers", type=int, default=INDEX_REBUILD_WORKERS, help="并行处理的文档数")
+    parser.add_argument("--force", action="store_true", help="忽略清单，重新处理所有文件")
+    parser.add_argument("--results-dir", type=str, default=RESULTS_DIR, help="结构文件目录")
+    args = parser.parse_args()
+    build_all_indexes(workers=args.workers, force=args.force, results_dir=args.results_dir)
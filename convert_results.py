@@ -0,0 +1,90 @@
+"""
+结果格式转换脚本
+
+把 results 文件夹中已有的结构文件转换为指定格式（msgpack 或 JSON），可同时拆分或内嵌节点文本，
+转换后重建结果目录清单，并打印文件大小和加载耗时的对比。
+"""
+
+import os
+import time
+import argparse
+from pageindex.storage import (list_result_files, resolve_result_path, load_result, save_result, load_manifest,
+                               FORMAT_EXTENSIONS)
+from pageindex.catalog import get_catalog
+
+RESULTS_DIR = "results"
+
+
+def _timed_load(path: str) -> float:
+    start = time.perf_counter()
+    load_result(path)
+    return time.perf_counter() - start
+
+
+def _total_size(path: str) -> int:
+    # 骨架加上引用的文本文件
+    actual_path = resolve_result_path(path)
+    size = os.path.getsize(actual_path)
+    text_file = load_result(path).get("text_file")
+    if text_file and os.path.exists(text_file):
+        size += os.path.getsize(text_file)
+    return size
+
+
+def convert_results(fmt: str = "msgpack", results_dir: str = RESULTS_DIR, split_text: bool = None):
+    """
+    转换结果目录中的所有结构文件
+
+    参数:
+        fmt: 目标格式，"msgpack" 或 "json"
+        results_dir: 结构文件目录
+        split_text: 是否拆分保存节点文本，默认由环境变量 PAGEINDEX_SPLIT_TEXT 决定
+    """
+    names = list_result_files(results_dir)
+    if not names:
+        print(f"在 {results_dir} 目录中没有找到任何结构文件")
+        return
+
+    print(f"找到 {len(names)} 个结构文件，转换为 {fmt} 格式...\n")
+    before_size = after_size = 0
+    before_load = after_load = 0.0
+    errors = []
+    for i, name in enumerate(names, 1):
+        path = os.path.join(results_dir, name)
+        try:
+            before_size += _total_size(path)
+            before_load += _timed_load(path)
+            result = load_result(path, with_text=True)
+            save_result(result, path, split_text=split_text, fmt=fmt)
+            after_size += _total_size(path)
+            after_load += _timed_load(path)
+            print(f"[{i}/{len(names)}] ✅ {name}")
+        except Exception as e:
+            errors.append(f"{name}: {str(e)}")
+            print(f"[{i}/{len(names)}] ❌ {name} 失败: {str(e)}")
+
+    manifest = load_manifest(results_dir)
+    # 结构文件已替换，同步文档目录中的路径和哈希
+    get_catalog().sync(results_dir)
+
+    print("\n" + "=" * 50)
+    print("转换完成!")
+    print(f"成功: {len(names) - len(errors)} 个文件, 失败: {len(errors)} 个文件")
+    print(f"文件大小: {before_size / 1024:.1f} KB -> {after_size / 1024:.1f} KB")
+    print(f"加载耗时: {before_load * 1000:.1f} ms -> {after_load * 1000:.1f} ms")
+    print(f"清单条目: {len(manifest)}")
+    if errors:
+        print("\n失败详情:")
+        for error in errors:
+            print(f"  - {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="转换 results 目录中结构文件的保存格式")
+    parser.add_argument("--to", type=str, default="msgpack", choices=sorted(FORMAT_EXTENSIONS), help="目标格式")
+    parser.add_argument("--results-dir", type=str, default=RESULTS_DIR, help="结构文件目录")
+    parser.add_argument("--split-text", type=str, default=None, choices=["yes", "no"],
+                        help="是否拆分保存节点文本（默认由 PAGEINDEX_SPLIT_TEXT 决定）")
+    args = parser.parse_args()
+    split_text = None if args.split_text is None else args.split_text == "yes"
+    convert_results(fmt=args.to, results_dir=args.results_dir, split_text=split_text)
@@ -0,0 +1,224 @@
+"""
+PageIndex 批量导入模块
+
+一次处理一个目录或通配符匹配到的多个文档：所有文档在同一个事件循环中并发处理，
+共用 LLM 客户端连接池、全局并发限制和缓存；PDF 解析（CPU 密集）交给进程池；
+按文件大小从大到小调度，减少末尾只剩一个大文档在跑的情况；内容相同的文件只处理一次；
+最后输出包含每个文档耗时的汇总报告。
+"""
+
+import os
+import glob
+import json
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from .utils import PdfDocument, close_async_openai_clients
+from .page_index import page_index_main_async
+from .page_index_md import md_to_tree
+from .catalog import get_catalog, file_hash
+
+PDF_EXTENSIONS = (".pdf",)
+MD_EXTENSIONS = (".md", ".markdown")
+
+
+def discover_documents(inputs: Iterable[str]) -> List[str]:
+    """
+    展开输入路径：目录（递归查找 PDF 和 Markdown）、通配符或单个文件
+
+    返回:
+        去重后的文件路径列表
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in sorted(files))
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            paths.append(item)
+
+    seen = set()
+    documents = []
+    for path in paths:
+        key = os.path.abspath(path)
+        if key in seen or not os.path.isfile(path) or not path.lower().endswith(PDF_EXTENSIONS + MD_EXTENSIONS):
+            continue
+        seen.add(key)
+        documents.append(path)
+    return documents
+
+
+def deduplicate_documents(paths: Iterable[str]):
+    """
+    按文件内容哈希去重（同一文档的多个副本并发处理会争用同一个检查点目录，也会重复调用模型）
+
+    返回:
+        (需要处理的路径列表, {重复文件路径: 保留的路径})
+    """
+    unique = []
+    duplicates = {}
+    kept = {}
+    for path in paths:
+        content_hash = file_hash(path)
+        if content_hash in kept:
+            duplicates[path] = kept[content_hash]
+            continue
+        kept[content_hash] = path
+        unique.append(path)
+    return unique, duplicates
+
+
+def _parse_pdf(path: str, model: str = "gpt-4o-2024-11-20") -> List[tuple]:
+    """在解析进程中提取每页文本和 token 数"""
+    with PdfDocument.open(path) as pdf:
+        return pdf.page_tokens(model=model)
+
+
+class BatchIngestor:
+    """
+    批量导入
+
+    参数:
+        opt: 处理配置（与 page_index_main 相同）
+        workers: 同时处理的文档数
+        parse_processes: PDF 解析进程数，默认与 workers 相同
+        output_dir: 结果目录，每个文档保存为 <文档名>_structure.json
+        md_options: Markdown 文档的额外参数（if_thinning、min_token_threshold、summary_token_threshold）
+    """
+
+    def __init__(self, opt, workers: int = 4, parse_processes: Optional[int] = None, output_dir: str = "./results",
+                 md_options: Optional[Dict[str, Any]] = None):
+        self.opt = opt
+        self.workers = max(1, workers)
+        self.parse_processes = max(1, parse_processes or self.workers)
+        self.output_dir = output_dir
+        self.md_options = md_options or {}
+
+    def output_path(self, path: str) -> str:
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.output_dir, f"{name}_structure.json")
+
+    async def _process_pdf(self, path: str, pool: ProcessPoolExecutor, timing: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        page_list = await loop.run_in_executor(pool, _parse_pdf, path, self.opt.model)
+        timing["parse_seconds"] = round(time.perf_counter() - start, 3)
+        timing["pages"] = len(page_list)
+        return await page_index_main_async(path, self.opt, page_list=page_list)
+
+    async def _process_md(self, path: str) -> Dict[str, Any]:
+        opt = self.opt
+        return await md_to_tree(
+            md_path=path,
+            if_thinning=self.md_options.get("if_thinning", False),
+            min_token_threshold=self.md_options.get("min_token_threshold", 5000),
+            if_add_node_summary=opt.if_add_node_summary,
+            summary_token_threshold=self.md_options.get("summary_token_threshold", 200),
+            model=opt.model,
+            if_add_doc_description=opt.if_add_doc_description,
+            if_add_node_text=opt.if_add_node_text,
+            if_add_node_id=opt.if_add_node_id,
+            if_build_vector_index=getattr(opt, "if_build_vector_index", "yes"),
+        )
+
+    async def _process(self, path: str, semaphore: asyncio.Semaphore, pool: ProcessPoolExecutor) -> Dict[str, Any]:
+        timing = {"path": path, "size_bytes": os.path.getsize(path)}
+        async with semaphore:
+            print(f"[batch] 开始处理 {path}")
+            start = time.perf_counter()
+            try:
+                if path.lower().endswith(PDF_EXTENSIONS):
+                    result = await self._process_pdf(path, pool, timing)
+                else:
+                    result = await self._process_md(path)
+                output_file = self.output_path(path)
+                get_catalog().save_document(result, output_file, source_path=path, seconds=time.perf_counter() - start)
+                timing.update({
+                    "status": "ok",
+                    "output": output_file,
+                    "llm_tokens": result.get("llm_metrics", {}).get("total", {}).get("total_tokens"),
+                })
+            except Exception as e:
+                timing.update({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+            timing["seconds"] = round(time.perf_counter() - start, 3)
+            print(f"[batch] {path}: {timing['status']} ({timing['seconds']}s)")
+            return timing
+
+    async def run_async(self, paths: List[str]) -> Dict[str, Any]:
+        """并发处理文档并返回汇总报告"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths, duplicates = deduplicate_documents(paths)
+        for path, original in duplicates.items():
+            print(f"[batch] 跳过 {path}：与 {original} 内容相同")
+        # 大文档先开始，避免最后只剩一个大文档串行处理
+        ordered = sorted(paths, key=os.path.getsize, reverse=True)
+        semaphore = asyncio.Semaphore(self.workers)
+        start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=self.parse_processes) as pool:
+                documents = await asyncio.gather(*[self._process(path, semaphore, pool) for path in ordered])
+        finally:
+            await close_async_openai_clients()
+
+        wall_seconds = round(time.perf_counter() - start, 3)
+        succeeded = [doc for doc in documents if doc["status"] == "ok"]
+        return {
+            "documents": documents,
+            "duplicates": [{"path": path, "duplicate_of": original} for path, original in duplicates.items()],
+            "summary": {
+                "total": len(documents),
+                "succeeded": len(succeeded),
+                "failed": len(documents) - len(succeeded),
+                "duplicates": len(duplicates),
+                "workers": self.workers,
+                "wall_seconds": wall_seconds,
+                "document_seconds": round(sum(doc["seconds"] for doc in documents), 3),
+                "llm_tokens": sum(doc.get("llm_tokens") or 0 for doc in succeeded),
+            },
+        }
+
+    def run(self, paths: List[str], report_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        处理文档并保存汇总报告
+
+        参数:
+            paths: 文档路径列表（可先用 discover_documents 展开）
+            report_path: 报告路径，默认为 <output_dir>/batch_report.json
+        """
+        report = asyncio.run(self.run_async(paths))
+        report_path = report_path or os.path.join(self.output_dir, "batch_report.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        summary = report["summary"]
+        print(f"[batch] 完成 {summary['succeeded']}/{summary['total']} 个文档，耗时 {summary['wall_seconds']}s，报告: {report_path}")
+        return report
+
+
+def ingest_documents(inputs: Iterable[str], opt, workers: int = 4, parse_processes: Optional[int] = None,
+                     output_dir: str = "./results", report_path: Optional[str] = None,
+                     md_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    批量导入目录或通配符匹配到的文档
+
+    参数:
+        inputs: 目录、通配符或文件路径
+        opt: 处理配置（与 page_index_main 相同）
+        workers: 同时处理的文档数
+        parse_processes: PDF 解析进程数
+        output_dir: 结果目录
+        report_path: 汇总报告路径
+        md_options: Markdown 文档的额外参数
+
+    返回:
+        汇总报告
+    """
+    inputs = list(inputs)
+    paths = discover_documents(inputs)
+    if not paths:
+        raise ValueError(f"没有找到 PDF 或 Markdown 文档: {inputs}")
+    return BatchIngestor(opt, workers=workers, parse_processes=parse_processes, output_dir=output_dir,
+                         md_options=md_options).run(paths, report_path=report_path)
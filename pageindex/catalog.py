@@ -0,0 +1,383 @@
+"""
+PageIndex 文档目录模块
+
+所有已导入文档记录在本地 SQLite 目录表中（文档 ID、显示名称、原始文件路径、结构文件路径、文本文件路径、
+内容哈希、状态、处理耗时、索引状态），按文档 ID 和文档名称建立索引，查找文档时不再扫描 results/uploads 目录或猜测文件名。
+导入、索引重建和删除都在同一个事务内更新目录；目录之外写入的结构文件（旧数据、命令行脚本）由 sync 补录。
+"""
+
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from .storage import (save_result, load_result, delete_result, load_manifest, resolve_result_path, result_exists,
+                      STRUCTURE_SUFFIX, FORMAT_EXTENSIONS)
+
+# 目录数据库路径
+CATALOG_DB_PATH = os.getenv("PAGEINDEX_CATALOG_DB", "./results/.catalog.db")
+
+# 文档状态
+PROCESSING = "processing"
+READY = "ready"
+FAILED = "failed"
+
+SOURCE_EXTENSIONS = (".pdf", ".md", ".markdown")
+
+# 旧版上传流程在文件名中附加的时间戳，例如 "报告_1766975805.2124398.md"
+_UPLOAD_TIMESTAMP = re.compile(r"_\d{10}\.\d+$")
+# API 按任务保存上传文件的目录名（任务 ID）
+_JOB_UPLOAD_DIR = re.compile(r"[0-9a-f]{32}")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    doc_name TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    source_path TEXT,
+    structure_path TEXT,
+    text_path TEXT,
+    source_hash TEXT,
+    structure_hash TEXT,
+    structure_mtime_ns INTEGER,
+    doc_description TEXT NOT NULL DEFAULT '',
+    node_count INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    error TEXT,
+    processing_seconds REAL,
+    index_nodes INTEGER,
+    indexed_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_doc_name ON documents (doc_name);
+CREATE INDEX IF NOT EXISTS idx_documents_status ON documents (status, display_name);
+"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def file_hash(path: str) -> Optional[str]:
+    """计算文件内容的 SHA-256 哈希（文件不存在时返回 None）"""
+    if not path or not os.path.isfile(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def doc_id_for(structure_path: str) -> str:
+    """结构文件对应的文档 ID（<文档 ID>_structure.json）"""
+    name = os.path.basename(structure_path)
+    for ext in FORMAT_EXTENSIONS.values():
+        if name.endswith(ext) and not name.endswith(".json"):
+            name = name[:-len(ext)] + ".json"
+    return name[:-len(STRUCTURE_SUFFIX)] if name.endswith(STRUCTURE_SUFFIX) else os.path.splitext(name)[0]
+
+
+def display_name_for(filename: str) -> str:
+    """去掉上传时间戳后的显示名称"""
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    if ext.lower() not in SOURCE_EXTENSIONS:
+        stem, ext = stem + ext, ""
+    return _UPLOAD_TIMESTAMP.sub("", stem) + ext
+
+
+def _count_nodes(structure: Any) -> int:
+    if isinstance(structure, dict):
+        return 1 + _count_nodes(structure.get("nodes") or [])
+    if isinstance(structure, list):
+        return sum(_count_nodes(item) for item in structure)
+    return 0
+
+
+class DocumentCatalog:
+    """
+    SQLite 持久化的文档目录
+
+    参数:
+        db_path: 数据库文件路径
+        read_only: 以只读方式打开（多进程部署的查询进程），只有写入进程更新目录
+    """
+
+    def __init__(self, db_path: str = CATALOG_DB_PATH, read_only: bool = False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True,
+                                         check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            return
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def _transaction(self, statements: Iterable[tuple]):
+        """在一个事务中执行多条语句"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _upsert_statement(doc_id: str, fields: Dict[str, Any]) -> tuple:
+        now = _now()
+        updates = dict(fields, updated_at=now)
+        # 默认值只用于新记录，已有记录只更新给出的字段
+        values = dict(updates, doc_id=doc_id, created_at=now)
+        values.setdefault("doc_name", doc_id)
+        values.setdefault("display_name", display_name_for(values["doc_name"]))
+        values.setdefault("status", PROCESSING)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in updates)
+        sql = (f"INSERT INTO documents ({', '.join(values)}) VALUES ({', '.join('?' * len(values))}) "
+               f"ON CONFLICT(doc_id) DO UPDATE SET {assignments}")
+        return sql, tuple(values.values())
+
+    def upsert(self, doc_id: str, **fields):
+        """新增或更新文档记录（只更新给出的字段）"""
+        self._transaction([self._upsert_statement(doc_id, fields)])
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, name: str, results_dir: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        按文档名称（向量索引中的 doc_name）或文档 ID 查找文档
+
+        参数:
+            name: 文档名称、文档 ID，或带扩展名的文件名
+            results_dir: 目录中没有记录时，在该结果目录中查找对应的结构文件并补录（其他进程写入的结果；只读时忽略）
+        """
+        stem = os.path.splitext(name)[0] if name.lower().endswith(SOURCE_EXTENSIONS) else name
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM documents WHERE doc_name = ? OR doc_id IN (?, ?) "
+                "ORDER BY doc_name = ? DESC, doc_id = ? DESC LIMIT 1",
+                (name, name, stem, name, name),
+            ).fetchone()
+        if row is not None:
+            return dict(row)
+        if results_dir and not self.read_only:
+            for doc_id in dict.fromkeys((name, stem)):
+                structure_path = os.path.join(results_dir, f"{doc_id}{STRUCTURE_SUFFIX}")
+                if result_exists(structure_path):
+                    self.sync(results_dir)
+                    return self.get(doc_id)
+        return None
+
+    def list(self, status: Optional[str] = READY) -> List[Dict[str, Any]]:
+        """按显示名称列出文档，status 为 None 时列出全部"""
+        with self._lock:
+            if status:
+                rows = self._conn.execute(
+                    "SELECT * FROM documents WHERE status = ? ORDER BY display_name", (status,)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM documents ORDER BY display_name").fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_processing(self, structure_path: str, source_path: str, display_name: Optional[str] = None) -> str:
+        """
+        记录开始处理的文档（已有的结构文件路径保留，处理失败时仍可使用上一版本）
+
+        返回:
+            文档 ID
+        """
+        doc_id = doc_id_for(structure_path)
+        self.upsert(doc_id, source_path=source_path, display_name=display_name or display_name_for(source_path),
+                    status=PROCESSING, error=None)
+        return doc_id
+
+    def mark_failed(self, structure_path: str, error: str):
+        """记录处理失败或取消：已有上一版本结果的文档恢复为可用状态，否则标记为失败"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET status = CASE WHEN structure_hash IS NULL THEN ? ELSE ? END, error = ?, "
+                "updated_at = ? WHERE doc_id = ?",
+                (FAILED, READY, error, _now(), doc_id_for(structure_path)),
+            )
+
+    def record_result(self, result: Dict[str, Any], structure_path: str, source_path: Optional[str] = None,
+                      seconds: Optional[float] = None, display_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        记录已保存的处理结果
+
+        参数:
+            result: page_index / md_to_tree 的结果
+            structure_path: 结构文件的逻辑路径（<文档 ID>_structure.json）
+            source_path: 原始文件路径
+            seconds: 处理耗时
+            display_name: 显示名称，默认取原始文件名（去掉上传时间戳）
+        """
+        doc_id = doc_id_for(structure_path)
+        self._transaction([self._upsert_statement(doc_id, self._result_fields(
+            result, structure_path, source_path, seconds, display_name))])
+        return self.get(doc_id)
+
+    @staticmethod
+    def _result_fields(result: Dict[str, Any], structure_path: str, source_path: Optional[str],
+                       seconds: Optional[float], display_name: Optional[str]) -> Dict[str, Any]:
+        actual_path = resolve_result_path(structure_path)
+        doc_name = result.get("doc_name") or doc_id_for(structure_path)
+        text_path = None
+        if result.get("text_file"):
+            text_path = os.path.join(os.path.dirname(structure_path), os.path.basename(result["text_file"]))
+        fields = {
+            "doc_name": doc_name,
+            "display_name": display_name or display_name_for(source_path or doc_name),
+            "structure_path": structure_path,
+            "text_path": text_path,
+            "structure_hash": file_hash(actual_path),
+            "structure_mtime_ns": os.stat(actual_path).st_mtime_ns if actual_path else None,
+            "doc_description": result.get("doc_description", ""),
+            "node_count": _count_nodes(result.get("structure", [])),
+            "status": READY,
+            "error": None,
+        }
+        if source_path:
+            fields.update(source_path=source_path, source_hash=file_hash(source_path))
+        if seconds is not None:
+            fields["processing_seconds"] = round(seconds, 3)
+        return fields
+
+    def save_document(self, result: Dict[str, Any], structure_path: str, source_path: Optional[str] = None,
+                      seconds: Optional[float] = None, display_name: Optional[str] = None) -> Dict[str, Any]:
+        """保存处理结果（save_result）并更新目录"""
+        saved = save_result(result, structure_path)
+        result = {key: value for key, value in result.items() if key != "text_file"}
+        if saved["text_file"]:
+            result["text_file"] = saved["text_file"]
+        return self.record_result(result, structure_path, source_path, seconds, display_name)
+
+    def mark_indexed(self, index_nodes: Dict[str, int]):
+        """记录向量索引中各文档（按 doc_name）的节点数"""
+        now = _now()
+        self._transaction(
+            ("UPDATE documents SET index_nodes = ?, indexed_at = ?, updated_at = ? WHERE doc_name = ?",
+             (nodes, now, now, doc_name))
+            for doc_name, nodes in index_nodes.items()
+        )
+
+    def mark_unindexed(self, doc_name: str):
+        """文档已从向量索引中删除"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET index_nodes = NULL, indexed_at = NULL, updated_at = ? WHERE doc_name = ?",
+                (_now(), doc_name),
+            )
+
+    def delete(self, doc_id: str, remove_files: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        删除文档记录，并删除结构文件、文本文件和原始文件
+
+        返回:
+            被删除的记录，不存在时返回 None
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row is not None:
+                    self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+                    if remove_files:
+                        if row["structure_path"]:
+                            delete_result(row["structure_path"])
+                        if row["source_path"] and os.path.exists(row["source_path"]):
+                            os.remove(row["source_path"])
+                            # API 上传的文件按任务保存在 uploads/<任务 ID>/ 中，删除后移除空目录
+                            source_dir = os.path.dirname(row["source_path"])
+                            if _JOB_UPLOAD_DIR.fullmatch(os.path.basename(source_dir)) and not os.listdir(source_dir):
+                                os.rmdir(source_dir)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def sync(self, results_dir: str, upload_dir: Optional[str] = None) -> Dict[str, int]:
+        """
+        与结果目录同步：补录目录之外写入或修改过的结构文件，移除结构文件已不存在的记录
+
+        参数:
+            results_dir: 结果目录
+            upload_dir: 原始文件目录，补录时在其中查找同名的原始文件
+
+        返回:
+            {"added": 新增数, "updated": 更新数, "removed": 移除数}
+        """
+        if self.read_only:
+            return {"added": 0, "updated": 0, "removed": 0}
+        manifest = load_manifest(results_dir)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, structure_path, structure_mtime_ns, source_path, status FROM documents").fetchall()
+        known = {row["doc_id"]: row for row in rows}
+        statements = []
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        for name, entry in manifest.items():
+            doc_id = doc_id_for(name)
+            row = known.get(doc_id)
+            # 正在处理的文档由导入流程更新
+            if row is not None and (row["status"] == PROCESSING or row["structure_mtime_ns"] == entry.get("mtime_ns")):
+                continue
+            structure_path = os.path.join(results_dir, name)
+            source_path = row["source_path"] if row is not None else None
+            if source_path is None and upload_dir:
+                source_path = next((os.path.join(upload_dir, doc_id + ext) for ext in SOURCE_EXTENSIONS
+                                    if os.path.exists(os.path.join(upload_dir, doc_id + ext))), None)
+            result = {"doc_name": entry.get("doc_name"), "doc_description": entry.get("doc_description", ""),
+                      "text_file": load_result(structure_path).get("text_file")}
+            fields = self._result_fields(result, structure_path, source_path, None, None)
+            fields["node_count"] = entry.get("node_count", 0)
+            statements.append(self._upsert_statement(doc_id, fields))
+            counts["added" if row is None else "updated"] += 1
+        for doc_id, row in known.items():
+            structure_path = row["structure_path"]
+            if (structure_path and os.path.abspath(os.path.dirname(structure_path)) == os.path.abspath(results_dir)
+                    and row["status"] != PROCESSING and not result_exists(structure_path)):
+                statements.append(("DELETE FROM documents WHERE doc_id = ?", (doc_id,)))
+                counts["removed"] += 1
+        if statements:
+            self._transaction(statements)
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 全局目录实例
+_catalog_instance = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(read_only: bool = False) -> DocumentCatalog:
+    """
+    获取全局文档目录实例（单例模式）
+
+    参数:
+        read_only: 首次创建时是否以只读方式打开
+    """
+    global _catalog_instance
+    with _catalog_lock:
+        if _catalog_instance is None:
+            _catalog_instance = DocumentCatalog(read_only=read_only)
+        return _catalog_instance
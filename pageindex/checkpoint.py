@@ -0,0 +1,331 @@
+"""
+PageIndex 断点续跑模块
+
+将 page_index_main 各阶段的中间结果持久化到任务目录中，
+任务因异常（配额错误、解析失败、Ctrl-C 等）中断后，可从最后完成的阶段继续执行。
+"""
+
+import os
+import copy
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import contextvars
+from io import BytesIO
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .utils import PdfDocument
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 任务目录根路径
+CHECKPOINT_DIR = os.getenv("PAGEINDEX_CHECKPOINT_DIR", "./jobs")
+
+# page_index_main 的阶段，按执行顺序排列
+STAGES = [
+    "page_extraction",
+    "toc_detection",
+    "toc_transform",
+    "index_mapping",
+    "verify_fix",
+    "large_nodes",
+    "summaries",
+    "vector_index",
+]
+
+# 阶段进度回调 callback(stage, event)，event 为 "start" 或 "done"；在回调中抛出异常可中止任务
+_stage_callback = contextvars.ContextVar("pageindex_stage_callback", default=None)
+
+# 不影响处理结果的配置项，不参与配置指纹计算
+_FINGERPRINT_IGNORED_KEYS = {"resume", "if_checkpoint"}
+
+
+def _try_lock_file(f) -> bool:
+    """对已打开的文件加非阻塞排他锁（进程退出时由系统自动释放），已被占用时返回 False"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def compute_document_hash(doc: Any) -> str:
+    """
+    计算文档内容的 SHA-256 哈希
+
+    参数:
+        doc: PDF 文件路径、BytesIO 对象或 PdfDocument
+
+    返回:
+        十六进制哈希字符串
+    """
+    sha = hashlib.sha256()
+    if isinstance(doc, PdfDocument):
+        sha.update(doc.buffer)
+    elif isinstance(doc, BytesIO):
+        sha.update(doc.getbuffer())
+    else:
+        with open(doc, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def compute_config_fingerprint(opt: Any) -> str:
+    """计算配置指纹，配置变化后旧的检查点不再可用"""
+    options = {k: v for k, v in vars(opt).items() if k not in _FINGERPRINT_IGNORED_KEYS} if opt else {}
+    payload = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class JobCheckpoint:
+    """
+    单个文档处理任务的检查点
+
+    每个阶段保存为任务目录下的一个 JSON Lines 文件，每行一个条目 {"key": key, "data": data}，
+    同一阶段可保存多个条目（例如大节点递归时每个子范围各一个条目），新条目追加写入。
+    manifest.json 记录文档哈希、配置指纹和各阶段完成时间。
+
+    任务目录由 <任务 ID>.lock 文件的排他锁保护：同一文档同时被处理（批量处理中的重复文件、重复上传）时，
+    后启动的任务使用独立的临时目录，不会清除或复用正在运行的任务的检查点；临时目录无法继续，close 时删除。
+    """
+
+    def __init__(self, job_id: str, base_dir: str = None, resume: bool = False, fingerprint: str = ""):
+        """
+        初始化检查点
+
+        参数:
+            job_id: 任务 ID（通常为文档内容哈希）
+            base_dir: 任务目录根路径
+            resume: 是否从已有检查点继续；为 False 时清除旧检查点
+            fingerprint: 配置指纹
+        """
+        base_dir = base_dir or CHECKPOINT_DIR
+        os.makedirs(base_dir, exist_ok=True)
+        self.job_id = job_id
+        self.job_dir = os.path.join(base_dir, job_id)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._stage_cache: Dict[str, Dict[str, Any]] = {}
+        self._lock_file = open(os.path.join(base_dir, f"{job_id}.lock"), "a+")
+        # 是否使用独立的临时目录（无法继续，任务结束时删除）
+        self.private = False
+        if not _try_lock_file(self._lock_file):
+            self._lock_file.close()
+            self._lock_file = None
+            self.job_dir = os.path.join(base_dir, f"{job_id}-{uuid.uuid4().hex[:8]}")
+            self.private = True
+            print(f"任务 {job_id} 的检查点正被另一个任务使用，本次使用独立目录 {self.job_dir}")
+            resume = False
+
+        manifest = self._read_json(self._manifest_path()) if resume else None
+        if manifest and manifest.get("fingerprint") != fingerprint:
+            print(f"任务 {job_id} 的配置已变化，忽略旧检查点")
+            manifest = None
+        if manifest is None:
+            self.clear()
+            manifest = {
+                "job_id": job_id,
+                "fingerprint": fingerprint,
+                "created_at": datetime.now().isoformat(),
+                "stages": {},
+            }
+        elif manifest["stages"]:
+            print(f"从检查点继续任务 {job_id}，已完成阶段: {', '.join(self.completed_stages(manifest))}")
+        self.manifest = manifest
+        os.makedirs(self.job_dir, exist_ok=True)
+        self._write_json(self._manifest_path(), self.manifest)
+
+    @classmethod
+    def for_document(cls, doc: Any, opt: Any = None, resume: bool = False, base_dir: str = None) -> "JobCheckpoint":
+        """
+        为文档创建检查点，任务 ID 为文档内容哈希
+
+        参数:
+            doc: PDF 文件路径、BytesIO 对象或 PdfDocument
+            opt: 处理配置
+            resume: 是否从已有检查点继续
+            base_dir: 任务目录根路径
+        """
+        job_id = compute_document_hash(doc)[:24]
+        return cls(job_id, base_dir=base_dir, resume=resume, fingerprint=compute_config_fingerprint(opt))
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.job_dir, "manifest.json")
+
+    def _stage_path(self, stage: str) -> str:
+        return os.path.join(self.job_dir, f"{stage}.jsonl")
+
+    @staticmethod
+    def _read_json(path: str) -> Optional[Any]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取检查点失败 {path}: {e}")
+            return None
+
+    @staticmethod
+    def _write_json(path: str, data: Any):
+        # 先写临时文件再替换，避免中断时留下半个文件
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _write_json_lines(path: str, entries: Dict[str, Any]):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, data in entries.items():
+                f.write(json.dumps({"key": key, "data": data}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+
+    def _load_stage(self, stage: str) -> Dict[str, Any]:
+        if stage not in self._stage_cache:
+            entries = {}
+            path = self._stage_path(stage)
+            if os.path.exists(path):
+                torn = False
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # 写入中断留下的不完整行
+                            torn = True
+                            continue
+                        entries[entry["key"]] = entry["data"]
+                if torn:
+                    # 去掉不完整的行，否则之后追加的条目会接在它后面
+                    self._write_json_lines(path, entries)
+            else:
+                # 旧版本保存的整个阶段 JSON 文件
+                entries = self._read_json(os.path.join(self.job_dir, f"{stage}.json")) or {}
+            self._stage_cache[stage] = entries
+        return self._stage_cache[stage]
+
+    @staticmethod
+    def completed_stages(manifest: Dict[str, Any]) -> List[str]:
+        return [stage for stage in STAGES if stage in manifest.get("stages", {})]
+
+    def has(self, stage: str, key: str = "_") -> bool:
+        """检查某阶段（条目）是否已完成"""
+        with self._lock:
+            return key in self._load_stage(stage)
+
+    def load(self, stage: str, key: str = "_") -> Any:
+        """读取某阶段（条目）的结果"""
+        with self._lock:
+            return copy.deepcopy(self._load_stage(stage).get(key))
+
+    def save(self, stage: str, data: Any, key: str = "_"):
+        """
+        保存某阶段（条目）的结果
+
+        参数:
+            stage: 阶段名称
+            data: 可 JSON 序列化的阶段结果
+            key: 条目键
+        """
+        with self._lock:
+            entries = self._load_stage(stage)
+            entries[key] = copy.deepcopy(data)
+            # 只追加新条目，不重写整个阶段文件
+            with open(self._stage_path(stage), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "data": data}, ensure_ascii=False) + "\n")
+            self.manifest["stages"][stage] = {
+                "completed_at": datetime.now().isoformat(),
+                "entries": len(entries),
+            }
+            self._write_json(self._manifest_path(), self.manifest)
+
+    def clear(self):
+        """删除任务目录"""
+        self._stage_cache = {}
+        if os.path.isdir(self.job_dir):
+            shutil.rmtree(self.job_dir, ignore_errors=True)
+
+    def close(self):
+        """释放任务目录的锁（任务结束时调用，无论成功与否；检查点保留以便继续，独立的临时目录直接删除）"""
+        if self.private:
+            self.clear()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+@contextmanager
+def report_stage_progress(callback: Callable[[str, str], None]):
+    """
+    在代码块内把 run_stage / run_stage_async 的阶段开始和完成事件报告给 callback（未启用检查点时同样报告）
+
+    用法:
+        with report_stage_progress(lambda stage, event: print(stage, event)):
+            page_index_main(doc, opt)
+    """
+    token = _stage_callback.set(callback)
+    try:
+        yield
+    finally:
+        _stage_callback.reset(token)
+
+
+def _notify_stage(stage: str, event: str):
+    callback = _stage_callback.get()
+    if callback is not None:
+        callback(stage, event)
+
+
+def run_stage(checkpoint: Optional[JobCheckpoint], stage: str, compute: Callable[[], Any], key: str = "_",
+              restore: Callable[[Any], Any] = None) -> Any:
+    """
+    执行一个阶段：已有检查点时直接读取，否则计算并保存
+
+    参数:
+        checkpoint: 检查点（为 None 时直接计算）
+        stage: 阶段名称
+        compute: 计算函数
+        key: 条目键
+        restore: 从 JSON 数据恢复结果的函数（可选）
+    """
+    _notify_stage(stage, "start")
+    if checkpoint is None:
+        result = compute()
+    elif checkpoint.has(stage, key):
+        data = checkpoint.load(stage, key)
+        result = restore(data) if restore else data
+    else:
+        result = compute()
+        checkpoint.save(stage, result, key)
+    _notify_stage(stage, "done")
+    return result
+
+
+async def run_stage_async(checkpoint: Optional[JobCheckpoint], stage: str, compute: Callable[[], Any], key: str = "_",
+                          restore: Callable[[Any], Any] = None) -> Any:
+    """run_stage 的异步版本，compute 返回协程"""
+    _notify_stage(stage, "start")
+    if checkpoint is None:
+        result = await compute()
+    elif checkpoint.has(stage, key):
+        data = checkpoint.load(stage, key)
+        result = restore(data) if restore else data
+    else:
+        result = await compute()
+        checkpoint.save(stage, result, key)
+    _notify_stage(stage, "done")
+    return result
@@ -0,0 +1,227 @@
+"""
+PageIndex 页面分组模块
+
+无目录或目录无页码时，需要把带 <physical_index_X> 标签的页面按 token 数分组后依次发送给模型。
+分组预算由模型配置（上下文窗口、预期输出 token 数、提示词开销）决定，
+用前缀和数组在 O(1) 时间内计算任意页面区间的 token 数，优先在看起来是章节开头的页面处切分，
+并输出每组的页码范围，后续阶段无需再用正则扫描标签。
+"""
+
+import os
+import re
+import math
+import bisect
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .utils import count_tokens
+
+
+# 模型名前缀 -> (上下文窗口, 最大输出 token 数)，按前缀长度从长到短匹配
+MODEL_PROFILES = {
+    "gpt-4.1": (1047576, 32768),
+    "gpt-4o": (128000, 16384),
+    "gpt-4-turbo": (128000, 4096),
+    "gpt-4": (8192, 4096),
+    "gpt-3.5-turbo": (16385, 4096),
+    "o1": (200000, 100000),
+    "o3": (200000, 100000),
+    "o4-mini": (200000, 100000),
+}
+DEFAULT_PROFILE = (128000, 4096)
+
+# 提示词模板和已生成的目录结构所占 token 数的预留
+DEFAULT_PROMPT_OVERHEAD = 2000
+# 预期输出 token 数（目录 JSON），不超过模型的最大输出
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 2000
+# 单组正文 token 上限，组太大时模型容易漏掉章节
+DEFAULT_GROUP_MAX_TOKENS = 20000
+
+# 页面开头像章节标题的行；只有关键字不区分大小写，编号形式要求标题以大写字母或汉字开头，
+# 编号最多两位数（排除以年份开头的正文）
+_SECTION_START = re.compile(
+    r'^\s*('
+    r'(?i:chapter|section|part|appendix|article)\s+[\divxlcA-Z]+'
+    r'|第\s*[\d一二三四五六七八九十百]+\s*[章节篇部分条]'
+    r'|\d{1,2}(\.\d+)*\.?\s+[A-Z一-鿿]'
+    r'|[IVXLC]+\.\s+[A-Z]'
+    r')'
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+
+def get_model_profile(model: Optional[str] = None) -> Dict[str, int]:
+    """
+    获取模型配置
+
+    可通过环境变量覆盖：PAGEINDEX_CONTEXT_WINDOW、PAGEINDEX_MAX_OUTPUT_TOKENS、PAGEINDEX_EXPECTED_OUTPUT_TOKENS、
+    PAGEINDEX_PROMPT_OVERHEAD、PAGEINDEX_GROUP_MAX_TOKENS
+
+    返回:
+        包含 context_window、max_output_tokens、expected_output_tokens、prompt_overhead、
+        group_max_tokens、group_budget（每组正文可用的 token 数）的字典
+    """
+    context_window, max_output_tokens = DEFAULT_PROFILE
+    name = (model or "").lower()
+    for prefix in sorted(MODEL_PROFILES, key=len, reverse=True):
+        if name.startswith(prefix):
+            context_window, max_output_tokens = MODEL_PROFILES[prefix]
+            break
+
+    profile = {
+        "context_window": _env_int("PAGEINDEX_CONTEXT_WINDOW", context_window),
+        "max_output_tokens": _env_int("PAGEINDEX_MAX_OUTPUT_TOKENS", max_output_tokens),
+        "expected_output_tokens": _env_int("PAGEINDEX_EXPECTED_OUTPUT_TOKENS", DEFAULT_EXPECTED_OUTPUT_TOKENS),
+        "prompt_overhead": _env_int("PAGEINDEX_PROMPT_OVERHEAD", DEFAULT_PROMPT_OVERHEAD),
+        "group_max_tokens": _env_int("PAGEINDEX_GROUP_MAX_TOKENS", DEFAULT_GROUP_MAX_TOKENS),
+    }
+    expected_output = min(profile["expected_output_tokens"], profile["max_output_tokens"])
+    available = profile["context_window"] - expected_output - profile["prompt_overhead"]
+    profile["group_budget"] = max(1, min(profile["group_max_tokens"], available))
+    return profile
+
+
+def is_section_start(page_text: str) -> bool:
+    """判断页面第一行非空文本是否像章节标题"""
+    for line in (page_text or "").split("\n"):
+        if line.strip():
+            return len(line.split()) <= 15 and bool(_SECTION_START.match(line))
+    return False
+
+
+def plan_page_groups(token_lengths: Sequence[int], max_tokens: int, overlap_page: int = 1,
+                     section_starts: Sequence[bool] = ()) -> List[Tuple[int, int]]:
+    """
+    计算页面分组
+
+    各组大小尽量均衡；在目标大小附近如果有章节开头页，则在该页之前切分（此时不需要重叠页），
+    否则在目标大小处切分，并让下一组重复上一组最后 overlap_page 页。
+
+    参数:
+        token_lengths: 每页 token 数
+        max_tokens: 每组 token 上限
+        overlap_page: 相邻组重叠的页数
+        section_starts: 每页是否为章节开头
+
+    返回:
+        [(起始下标, 结束下标)] 列表，下标从 0 开始，左闭右开
+    """
+    n = len(token_lengths)
+    if n == 0:
+        return []
+    prefix = [0]
+    for tokens in token_lengths:
+        prefix.append(prefix[-1] + tokens)
+    total = prefix[-1]
+    if total <= max_tokens:
+        return [(0, n)]
+
+    expected_parts = math.ceil(total / max_tokens)
+    target = math.ceil(((total / expected_parts) + max_tokens) / 2)
+    target = min(target, max_tokens)
+
+    groups = []
+    start = 0
+    while start < n:
+        # 从 start 开始不超过上限的最远结束位置（至少包含一页）
+        limit = max(start + 1, bisect.bisect_right(prefix, prefix[start] + max_tokens) - 1)
+        if limit >= n:
+            groups.append((start, n))
+            break
+        # 不超过目标大小的结束位置
+        end = max(start + 1, bisect.bisect_right(prefix, prefix[start] + target) - 1)
+
+        # 在 [目标的 3/4, 上限] 区间内找最接近目标的章节开头页
+        split_at_section = False
+        if section_starts:
+            lower = prefix[start] + target * 3 // 4
+            best = None
+            for candidate in range(start + 1, limit + 1):
+                if prefix[candidate] < lower or not section_starts[candidate]:
+                    continue
+                if best is None or abs(prefix[candidate] - prefix[start] - target) < abs(prefix[best] - prefix[start] - target):
+                    best = candidate
+            if best is not None:
+                end = best
+                split_at_section = True
+
+        groups.append((start, end))
+        next_start = end if split_at_section else end - overlap_page
+        start = max(next_start, start + 1)
+    return groups
+
+
+class TaggedPageCache:
+    """
+    整篇文档共用的带 <physical_index_X> 标签的页面文本、token 数和章节开头标记（按物理页码缓存），
+    大节点拆分时各子页面范围分组直接复用，不再重复打标签和计算 token
+
+    参数:
+        page_list: 整篇文档的 (页面文本, token 数量) 列表
+        model: 用于 token 计数的模型
+        start_index: page_list 第一页的物理页码
+    """
+
+    def __init__(self, page_list, model: Optional[str] = None, start_index: int = 1):
+        self.page_list = page_list
+        self.model = model
+        self.start_index = start_index
+        # 同一页重复计算的结果相同，多线程下无需加锁
+        self._pages: Dict[int, Tuple[str, int, bool]] = {}
+
+    def get(self, page_index: int) -> Tuple[str, int, bool]:
+        """返回 (带标签文本, token 数, 是否章节开头)，page_index 为从 1 开始的物理页码"""
+        cached = self._pages.get(page_index)
+        if cached is None:
+            page_text = self.page_list[page_index - self.start_index][0]
+            tagged = f"<physical_index_{page_index}>\n{page_text}\n<physical_index_{page_index}>\n\n"
+            cached = (tagged, count_tokens(tagged, self.model), is_section_start(page_text))
+            self._pages[page_index] = cached
+        return cached
+
+
+def group_pages(page_list, start_index: int = 1, model: Optional[str] = None, max_tokens: Optional[int] = None,
+                overlap_page: int = 1, tagged_pages: Optional[TaggedPageCache] = None) -> List[Dict[str, Any]]:
+    """
+    将页面打上 <physical_index_X> 标签并分组
+
+    参数:
+        page_list: (页面文本, token 数量) 列表
+        start_index: 第一页的物理页码
+        model: 模型名称，用于确定分组预算和 token 计数
+        max_tokens: 每组 token 上限，默认由模型配置决定
+        overlap_page: 相邻组重叠的页数
+        tagged_pages: 整篇文档的页面缓存（page_list 为文档的连续片段时复用）
+
+    返回:
+        [{"text": 分组文本, "start_index": 起始页码, "end_index": 结束页码, "tokens": token 数}]
+    """
+    if max_tokens is None:
+        max_tokens = get_model_profile(model)["group_budget"]
+
+    if tagged_pages is None:
+        tagged_pages = TaggedPageCache(page_list, model, start_index=start_index)
+    page_contents = []
+    token_lengths = []
+    section_starts = []
+    for page_index in range(start_index, start_index + len(page_list)):
+        page_text, tokens, section_start = tagged_pages.get(page_index)
+        page_contents.append(page_text)
+        token_lengths.append(tokens)
+        section_starts.append(section_start)
+
+    groups = []
+    for start, end in plan_page_groups(token_lengths, max_tokens, overlap_page, section_starts):
+        groups.append({
+            "text": "".join(page_contents[start:end]),
+            "start_index": start_index + start,
+            "end_index": start_index + end - 1,
+            "tokens": sum(token_lengths[start:end]),
+        })
+    return groups
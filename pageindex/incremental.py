@@ -0,0 +1,470 @@
+"""
+PageIndex 增量更新模块
+
+文档修订后重新上传时，按每页内容哈希与上一版本比对：
+未变化的页面区间直接映射到已有节点并复用摘要和 embedding，
+只有页面范围涉及变化页面的节点才重新校验和生成摘要，并输出差异报告。
+标题在新版本中找不到的节点被移除（子节点上移一级），变化页面中新出现的标题作为新节点插入；
+变化页面无法重新提取目录时退回完整处理。
+"""
+
+import asyncio
+import difflib
+from typing import Any, Dict, List, Optional, Tuple
+
+from .utils import *
+from .summary import SummaryEngine
+from .metrics import collect_llm_metrics, llm_stage
+from .page_index import (
+    check_title_appearance,
+    check_title_appearance_batched,
+    check_title_appearance_in_start_concurrent,
+    meta_processor,
+    page_index_main,
+    split_large_nodes,
+    single_toc_item_index_fixer,
+)
+
+
+def diff_pages(old_hashes: List[str], new_hashes: List[str]) -> Dict[str, Any]:
+    """
+    比对新旧版本的页面哈希
+
+    参数:
+        old_hashes: 旧版本每页哈希
+        new_hashes: 新版本每页哈希
+
+    返回:
+        包含 opcodes、变化页面（新版本页码）、删除页面（旧版本页码）的字典，页码从 1 开始
+    """
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    opcodes = matcher.get_opcodes()
+    changed_pages = []
+    deleted_pages = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag in ('replace', 'insert'):
+            changed_pages.extend(range(j1 + 1, j2 + 1))
+        if tag in ('replace', 'delete'):
+            deleted_pages.extend(range(i1 + 1, i2 + 1))
+    return {
+        'opcodes': opcodes,
+        'changed_pages': changed_pages,
+        'deleted_pages': deleted_pages,
+        'old_page_count': len(old_hashes),
+        'new_page_count': len(new_hashes),
+    }
+
+
+def map_old_page(page: int, opcodes, new_total: int, is_end: bool = False) -> int:
+    """
+    将旧版本页码映射到新版本页码
+
+    未变化页面一一对应；被替换的页面映射到替换区间内的相对位置；
+    被删除的页面映射到删除位置之后（起始页）或之前（结束页）的页面。
+    """
+    index = page - 1
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 <= index < i2:
+            if tag == 'equal':
+                new_page = j1 + (index - i1) + 1
+            elif tag == 'replace':
+                new_page = j1 + min(index - i1, j2 - j1 - 1) + 1
+            else:
+                new_page = j1 if is_end else j1 + 1
+            return max(1, min(new_page, new_total))
+    return new_total
+
+
+def _remap_starts(nodes, opcodes, new_total, unchanged_starts):
+    for node in nodes:
+        old_start = node['start_index']
+        node['start_index'] = map_old_page(old_start, opcodes, new_total)
+        if _is_equal_mapped(old_start, opcodes):
+            unchanged_starts.add(id(node))
+        if node.get('nodes'):
+            _remap_starts(node['nodes'], opcodes, new_total, unchanged_starts)
+
+
+def _is_equal_mapped(page, opcodes) -> bool:
+    index = page - 1
+    return any(tag == 'equal' and i1 <= index < i2 for tag, i1, i2, _, _ in opcodes)
+
+
+def _recompute_ends(nodes, parent_end, old_parent_end, old_ranges, opcodes, new_total):
+    """
+    按旧版本的边界关系重新计算结束页：
+    与下一个兄弟节点共享起始页的仍然共享，否则结束于其前一页；
+    最后一个子节点原本与父节点同页结束的，仍与父节点同页结束
+    """
+    for i, node in enumerate(nodes):
+        old_start, old_end = old_ranges[id(node)]
+        if i + 1 < len(nodes):
+            next_node = nodes[i + 1]
+            next_old_start = old_ranges[id(next_node)][0]
+            if old_end >= next_old_start:
+                end = next_node['start_index']
+            else:
+                end = next_node['start_index'] - 1
+        elif old_end >= old_parent_end:
+            end = parent_end
+        else:
+            end = min(map_old_page(old_end, opcodes, new_total, is_end=True), parent_end)
+        node['end_index'] = max(node['start_index'], end)
+        if node.get('nodes'):
+            _recompute_ends(node['nodes'], node['end_index'], old_end, old_ranges, opcodes, new_total)
+
+
+class IncrementalFallback(Exception):
+    """增量更新无法得到可靠的结构，需要退回完整处理"""
+
+
+async def _reverify_starts(flat_nodes, candidates, page_list, opt, logger) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    校验起始页内容发生变化的节点标题是否仍出现在映射后的起始页，
+    不出现的在相邻节点之间的页面范围内重新定位
+
+    返回:
+        (已修正的节点标题列表, 仍未通过校验的节点列表)
+    """
+    if not candidates:
+        return [], []
+    items = [
+        {'list_index': i, 'title': flat_nodes[i]['title'], 'physical_index': flat_nodes[i]['start_index']}
+        for i in candidates
+    ]
+    with llm_stage('verify'):
+        results = await check_title_appearance_batched(items, page_list, model=opt.model,
+                                                       max_batch_size=getattr(opt, 'verify_batch_size', 10))
+    incorrect = [result['list_index'] for result in results if result['answer'] != 'yes']
+
+    async def fix_item(list_index):
+        prev_start = flat_nodes[list_index - 1]['start_index'] if list_index > 0 else 1
+        next_start = flat_nodes[list_index + 1]['start_index'] if list_index + 1 < len(flat_nodes) else len(page_list)
+        content = get_text_of_pdf_pages_with_labels(page_list, prev_start, max(prev_start, next_start))
+        physical_index = await asyncio.to_thread(single_toc_item_index_fixer, flat_nodes[list_index]['title'], content, opt.model)
+        if physical_index is None or not prev_start <= physical_index <= max(prev_start, next_start):
+            return list_index, None
+        check = await check_title_appearance(
+            {'list_index': list_index, 'title': flat_nodes[list_index]['title'], 'physical_index': physical_index},
+            page_list, model=opt.model)
+        return list_index, physical_index if check['answer'] == 'yes' else None
+
+    with llm_stage('fix'):
+        fix_results = await asyncio.gather(*[fix_item(i) for i in incorrect])
+    fixed, unverified = [], []
+    for list_index, physical_index in fix_results:
+        node = flat_nodes[list_index]
+        if physical_index is None:
+            unverified.append(node)
+        else:
+            node['start_index'] = physical_index
+            fixed.append(node['title'])
+    logger.info({'incremental_fixed': fixed, 'incremental_unverified': [node['title'] for node in unverified]})
+    return fixed, unverified
+
+
+def _remove_nodes(nodes, removed_ids) -> List[Dict[str, Any]]:
+    """移除指定节点，其子节点上移到父节点下的同一位置"""
+    result = []
+    for node in nodes:
+        children = _remove_nodes(node.get('nodes') or [], removed_ids)
+        if id(node) in removed_ids:
+            result.extend(children)
+            continue
+        if children:
+            node['nodes'] = children
+        else:
+            node.pop('nodes', None)
+        result.append(node)
+    return result
+
+
+def _page_spans(pages) -> List[Tuple[int, int]]:
+    """把页码列表合并为连续区间 [(起始页, 结束页), ...]"""
+    spans = []
+    for page in sorted(set(pages)):
+        if spans and page == spans[-1][1] + 1:
+            spans[-1] = (spans[-1][0], page)
+        else:
+            spans.append((page, page))
+    return spans
+
+
+def _title_key(title: str) -> str:
+    return re.sub(r'\W+', '', title or '').lower()
+
+
+async def _find_new_headings(structure, page_list, changed_pages, opt, logger) -> List[Dict[str, Any]]:
+    """
+    在变化页面的每个连续区间上重新提取目录（process_no_toc），返回页面范围与该区间相交的节点中没有同名节点的标题
+
+    返回:
+        新标题列表，每项包含 title、physical_index 和 appear_start，按页码排序
+    """
+    flat_nodes = structure_to_list(structure)
+    new_items = []
+    for start, end in _page_spans(changed_pages):
+        try:
+            items = await meta_processor(page_list[start - 1:end], mode='process_no_toc', start_index=start,
+                                         opt=opt, logger=logger)
+        except Exception as e:
+            raise IncrementalFallback(f'第 {start}-{end} 页重新提取目录失败: {e}') from e
+        existing = {_title_key(node['title']) for node in flat_nodes
+                    if node['start_index'] <= end + 1 and node['end_index'] >= start - 1}
+        for item in items:
+            physical_index = item.get('physical_index')
+            if physical_index is None or not start <= physical_index <= end or _title_key(item['title']) in existing:
+                continue
+            existing.add(_title_key(item['title']))
+            new_items.append({'title': item['title'], 'physical_index': physical_index})
+    if new_items:
+        await check_title_appearance_in_start_concurrent(new_items, page_list, model=opt.model, logger=logger,
+                                                         max_batch_size=getattr(opt, 'verify_batch_size', 10))
+    logger.info({'incremental_new_headings': [item['title'] for item in new_items]})
+    return sorted(new_items, key=lambda item: item['physical_index'])
+
+
+def _insert_heading(structure, item) -> Dict[str, Any]:
+    """
+    把新标题插入为页码在它之前的最后一个节点（先序遍历）的下一个兄弟节点，并接管该节点剩余的页面；
+    该节点有子节点时（子节点都从标题之后开始）插入为第一个子节点
+    """
+    page = item['physical_index']
+    node = {'title': item['title'], 'start_index': page, 'end_index': page}
+    flat_nodes = structure_to_list(structure)
+    previous = None
+    for candidate in flat_nodes:
+        if candidate['start_index'] <= page:
+            previous = candidate
+    if previous is None:
+        siblings, position = structure, 0
+    elif previous.get('nodes'):
+        siblings, position = previous['nodes'], 0
+    else:
+        siblings = next(children for children in [structure] + [n.get('nodes') or [] for n in flat_nodes]
+                        if any(child is previous for child in children))
+        position = next(i for i, child in enumerate(siblings) if child is previous) + 1
+        node['end_index'] = max(page, previous['end_index'])
+        shared = item.get('appear_start') != 'yes' or page == previous['start_index']
+        previous['end_index'] = page if shared else page - 1
+    if position < len(siblings) and (previous is None or previous.get('nodes')):
+        node['end_index'] = max(page, siblings[position]['start_index'])
+    siblings.insert(position, node)
+    return node
+
+
+def _node_pages(node) -> set:
+    return set(range(node['start_index'], node['end_index'] + 1))
+
+
+async def update_structure(previous_result: Dict[str, Any], page_list, diff: Dict[str, Any], opt, logger,
+                           text_page_list=None) -> Dict[str, Any]:
+    """
+    基于页面差异更新上一版本的树结构
+
+    参数:
+        previous_result: 上一版本的处理结果
+        page_list: 新版本 (页面文本, token 数量) 列表（用于构造提示词）
+        diff: diff_pages 的返回值
+        opt: 处理配置
+        logger: 日志记录器
+        text_page_list: 用于节点最终文本的原始页面列表，默认与 page_list 相同
+
+    返回:
+        包含新结构（structure 字段）和差异报告中节点相关部分的字典，previous_result 本身不会被修改
+    """
+    structure = copy.deepcopy(previous_result['structure'])
+    opcodes = diff['opcodes']
+    new_total = len(page_list)
+    old_total = diff['old_page_count']
+    flat_nodes = structure_to_list(structure)
+    old_ranges = {id(node): (node['start_index'], node['end_index']) for node in flat_nodes}
+
+    # 1. 映射起始页，起始页内容有变化的节点重新校验
+    unchanged_starts = set()
+    _remap_starts(structure, opcodes, new_total, unchanged_starts)
+    candidates = [i for i, node in enumerate(flat_nodes) if id(node) not in unchanged_starts]
+    fixed, unverified = await _reverify_starts(flat_nodes, candidates, page_list, opt, logger)
+
+    # 2. 按原有边界关系重新计算结束页
+    _recompute_ends(structure, new_total, old_total, old_ranges, opcodes, new_total)
+
+    # 3. 在变化页面上重新提取目录；未通过校验的节点在起始页有新标题时视为改写（更新标题），
+    #    否则视为已删除并移除（子节点上移一级），其余新标题作为新节点插入
+    changed_pages = set(diff['changed_pages'])
+    new_headings = await _find_new_headings(structure, page_list, changed_pages, opt, logger)
+    renamed, removed = [], []
+    for node in unverified:
+        heading = next((item for item in new_headings if item['physical_index'] == node['start_index']), None)
+        if heading is None:
+            removed.append(node)
+            continue
+        new_headings.remove(heading)
+        renamed.append({'old_title': node['title'], 'new_title': heading['title']})
+        node['title'] = heading['title']
+    removed_ids = {id(node) for node in removed}
+    if removed_ids:
+        structure[:] = _remove_nodes(structure, removed_ids)
+        flat_nodes = [node for node in flat_nodes if id(node) not in removed_ids]
+        _recompute_ends(structure, new_total, old_total, old_ranges, opcodes, new_total)
+    inserted = [_insert_heading(structure, item) for item in new_headings]
+
+    # 4. 页面范围涉及变化页面（或范围内有页面被删除）、或标题被改写的节点标记为需要更新
+    unverified_ids = {id(node) for node in unverified}
+    dirty = []
+    for node in flat_nodes:
+        old_start, old_end = old_ranges[id(node)]
+        if (_node_pages(node) & changed_pages) or (node['end_index'] - node['start_index']) != (old_end - old_start) \
+                or id(node) in unverified_ids:
+            dirty.append(node)
+    dirty_ids = {id(node) for node in dirty}
+
+    # 5. 变化后的叶子节点和新节点如果超出大小限制，按原流程继续拆分
+    split_nodes = [node for node in dirty + inserted if not node.get('nodes')]
+    await split_large_nodes(split_nodes, page_list, opt, logger=logger)
+    new_nodes = [node for node in structure_to_list(structure) if id(node) not in old_ranges]
+
+    if opt.if_add_node_id == 'yes':
+        write_node_id(structure)
+
+    # 6. 只为变化节点和新节点重新生成摘要，其余节点复用原摘要
+    resummarized = []
+    report_usage = {}
+    if opt.if_add_node_summary == 'yes':
+        add_node_text(structure, page_list)
+        needs_summary = lambda node: id(node) in dirty_ids or id(node) not in old_ranges
+        resummarized = [
+            node['title'] for node in structure_to_list(structure)
+            if needs_summary(node) or not node.get('summary')
+        ]
+        report_usage = await SummaryEngine.from_opt(opt, logger=logger).run(structure, needs_summary=needs_summary, page_list=page_list)
+    if opt.if_add_node_text == 'yes':
+        add_node_text(structure, text_page_list or page_list)
+    else:
+        remove_structure_text(structure)
+
+    updated_nodes = [
+        {
+            'title': node['title'],
+            'node_id': node.get('node_id'),
+            'old_range': list(old_ranges[id(node)]),
+            'new_range': [node['start_index'], node['end_index']],
+        }
+        for node in dirty
+    ]
+    return {
+        'structure': structure,
+        'updated_nodes': updated_nodes,
+        'reused_nodes': len(flat_nodes) - len(dirty),
+        'new_nodes': [node['title'] for node in new_nodes],
+        'reverified_nodes': len(candidates),
+        'fixed_nodes': fixed,
+        'renamed_nodes': renamed,
+        'removed_nodes': [node['title'] for node in removed],
+        'resummarized_nodes': resummarized,
+        'summary_usage': report_usage,
+    }
+
+
+def page_index_incremental(doc, previous_result: Optional[Dict[str, Any]], opt=None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    增量处理修订后的 PDF
+
+    上一版本结果缺少页面哈希、或变化页面比例超过 incremental_max_changed_ratio 时，退回完整处理。
+
+    参数:
+        doc: 新版本 PDF 文件路径、BytesIO 对象或 PdfDocument
+        previous_result: 上一版本的处理结果（page_index_main 的返回值）
+        opt: 处理配置
+
+    返回:
+        (新的处理结果, 差异报告)
+    """
+    pdf = PdfDocument.open(doc)
+    try:
+        return _update_document(pdf, previous_result, opt)
+    finally:
+        if pdf is not doc:
+            pdf.close()
+
+
+def _update_document(pdf, previous_result, opt):
+    old_hashes = (previous_result or {}).get('page_hashes')
+    if not old_hashes:
+        print('上一版本结果缺少页面哈希，执行完整处理')
+        return page_index_main(pdf, opt), {'mode': 'full', 'reason': 'no_previous_page_hashes'}
+
+    with JsonLogger(pdf) as logger:
+        page_list = get_page_tokens(pdf)
+        new_hashes = compute_page_hashes(page_list)
+        diff = diff_pages(old_hashes, new_hashes)
+
+        report = {
+            'mode': 'incremental',
+            'old_page_count': diff['old_page_count'],
+            'new_page_count': diff['new_page_count'],
+            'changed_pages': diff['changed_pages'],
+            'deleted_pages': diff['deleted_pages'],
+            'unchanged_page_count': diff['new_page_count'] - len(diff['changed_pages']),
+        }
+        logger.info({'incremental_diff': report})
+
+        max_ratio = getattr(opt, 'incremental_max_changed_ratio', 0.5)
+        changed_ratio = (len(diff['changed_pages']) + len(diff['deleted_pages'])) / max(len(old_hashes), len(new_hashes), 1)
+        if changed_ratio > max_ratio:
+            print(f'变化页面比例 {changed_ratio:.0%} 超过阈值 {max_ratio:.0%}，执行完整处理')
+            report.update({'mode': 'full', 'reason': 'too_many_changes', 'changed_ratio': changed_ratio})
+            return page_index_main(pdf, opt), report
+
+        doc_name = pdf.name
+        if not diff['changed_pages'] and not diff['deleted_pages']:
+            print(f'{doc_name} 内容未变化，复用上一版本结果')
+            result = copy.deepcopy(previous_result)
+            result['doc_name'] = doc_name
+            report.update({'reused_nodes': len(structure_to_list(result['structure'])), 'updated_nodes': []})
+            return result, report
+
+        print(f'检测到 {len(diff["changed_pages"])} 个变化页面、{len(diff["deleted_pages"])} 个删除页面，增量更新中...')
+        # 页面哈希基于原文，提示词使用规范化后的文本
+        prompt_page_list = page_list
+        if getattr(opt, 'if_normalize_pages', 'yes') == 'yes':
+            prompt_page_list, norm_stats = normalize_page_list(
+                page_list, model=opt.model, min_repeat_ratio=getattr(opt, 'page_header_repeat_ratio', 0.5))
+            logger.info({'page_normalization': norm_stats})
+        try:
+            with collect_llm_metrics() as metrics:
+                node_report = run_async(update_structure(previous_result, prompt_page_list, diff, opt, logger,
+                                                         text_page_list=page_list))
+        except IncrementalFallback as e:
+            print(f'{e}，执行完整处理')
+            report.update({'mode': 'full', 'reason': 'reextract_failed', 'error': str(e)})
+            return page_index_main(pdf, opt), report
+        structure = node_report.pop('structure')
+        report.update(node_report)
+
+        doc_description = previous_result.get('doc_description', '')
+        if opt.if_add_doc_description == 'yes' and (node_report['updated_nodes'] or not doc_description):
+            clean_structure = create_clean_structure_for_description(structure)
+            with collect_llm_metrics(metrics):
+                doc_description = generate_doc_description(clean_structure, model=opt.model)
+
+        result = {
+            'doc_name': doc_name,
+            'structure': structure,
+        }
+        if doc_description:
+            result['doc_description'] = doc_description
+        result['page_hashes'] = new_hashes
+        result['llm_metrics'] = metrics.summary()
+
+        # 增量更新向量索引（复用未变化节点的 embedding）
+        if getattr(opt, 'if_build_vector_index', 'yes') == 'yes':
+            try:
+                from .vector_index import update_index_for_document
+                print(f"正在增量更新 {doc_name} 的向量索引...")
+                report['embeddings'] = update_index_for_document(doc_name, structure, doc_description)
+            except Exception as e:
+                print(f"向量索引更新失败: {e}")
+
+        logger.info({'incremental_report': report})
+        return result, report
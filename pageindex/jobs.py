@@ -0,0 +1,450 @@
+"""
+PageIndex 后台导入任务模块
+
+上传的文档先写入本地 SQLite 任务队列，再由可配置数量的导入线程依次领取处理。
+每个任务记录状态、当前阶段和各阶段进度（来自 run_stage 的阶段事件），支持取消（在阶段开始和每次 LLM 请求前检查）；
+服务重启后，中断时仍在运行的任务会重新排队，并从检查点继续执行。
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .utils import run_async, llm_cancel_check
+from .checkpoint import STAGES, report_stage_progress
+from .storage import load_result, result_exists
+from .catalog import DocumentCatalog, get_catalog
+
+# 任务队列数据库路径
+JOB_DB_PATH = os.getenv("PAGEINDEX_JOB_DB", "./jobs/queue.db")
+# 导入线程数
+INGEST_WORKERS = int(os.getenv("PAGEINDEX_INGEST_WORKERS", "2"))
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+PDF_EXTENSIONS = (".pdf",)
+MD_EXTENSIONS = (".md", ".markdown")
+
+# 非导入类任务（多进程部署时由查询进程提交，写入进程执行）：options["action"] 为任务类型
+REBUILD_INDEX = "rebuild_index"
+DELETE_INDEX = "delete_index"
+DELETE_DOCUMENT = "delete_document"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    stages TEXT NOT NULL DEFAULT '{}',
+    options TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    result_path TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobCancelled(BaseException):
+    """
+    任务被取消（在下一个阶段开始或下一次 LLM 请求之前抛出）
+
+    与 asyncio.CancelledError 一样继承 BaseException，避免被流程中的降级逻辑（except Exception）吞掉
+    """
+
+
+class JobConflict(ValueError):
+    """已有排队中或运行中的任务写入同一个结果文件"""
+
+    def __init__(self, message: str, job_id: str):
+        super().__init__(message)
+        self.job_id = job_id
+
+
+def output_name(filename: str) -> str:
+    """任务结果的文档名（结果保存为 <文档名>_structure.json）"""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JobStore:
+    """
+    SQLite 持久化的任务队列
+
+    参数:
+        db_path: 数据库文件路径
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["stages"] = json.loads(job["stages"] or "{}")
+        job["options"] = json.loads(job["options"] or "{}")
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def create(self, path: str, filename: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+               job_id: Optional[str] = None, unique_output: bool = False) -> Dict[str, Any]:
+        """
+        新建排队中的任务
+
+        参数:
+            job_id: 任务 ID，默认自动生成（上传文件需要先按任务 ID 保存时由调用方生成）
+            unique_output: 为 True 时，如果已有排队中或运行中的导入任务写入同一个结果文件，抛出 JobConflict
+                （处理完成后再上传同名文档仍会作为该文档的新版本处理）
+        """
+        job_id = job_id or uuid.uuid4().hex
+        filename = filename or os.path.basename(path)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if unique_output:
+                    rows = self._conn.execute(
+                        "SELECT id, filename, options FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+                    for row in rows:
+                        if not json.loads(row["options"] or "{}").get("action") and \
+                                output_name(row["filename"]) == output_name(filename):
+                            raise JobConflict(f"同名文档 {row['filename']} 正在处理（任务 {row['id']}），请在其完成后再上传",
+                                              row["id"])
+                self._conn.execute(
+                    "INSERT INTO jobs (id, path, filename, status, options, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, path, filename, QUEUED, json.dumps(options or {}), _now()),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def create_action(self, action: str, target: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """新建非导入类任务（重建索引、删除文档等），target 为操作对象的名称"""
+        return self.create("", target, options=dict(options or {}, action=action))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """按创建时间倒序列出任务"""
+        with self._lock:
+            if status:
+                rows = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """领取最早排队的任务并标记为运行中，没有任务时返回 None"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (RUNNING, _now(), row["id"]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def update_progress(self, job_id: str, stage: str, progress: float, stages: Dict[str, Any]) -> bool:
+        """
+        更新当前阶段和进度
+
+        返回:
+            是否已请求取消
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, stages = ? WHERE id = ?",
+                (stage, progress, json.dumps(stages), job_id),
+            )
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None, result_path: Optional[str] = None):
+        """记录任务结束状态"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, result_path = ?, finished_at = ?, "
+                "progress = CASE WHEN ? = ? THEN 1 ELSE progress END WHERE id = ?",
+                (status, error, result_path, _now(), status, SUCCEEDED, job_id),
+            )
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def request_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取消任务：排队中的任务直接取消，运行中的任务在下一个阶段开始或下一次 LLM 请求之前停止
+
+        返回:
+            更新后的任务，任务不存在时返回 None
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, _now(), job_id, QUEUED),
+            )
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def requeue_interrupted(self) -> int:
+        """将上次服务退出时仍在运行的任务重新排队（从检查点继续），返回任务数"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_requested THEN ? ELSE ? END, "
+                "finished_at = CASE WHEN cancel_requested THEN ? ELSE NULL END WHERE status = ?",
+                (CANCELLED, QUEUED, _now(), RUNNING),
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class StageTracker:
+    """
+    把 run_stage 的阶段事件转换为任务进度
+
+    阶段可能嵌套或重复执行（例如大节点拆分会再次执行目录相关阶段），
+    进度取已完成阶段在 STAGES 中的最大位置，保证单调递增。
+    check_cancelled 在每次 LLM 请求前调用（见 utils.llm_cancel_check），长阶段中途也能及时停止。
+
+    参数:
+        cancel_check_interval: 两次查询取消标记的最短间隔（秒）
+    """
+
+    def __init__(self, store: JobStore, job_id: str, cancel_check_interval: float = 1.0):
+        self.store = store
+        self.job_id = job_id
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.progress = 0.0
+        self.cancel_check_interval = cancel_check_interval
+        self._cancelled = False
+        self._checked_at = 0.0
+        self._started: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def check_cancelled(self):
+        """已请求取消时抛出 JobCancelled"""
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked_at >= self.cancel_check_interval:
+            self._checked_at = now
+            self._cancelled = self.store.is_cancel_requested(self.job_id)
+        if self._cancelled:
+            raise JobCancelled(self.job_id)
+
+    def __call__(self, stage: str, event: str):
+        with self._lock:
+            info = self.stages.setdefault(stage, {"status": "running", "runs": 0, "seconds": 0.0})
+            if event == "start":
+                info["status"] = "running"
+                self._started.setdefault(stage, []).append(time.perf_counter())
+            else:
+                info["runs"] += 1
+                starts = self._started.get(stage)
+                if starts:
+                    info["seconds"] = round(info["seconds"] + time.perf_counter() - starts.pop(), 3)
+                if not starts:
+                    info["status"] = "done"
+                if stage in STAGES:
+                    self.progress = max(self.progress, (STAGES.index(stage) + 1) / len(STAGES))
+            cancel_requested = self.store.update_progress(self.job_id, stage, round(self.progress, 3), self.stages)
+            self._cancelled = self._cancelled or cancel_requested
+        if cancel_requested and event == "start":
+            raise JobCancelled(self.job_id)
+
+
+class IngestionWorkerPool:
+    """
+    后台导入线程池
+
+    参数:
+        store: 任务队列
+        build_options: 根据任务选项返回处理配置的函数 build_options(job_options, resume)
+        workers: 导入线程数
+        results_dir: 结果目录，每个文档保存为 <文档名>_structure.json
+        poll_interval: 队列为空时的轮询间隔（秒）
+        catalog: 文档目录，默认使用全局实例
+        actions: 非导入类任务的处理函数 {任务类型: handler(job_options)}
+        on_change: 任务成功完成（文档或索引可能已变化）后调用
+    """
+
+    def __init__(self, store: JobStore, build_options, workers: int = INGEST_WORKERS, results_dir: str = "./results",
+                 poll_interval: float = 1.0, catalog: Optional[DocumentCatalog] = None,
+                 actions: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None,
+                 on_change: Optional[Callable[[], None]] = None):
+        self.store = store
+        self.build_options = build_options
+        self.workers = max(1, workers)
+        self.results_dir = results_dir
+        self.catalog = catalog
+        self.actions = actions or {}
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """重新排队中断的任务并启动导入线程"""
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            print(f"[jobs] {requeued} 个中断的任务已重新排队")
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"pageindex-ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止领取新任务并等待正在处理的任务结束"""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """有新任务时唤醒空闲线程"""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            job = self.store.claim_next()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self.run_job(job)
+
+    def output_path(self, job: Dict[str, Any]) -> str:
+        return os.path.join(self.results_dir, f"{output_name(job['filename'])}_structure.json")
+
+    def _process(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        from .page_index import page_index_main
+        from .page_index_md import md_to_tree
+        from .incremental import page_index_incremental
+
+        path = job["path"]
+        job_options = job["options"]
+        # 重新排队的任务（已开始过）从检查点继续
+        opt = self.build_options(job_options, resume=job_options.get("resume") or bool(job["stages"]))
+        output_file = self.output_path(job)
+
+        if path.lower().endswith(PDF_EXTENSIONS):
+            previous_result = None
+            if result_exists(output_file):
+                previous_result = load_result(output_file, with_text=True)
+            if previous_result and previous_result.get("page_hashes"):
+                # 同名文档的新版本：只重新处理变化的页面
+                result, _ = page_index_incremental(path, previous_result, opt)
+                return result
+            return page_index_main(path, opt)
+        if path.lower().endswith(MD_EXTENSIONS):
+            return run_async(md_to_tree(
+                md_path=path,
+                if_thinning=False,
+                if_add_node_summary=opt.if_add_node_summary == "yes",
+                model=opt.model,
+                if_add_doc_description=opt.if_add_doc_description == "yes",
+                if_add_node_text=True,  # Markdown 文件保留完整文本以支持检索
+                if_add_node_id=True,
+                if_build_vector_index=True,
+            ))
+        raise ValueError(f"不支持的文件类型: {job['filename']}")
+
+    def _changed(self):
+        if self.on_change is not None:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"[jobs] 变更通知失败: {e}")
+
+    def _run_action(self, job: Dict[str, Any], action: str):
+        job_id = job["id"]
+        print(f"[jobs] 开始执行 {action} {job['filename']} ({job_id})")
+        try:
+            handler = self.actions.get(action)
+            if handler is None:
+                raise ValueError(f"不支持的任务类型: {action}")
+            handler(job["options"])
+            self.store.finish(job_id, SUCCEEDED)
+            print(f"[jobs] {action} {job['filename']} 完成")
+            self._changed()
+        except Exception as e:
+            self.store.finish(job_id, FAILED, error=f"{type(e).__name__}: {e}")
+            print(f"[jobs] {action} {job['filename']} 失败: {e}")
+
+    def run_job(self, job: Dict[str, Any]):
+        """处理一个已领取的任务并记录结果"""
+        action = job["options"].get("action")
+        if action:
+            self._run_action(job, action)
+            return
+        job_id = job["id"]
+        tracker = StageTracker(self.store, job_id)
+        catalog = self.catalog or get_catalog()
+        output_file = self.output_path(job)
+        print(f"[jobs] 开始处理 {job['filename']} ({job_id})")
+        start = time.perf_counter()
+        try:
+            catalog.mark_processing(output_file, job["path"], display_name=job["filename"])
+            with report_stage_progress(tracker), llm_cancel_check(tracker.check_cancelled):
+                result = self._process(job)
+            os.makedirs(self.results_dir, exist_ok=True)
+            catalog.save_document(result, output_file, source_path=job["path"], seconds=time.perf_counter() - start,
+                                  display_name=job["filename"])
+            self.store.finish(job_id, SUCCEEDED, result_path=output_file)
+            print(f"[jobs] {job['filename']} 处理完成")
+            self._changed()
+        except JobCancelled:
+            catalog.mark_failed(output_file, "已取消")
+            self.store.finish(job_id, CANCELLED)
+            print(f"[jobs] {job['filename']} 已取消")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            catalog.mark_failed(output_file, error)
+            self.store.finish(job_id, FAILED, error=error)
+            print(f"[jobs] {job['filename']} 处理失败: {e}")
@@ -0,0 +1,207 @@
+"""
+PageIndex LLM 调用统计模块
+
+为每次 LLM 调用标记所属的处理阶段（toc_detect、toc_transform、index_extract、verify、fix、
+large_node、summary、description），按文档汇总调用次数、token 用量（来自接口返回的 usage 字段）、
+重试次数、JSON 本地修复/解析失败次数和耗时分位数，便于定位成本最高的阶段。
+"""
+
+import json
+import math
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+DEFAULT_STAGE = "other"
+
+# 当前调用所属阶段，以及该阶段是否独占（独占时内部嵌套的阶段不再覆盖）
+_current_stage = contextvars.ContextVar("pageindex_llm_stage", default=(DEFAULT_STAGE, False))
+# 当前文档的统计收集器
+_current_metrics = contextvars.ContextVar("pageindex_llm_metrics", default=None)
+
+
+@contextmanager
+def llm_stage(stage: str, exclusive: bool = False):
+    """
+    标记代码块内 LLM 调用所属的阶段
+
+    参数:
+        stage: 阶段名称
+        exclusive: 为 True 时代码块内的所有调用都计入该阶段（例如大节点递归内部的校验和修正）
+    """
+    current, current_exclusive = _current_stage.get()
+    if current_exclusive:
+        yield
+        return
+    token = _current_stage.set((stage, exclusive))
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_stage() -> str:
+    """获取当前阶段名称"""
+    return _current_stage.get()[0]
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class LLMMetrics:
+    """
+    单个文档的 LLM 调用统计（线程安全，可在 asyncio.to_thread 的工作线程中记录）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def _entry(self, stage: str) -> Dict[str, Any]:
+        return self._stages.setdefault(stage, {
+            "calls": 0,
+            "errors": 0,
+            "retries": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "json_repairs": 0,
+            "json_failures": 0,
+            "latencies": [],
+            "models": set(),
+        })
+
+    def record(self, stage: str, model: str = None, prompt_tokens: int = 0, completion_tokens: int = 0,
+               latency: float = 0.0, retries: int = 0, error: bool = False):
+        """记录一次 LLM 调用"""
+        with self._lock:
+            entry = self._entry(stage)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["retries"] += retries
+            entry["prompt_tokens"] += prompt_tokens or 0
+            entry["completion_tokens"] += completion_tokens or 0
+            entry["latencies"].append(latency)
+            if model:
+                entry["models"].add(model)
+
+    def stage_usage(self, stage: str) -> Dict[str, int]:
+        """某阶段目前的调用次数和 token 用量"""
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            return {key: entry[key] for key in ("calls", "prompt_tokens", "completion_tokens")}
+
+    def record_json(self, stage: str, repaired: bool = False, failed: bool = False):
+        """记录一次 JSON 本地修复或解析失败"""
+        with self._lock:
+            entry = self._entry(stage)
+            entry["json_repairs"] += int(repaired)
+            entry["json_failures"] += int(failed)
+
+    @staticmethod
+    def _summarize(entry: Dict[str, Any]) -> Dict[str, Any]:
+        latencies = entry["latencies"]
+        return {
+            "calls": entry["calls"],
+            "errors": entry["errors"],
+            "retries": entry["retries"],
+            "prompt_tokens": entry["prompt_tokens"],
+            "completion_tokens": entry["completion_tokens"],
+            "total_tokens": entry["prompt_tokens"] + entry["completion_tokens"],
+            "json_repairs": entry["json_repairs"],
+            "json_failures": entry["json_failures"],
+            "latency_total": round(sum(latencies), 3),
+            "latency_p50": round(_percentile(latencies, 50), 3),
+            "latency_p90": round(_percentile(latencies, 90), 3),
+            "latency_p99": round(_percentile(latencies, 99), 3),
+            "latency_max": round(max(latencies), 3) if latencies else 0.0,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总统计
+
+        返回:
+            {"stages": {阶段: 统计}, "total": 全部调用的统计}
+        """
+        with self._lock:
+            stages = {stage: self._summarize(entry) for stage, entry in sorted(self._stages.items())}
+            total = {
+                "calls": 0, "errors": 0, "retries": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "json_repairs": 0, "json_failures": 0, "latencies": [],
+            }
+            for entry in self._stages.values():
+                for key in ("calls", "errors", "retries", "prompt_tokens", "completion_tokens", "json_repairs", "json_failures"):
+                    total[key] += entry[key]
+                total["latencies"].extend(entry["latencies"])
+        return {"stages": stages, "total": self._summarize(total)}
+
+    def save(self, path: str):
+        """将汇总统计写入 JSON 文件"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+
+@contextmanager
+def collect_llm_metrics(metrics: Optional[LLMMetrics] = None):
+    """
+    在代码块内收集 LLM 调用统计
+
+    用法:
+        with collect_llm_metrics() as metrics:
+            ...
+        metrics.summary()
+    """
+    metrics = metrics or LLMMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def current_llm_metrics() -> Optional[LLMMetrics]:
+    """当前的统计收集器，未处于 collect_llm_metrics 中时返回 None"""
+    return _current_metrics.get()
+
+
+def record_llm_call(model: str = None, usage: Any = None, latency: float = 0.0, retries: int = 0, error: bool = False):
+    """
+    由 LLM 调用函数在每次调用结束后记录统计；未处于 collect_llm_metrics 中时不做任何事
+
+    参数:
+        model: 模型名称
+        usage: 接口返回的 usage 对象（包含 prompt_tokens / completion_tokens）
+        latency: 调用耗时（秒，包含重试）
+        retries: 重试次数
+        error: 是否最终失败
+    """
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return
+    metrics.record(
+        current_stage(),
+        model=model,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) if usage is not None else 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) if usage is not None else 0,
+        latency=latency,
+        retries=retries,
+        error=error,
+    )
+
+
+def record_json_parse(repaired: bool = False, failed: bool = False):
+    """
+    由 JSON 解析函数记录本地修复或解析失败；未处于 collect_llm_metrics 中时不做任何事
+    """
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return
+    metrics.record_json(current_stage(), repaired=repaired, failed=failed)
@@ -4,7 +4,14 @@ import copy
 import math
 import random
 import re
+import time
+import hashlib
+import threading
 from .utils import *
+from .checkpoint import JobCheckpoint, run_stage, run_stage_async
+from .summary import SummaryEngine
+from .metrics import collect_llm_metrics, llm_stage
+from .grouping import TaggedPageCache, group_pages, plan_page_groups
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -36,15 +43,144 @@ async def check_title_appearance(item, page_list, start_index=1, model=None):
     }}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = await ChatGPT_API_async(model=model, prompt=prompt)
+    response = await ChatGPT_API_async(model=model, prompt=prompt, json_mode=True)
     response = extract_json(response)
-    if 'answer' in response:
-        answer = response['answer']
-    else:
-        answer = 'no'
+    answer = response.get('answer', 'no') if isinstance(response, dict) else 'no'
     return {'list_index': item['list_index'], 'answer': answer, 'title': title, 'page_number': page_number}
 
 
+def group_items_by_page_window(items, start_index=1, page_window=1, max_batch_size=10):
+    """
+    Group toc items whose physical_index falls in the same window of page_window pages,
+    so each group can be verified with one prompt. Groups are capped at max_batch_size items.
+    """
+    groups = {}
+    for item in items:
+        key = (item['physical_index'] - start_index) // max(page_window, 1)
+        groups.setdefault(key, []).append(item)
+
+    batches = []
+    for key in sorted(groups):
+        group = groups[key]
+        for i in range(0, len(group), max_batch_size):
+            batches.append(group[i:i + max_batch_size])
+    return batches
+
+
+def parse_batch_answers(response, num_items, answer_key='answer'):
+    """
+    Parse a JSON array of {"index": k, "<answer_key>": "yes/no"} replies.
+    Returns a dict of 1-based index -> answer, only for well-formed entries.
+    """
+    json_content = extract_json_list(response)
+
+    answers = {}
+    for entry in json_content:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = int(entry.get('index'))
+        except (TypeError, ValueError):
+            continue
+        answer = str(entry.get(answer_key, '')).strip().lower()
+        if 1 <= index <= num_items and answer in ('yes', 'no'):
+            answers[index] = answer
+    return answers
+
+
+async def check_title_appearance_batch(items, page_list, start_index=1, model=None):
+    """
+    Check several toc items that live on the same page (or page window) with one prompt.
+    The page text is sent once together with all the titles; items whose answer cannot be
+    parsed from the reply fall back to check_title_appearance.
+    """
+    if len(items) == 1:
+        return [await check_title_appearance(items[0], page_list, start_index, model)]
+
+    page_numbers = sorted({item['physical_index'] for item in items})
+    page_texts = ""
+    for page_number in page_numbers:
+        page_texts += f"<physical_index_{page_number}>\n{page_list[page_number-start_index][0]}\n<physical_index_{page_number}>\n\n"
+
+    section_lines = "\n".join(
+        f"{i}. title: {item['title']}, page: <physical_index_{item['physical_index']}>"
+        for i, item in enumerate(items, 1)
+    )
+
+    prompt = f"""
+    Your job is to check, for each of the given sections, if the section appears or starts in its given page.
+
+    Note: do fuzzy matching, ignore any space inconsistency in the page text.
+
+    The provided pages contain tags like <physical_index_X> and <physical_index_X> to indicate the start and end of page X.
+
+    The given sections are:
+    {section_lines}
+
+    The given pages are:
+    {page_texts}
+
+    Reply format:
+    [
+        {{
+            "index": <index of the section in the given list>,
+            "answer": "yes or no" (yes if the section appears or starts in its page, no otherwise)
+        }},
+        ...
+    ]
+    Directly return the final JSON structure. Do not output anything else."""
+
+    response = await ChatGPT_API_async(model=model, prompt=prompt)
+    answers = parse_batch_answers(response, len(items))
+
+    results = [None] * len(items)
+    fallback_tasks = []
+    fallback_positions = []
+    for i, item in enumerate(items):
+        if i + 1 in answers:
+            results[i] = {'list_index': item['list_index'], 'answer': answers[i + 1], 'title': item['title'], 'page_number': item['physical_index']}
+        else:
+            fallback_tasks.append(check_title_appearance(item, page_list, start_index, model))
+            fallback_positions.append(i)
+
+    if fallback_tasks:
+        print(f'batch verification fell back to single checks for {len(fallback_tasks)} items')
+        fallback_results = await asyncio.gather(*fallback_tasks)
+        for position, result in zip(fallback_positions, fallback_results):
+            results[position] = result
+    return results
+
+
+async def check_title_appearance_batched(items, page_list, start_index=1, model=None, page_window=1, max_batch_size=10):
+    """
+    Verify toc items with batched prompts grouped by page window.
+    Returns the results in the same order as items.
+    """
+    results = [None] * len(items)
+    valid_positions = []
+    for i, item in enumerate(items):
+        if item.get('physical_index') is None:
+            results[i] = {'list_index': item.get('list_index'), 'answer': 'no', 'title': item['title'], 'page_number': None}
+        else:
+            valid_positions.append(i)
+
+    positions_by_id = {id(items[i]): i for i in valid_positions}
+    batches = group_items_by_page_window(
+        [items[i] for i in valid_positions],
+        start_index=start_index,
+        page_window=page_window,
+        max_batch_size=max_batch_size
+    )
+    batch_results = await asyncio.gather(*[
+        check_title_appearance_batch(batch, page_list, start_index, model)
+        for batch in batches
+    ])
+    for batch, batch_result in zip(batches, batch_results):
+        for item, result in zip(batch, batch_result):
+            results[positions_by_id[id(item)]] = result
+    return results
+
+
 async def check_title_appearance_in_start(title, page_text, model=None, logger=None):    
     prompt = f"""
     You will be given the current section title and the current page_text.
@@ -64,39 +200,98 @@ async def check_title_appearance_in_start(title, page_text, model=None, logger=N
     }}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = await ChatGPT_API_async(model=model, prompt=prompt)
+    response = await ChatGPT_API_async(model=model, prompt=prompt, json_mode=True)
     response = extract_json(response)
     if logger:
         logger.info(f"Response: {response}")
-    return response.get("start_begin", "no")
+    return response.get("start_begin", "no") if isinstance(response, dict) else "no"
+
+
+async def check_title_appearance_in_start_batch(titles, page_text, model=None, logger=None):
+    """
+    Check for several section titles on the same page which one starts in the beginning of the page.
+    The page text is sent once; titles whose answer cannot be parsed fall back to
+    check_title_appearance_in_start.
+    """
+    if len(titles) == 1:
+        return [await check_title_appearance_in_start(titles[0], page_text, model=model, logger=logger)]
+
+    section_lines = "\n".join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+    prompt = f"""
+    You will be given several section titles and the current page_text.
+    Your job is to check, for each section, if the section starts in the beginning of the given page_text.
+    If there are other contents before the section title, then the section does not start in the beginning of the given page_text.
+    If the section title is the first content in the given page_text, then the section starts in the beginning of the given page_text.
+
+    Note: do fuzzy matching, ignore any space inconsistency in the page_text.
 
+    The given section titles are:
+    {section_lines}
 
-async def check_title_appearance_in_start_concurrent(structure, page_list, model=None, logger=None):
+    The given page_text is {page_text}.
+
+    reply format:
+    [
+        {{
+            "index": <index of the section in the given list>,
+            "start_begin": "yes or no" (yes if the section starts in the beginning of the page_text, no otherwise)
+        }},
+        ...
+    ]
+    Directly return the final JSON structure. Do not output anything else."""
+
+    response = await ChatGPT_API_async(model=model, prompt=prompt)
+    answers = parse_batch_answers(response, len(titles), answer_key='start_begin')
+    if logger:
+        logger.info(f"Batch start response: {answers}")
+
+    results = [answers.get(i + 1) for i in range(len(titles))]
+    missing = [i for i, answer in enumerate(results) if answer is None]
+    if missing:
+        fallback_results = await asyncio.gather(*[
+            check_title_appearance_in_start(titles[i], page_text, model=model, logger=logger)
+            for i in missing
+        ])
+        for i, answer in zip(missing, fallback_results):
+            results[i] = answer
+    return results
+
+
+async def check_title_appearance_in_start_concurrent(structure, page_list, model=None, logger=None, max_batch_size=10):
     if logger:
         logger.info("Checking title appearance in start concurrently")
-    
+
     # skip items without physical_index
     for item in structure:
         if item.get('physical_index') is None:
             item['appear_start'] = 'no'
 
-    # only for items with valid physical_index
-    tasks = []
-    valid_items = []
+    # only for items with valid physical_index, batched by page so each page text is sent once
+    items_by_page = {}
     for item in structure:
         if item.get('physical_index') is not None:
-            page_text = page_list[item['physical_index'] - 1][0]
-            tasks.append(check_title_appearance_in_start(item['title'], page_text, model=model, logger=logger))
-            valid_items.append(item)
+            items_by_page.setdefault(item['physical_index'], []).append(item)
 
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    for item, result in zip(valid_items, results):
+    tasks = []
+    batches = []
+    for physical_index, page_items in items_by_page.items():
+        page_text = page_list[physical_index - 1][0]
+        for i in range(0, len(page_items), max_batch_size):
+            batch = page_items[i:i + max_batch_size]
+            tasks.append(check_title_appearance_in_start_batch([item['title'] for item in batch], page_text, model=model, logger=logger))
+            batches.append(batch)
+
+    with llm_stage('verify'):
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    for batch, result in zip(batches, results):
         if isinstance(result, Exception):
-            if logger:
-                logger.error(f"Error checking start for {item['title']}: {result}")
-            item['appear_start'] = 'no'
+            for item in batch:
+                if logger:
+                    logger.error(f"Error checking start for {item['title']}: {result}")
+                item['appear_start'] = 'no'
         else:
-            item['appear_start'] = result
+            for item, answer in zip(batch, result):
+                item['appear_start'] = answer
 
     return structure
 
@@ -116,10 +311,9 @@ def toc_detector_single_page(content, model=None):
     Directly return the final JSON structure. Do not output anything else.
     Please note: abstract,summary, notation list, figure list, table list, etc. are not table of contents."""
 
-    response = ChatGPT_API(model=model, prompt=prompt)
-    # print('response', response)
+    response = ChatGPT_API(model=model, prompt=prompt, json_mode=True)
     json_content = extract_json(response)    
-    return json_content['toc_detected']
+    return json_content.get('toc_detected', 'no') if isinstance(json_content, dict) else 'no'
 
 
 def check_if_toc_extraction_is_complete(content, toc, model=None):
@@ -135,9 +329,9 @@ def check_if_toc_extraction_is_complete(content, toc, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = prompt + '\n Document:\n' + content + '\n Table of contents:\n' + toc
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = ChatGPT_API(model=model, prompt=prompt, json_mode=True)
     json_content = extract_json(response)
-    return json_content['completed']
+    return json_content.get('completed', 'no') if isinstance(json_content, dict) else 'no'
 
 
 def check_if_toc_transformation_is_complete(content, toc, model=None):
@@ -153,9 +347,9 @@ def check_if_toc_transformation_is_complete(content, toc, model=None):
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = prompt + '\n Raw Table of contents:\n' + content + '\n Cleaned Table of contents:\n' + toc
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = ChatGPT_API(model=model, prompt=prompt, json_mode=True)
     json_content = extract_json(response)
-    return json_content['completed']
+    return json_content.get('completed', 'no') if isinstance(json_content, dict) else 'no'
 
 def extract_toc_content(content, model=None):
     prompt = f"""
@@ -212,9 +406,9 @@ def detect_page_index(toc_content, model=None):
     }}
     Directly return the final JSON structure. Do not output anything else."""
 
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = ChatGPT_API(model=model, prompt=prompt, json_mode=True)
     json_content = extract_json(response)
-    return json_content['page_index_given_in_toc']
+    return json_content.get('page_index_given_in_toc', 'no') if isinstance(json_content, dict) else 'no'
 
 def toc_extractor(page_list, toc_page_list, model):
     def transform_dots_to_colon(text):
@@ -262,7 +456,7 @@ def toc_index_extractor(toc, content, model=None):
 
     prompt = tob_extractor_prompt + '\nTable of contents:\n' + str(toc) + '\nDocument pages:\n' + content
     response = ChatGPT_API(model=model, prompt=prompt)
-    json_content = extract_json(response)    
+    json_content = extract_json_list(response)    
     return json_content
 
 
@@ -289,11 +483,10 @@ def toc_transformer(toc_content, model=None):
     Directly return the final JSON structure, do not output anything else. """
 
     prompt = init_prompt + '\n Given table of contents\n:' + toc_content
-    last_complete, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt)
+    last_complete, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt, json_mode=True)
     if_complete = check_if_toc_transformation_is_complete(toc_content, last_complete, model)
     if if_complete == "yes" and finish_reason == "finished":
-        last_complete = extract_json(last_complete)
-        cleaned_response=convert_page_to_int(last_complete['table_of_contents'])
+        cleaned_response=convert_page_to_int(extract_json_list(last_complete, key='table_of_contents'))
         return cleaned_response
     
     last_complete = get_json_content(last_complete)
@@ -322,9 +515,7 @@ def toc_transformer(toc_content, model=None):
         if_complete = check_if_toc_transformation_is_complete(toc_content, last_complete, model)
         
 
-    last_complete = json.loads(last_complete)
-
-    cleaned_response=convert_page_to_int(last_complete['table_of_contents'])
+    cleaned_response=convert_page_to_int(extract_json_list(last_complete, key='table_of_contents'))
     return cleaned_response
     
 
@@ -416,39 +607,10 @@ def add_page_offset_to_toc_json(data, offset):
 
 
 def page_list_to_group_text(page_contents, token_lengths, max_tokens=20000, overlap_page=1):    
-    num_tokens = sum(token_lengths)
-    
-    if num_tokens <= max_tokens:
-        # merge all pages into one text
-        page_text = "".join(page_contents)
-        return [page_text]
-    
-    subsets = []
-    current_subset = []
-    current_token_count = 0
-
-    expected_parts_num = math.ceil(num_tokens / max_tokens)
-    average_tokens_per_part = math.ceil(((num_tokens / expected_parts_num) + max_tokens) / 2)
-    
-    for i, (page_content, page_tokens) in enumerate(zip(page_contents, token_lengths)):
-        if current_token_count + page_tokens > average_tokens_per_part:
-
-            subsets.append(''.join(current_subset))
-            # Start new subset from overlap if specified
-            overlap_start = max(i - overlap_page, 0)
-            current_subset = page_contents[overlap_start:i]
-            current_token_count = sum(token_lengths[overlap_start:i])
-        
-        # Add current page to the subset
-        current_subset.append(page_content)
-        current_token_count += page_tokens
-
-    # Add the last subset if it contains any pages
-    if current_subset:
-        subsets.append(''.join(current_subset))
-    
-    print('divide page_list to groups', len(subsets))
-    return subsets
+    groups = plan_page_groups(token_lengths, max_tokens, overlap_page)
+    if len(groups) > 1:
+        print('divide page_list to groups', len(groups))
+    return [''.join(page_contents[start:end]) for start, end in groups]
 
 def add_page_number_to_toc(part, structure, model=None):
     fill_prompt_seq = """
@@ -475,10 +637,10 @@ def add_page_number_to_toc(part, structure, model=None):
 
     prompt = fill_prompt_seq + f"\n\nCurrent Partial Document:\n{part}\n\nGiven Structure\n{json.dumps(structure, indent=2)}\n"
     current_json_raw = ChatGPT_API(model=model, prompt=prompt)
-    json_result = extract_json(current_json_raw)
+    json_result = extract_json_list(current_json_raw)
     
     for item in json_result:
-        if 'start' in item:
+        if isinstance(item, dict) and 'start' in item:
             del item['start']
     return json_result
 
@@ -496,7 +658,7 @@ def remove_first_physical_index_section(text):
     return text
 
 ### add verify completeness
-def generate_toc_continue(toc_content, part, model="gpt-4o-2024-11-20"):
+def generate_toc_continue(toc_content, part, model="gpt-4o-2024-11-20", max_continuations=3):
     print('start generate_toc_continue')
     prompt = """
     You are an expert in extracting hierarchical tree structure.
@@ -526,12 +688,11 @@ def generate_toc_continue(toc_content, part, model="gpt-4o-2024-11-20"):
     prompt = prompt + '\nGiven text\n:' + part + '\nPrevious tree structure\n:' + json.dumps(toc_content, indent=2)
     response, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt)
     if finish_reason == 'finished':
-        return extract_json(response)
-    else:
-        raise Exception(f'finish reason: {finish_reason}')
+        return extract_json_list(response)
+    return continue_truncated_toc(toc_content, response, part, model, finish_reason, max_continuations)
     
 ### add verify completeness
-def generate_toc_init(part, model=None):
+def generate_toc_init(part, model=None, max_continuations=3):
     print('start generate_toc_init')
     prompt = """
     You are an expert in extracting hierarchical tree structure, your task is to generate the tree structure of the document.
@@ -561,23 +722,114 @@ def generate_toc_init(part, model=None):
     response, finish_reason = ChatGPT_API_with_finish_reason(model=model, prompt=prompt)
 
     if finish_reason == 'finished':
-         return extract_json(response)
-    else:
+         return extract_json_list(response)
+    return continue_truncated_toc([], response, part, model, finish_reason, max_continuations)
+
+
+def continue_truncated_toc(previous_items, response, part, model, finish_reason, max_continuations=3):
+    """
+    The output hit the length limit: the truncated JSON is repaired locally (keeping the complete items),
+    and only the sections after the last complete item are requested. Each continuation resends the part
+    and all items so far, so at most max_continuations follow-up calls are made for one part; after that
+    the repaired items are returned as they are.
+    """
+    items = extract_json_list(response)
+    if not items:
         raise Exception(f'finish reason: {finish_reason}')
+    if max_continuations <= 0:
+        print(f'toc output truncated, kept {len(items)} items, continuation limit reached')
+        return items
+    print(f'toc output truncated, kept {len(items)} items, continuing')
+    return items + generate_toc_continue(previous_items + items, part, model, max_continuations - 1)
+
+class StrategyCancelled(Exception):
+    """Raised inside a speculative strategy once another strategy has been accepted."""
+
+
+def raise_if_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise StrategyCancelled()
+
+
+class StrategyCache:
+    """
+    Intermediate results shared by the fallback strategies of one meta_processor run,
+    e.g. the transformed toc and the tagged page groups. Thread-safe, because speculative
+    strategies run in worker threads. Entries with a stage are also persisted to the job checkpoint.
+    tagged_pages is the document-wide TaggedPageCache, shared across meta_processor runs.
+    """
+    def __init__(self, checkpoint=None, tagged_pages=None):
+        self.checkpoint = checkpoint
+        self.tagged_pages = tagged_pages
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._data = {}
+
+    def get_or_compute(self, key, compute, stage=None):
+        # one lock per key: strategies needing the same entry wait for a single computation,
+        # while different entries (and the LLM calls behind them) are computed concurrently
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._data:
+                    return copy.deepcopy(self._data[key])
+            if stage and self.checkpoint is not None:
+                stage_key = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+                value = run_stage(self.checkpoint, stage, compute, key=stage_key)
+            else:
+                value = compute()
+            with self._lock:
+                self._data[key] = value
+        return copy.deepcopy(value)
+
+
+def get_group_texts(page_list, start_index=1, model=None, cache=None):
+    """Returns the tagged page groups with their page ranges, see grouping.group_pages."""
+    def compute():
+        tagged_pages = cache.tagged_pages if cache is not None else None
+        groups = group_pages(page_list, start_index=start_index, model=model, tagged_pages=tagged_pages)
+        if len(groups) > 1:
+            print('divide page_list to groups', len(groups))
+        return groups
+
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(('group_texts', start_index, len(page_list)), compute)
+
+
+def clear_out_of_group_indices(toc_items, previous_items, group):
+    """Drops page numbers newly assigned by the model that fall outside the pages of the group it was shown."""
+    previous = {(item.get('structure'), item.get('title')): item.get('physical_index') for item in previous_items}
+    for item in toc_items:
+        physical_index = item.get('physical_index')
+        if physical_index is None or previous.get((item.get('structure'), item.get('title'))) == physical_index:
+            continue
+        try:
+            page = convert_physical_index_to_int(physical_index) if isinstance(physical_index, str) else physical_index
+        except ValueError:
+            page = None
+        if not isinstance(page, int) or not group['start_index'] <= page <= group['end_index']:
+            item['physical_index'] = None
+    return toc_items
+
 
-def process_no_toc(page_list, start_index=1, model=None, logger=None):
-    page_contents=[]
-    token_lengths=[]
-    for page_index in range(start_index, start_index+len(page_list)):
-        page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
-        page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
-    group_texts = page_list_to_group_text(page_contents, token_lengths)
-    logger.info(f'len(group_texts): {len(group_texts)}')
-
-    toc_with_page_number= generate_toc_init(group_texts[0], model)
-    for group_text in group_texts[1:]:
-        toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, group_text, model)    
+def get_transformed_toc(toc_content, model=None, cache=None):
+    with llm_stage('toc_transform'):
+        if cache is None:
+            return toc_transformer(toc_content, model)
+        return cache.get_or_compute(('toc_transformer', toc_content), lambda: toc_transformer(toc_content, model), stage='toc_transform')
+
+
+def process_no_toc(page_list, start_index=1, model=None, logger=None, cache=None, cancel_event=None, max_continuations=3):
+    groups = get_group_texts(page_list, start_index=start_index, model=model, cache=cache)
+    logger.info({'page_groups': [[group['start_index'], group['end_index'], group['tokens']] for group in groups]})
+
+    raise_if_cancelled(cancel_event)
+    toc_with_page_number= generate_toc_init(groups[0]['text'], model, max_continuations)
+    for group in groups[1:]:
+        raise_if_cancelled(cancel_event)
+        toc_with_page_number_additional = generate_toc_continue(toc_with_page_number, group['text'], model, max_continuations)
         toc_with_page_number.extend(toc_with_page_number_additional)
     logger.info(f'generate_toc: {toc_with_page_number}')
 
@@ -586,22 +838,19 @@ def process_no_toc(page_list, start_index=1, model=None, logger=None):
 
     return toc_with_page_number
 
-def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None):
-    page_contents=[]
-    token_lengths=[]
-    toc_content = toc_transformer(toc_content, model)
+def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_index=1, model=None, logger=None, cache=None, cancel_event=None):
+    toc_content = get_transformed_toc(toc_content, model, cache=cache)
     logger.info(f'toc_transformer: {toc_content}')
-    for page_index in range(start_index, start_index+len(page_list)):
-        page_text = f"<physical_index_{page_index}>\n{page_list[page_index-start_index][0]}\n<physical_index_{page_index}>\n\n"
-        page_contents.append(page_text)
-        token_lengths.append(count_tokens(page_text, model))
-    
-    group_texts = page_list_to_group_text(page_contents, token_lengths)
-    logger.info(f'len(group_texts): {len(group_texts)}')
+
+    groups = get_group_texts(page_list, start_index=start_index, model=model, cache=cache)
+    logger.info({'page_groups': [[group['start_index'], group['end_index'], group['tokens']] for group in groups]})
 
     toc_with_page_number=copy.deepcopy(toc_content)
-    for group_text in group_texts:
-        toc_with_page_number = add_page_number_to_toc(group_text, toc_with_page_number, model)
+    for group in groups:
+        raise_if_cancelled(cancel_event)
+        previous_items = copy.deepcopy(toc_with_page_number)
+        toc_with_page_number = add_page_number_to_toc(group['text'], toc_with_page_number, model)
+        toc_with_page_number = clear_out_of_group_indices(toc_with_page_number, previous_items, group)
     logger.info(f'add_page_number_to_toc: {toc_with_page_number}')
 
     toc_with_page_number = convert_physical_index_to_int(toc_with_page_number)
@@ -611,9 +860,10 @@ def process_toc_no_page_numbers(toc_content, toc_page_list, page_list,  start_in
 
 
 
-def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None):
-    toc_with_page_number = toc_transformer(toc_content, model)
+def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=None, model=None, logger=None, cache=None, cancel_event=None):
+    toc_with_page_number = get_transformed_toc(toc_content, model, cache=cache)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
+    raise_if_cancelled(cancel_event)
 
     toc_no_page_number = remove_page_number(copy.deepcopy(toc_with_page_number))
     
@@ -622,6 +872,7 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
     for page_index in range(start_page_index, min(start_page_index + toc_check_page_num, len(page_list))):
         main_content += f"<physical_index_{page_index+1}>\n{page_list[page_index][0]}\n<physical_index_{page_index+1}>\n\n"
 
+    raise_if_cancelled(cancel_event)
     toc_with_physical_index = toc_index_extractor(toc_no_page_number, main_content, model)
     logger.info(f'toc_with_physical_index: {toc_with_physical_index}')
 
@@ -637,6 +888,7 @@ def process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_che
     toc_with_page_number = add_page_offset_to_toc_json(toc_with_page_number, offset)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
+    raise_if_cancelled(cancel_event)
     toc_with_page_number = process_none_page_numbers(toc_with_page_number, page_list, model=model)
     logger.info(f'toc_with_page_number: {toc_with_page_number}')
 
@@ -743,9 +995,9 @@ def single_toc_item_index_fixer(section_title, content, model="gpt-4o-2024-11-20
     Directly return the final JSON structure. Do not output anything else."""
 
     prompt = tob_extractor_prompt + '\nSection Title:\n' + str(section_title) + '\nDocument pages:\n' + content
-    response = ChatGPT_API(model=model, prompt=prompt)
+    response = ChatGPT_API(model=model, prompt=prompt, json_mode=True)
     json_content = extract_json(response)    
-    return convert_physical_index_to_int(json_content['physical_index'])
+    return convert_physical_index_to_int(json_content.get('physical_index')) if isinstance(json_content, dict) else None
 
 
 
@@ -812,7 +1064,7 @@ async def fix_incorrect_toc(toc_with_page_number, page_list, incorrect_results,
                 continue
         content_range = ''.join(page_contents)
         
-        physical_index_int = single_toc_item_index_fixer(incorrect_item['title'], content_range, model)
+        physical_index_int = await asyncio.to_thread(single_toc_item_index_fixer, incorrect_item['title'], content_range, model)
         
         # Check if the result is correct
         check_item = incorrect_item.copy()
@@ -876,7 +1128,8 @@ async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorr
     while current_incorrect:
         print(f"Fixing {len(current_incorrect)} incorrect results")
         
-        current_toc, current_incorrect = await fix_incorrect_toc(current_toc, page_list, current_incorrect, start_index, model, logger)
+        with llm_stage('fix'):
+            current_toc, current_incorrect = await fix_incorrect_toc(current_toc, page_list, current_incorrect, start_index, model, logger)
                 
         fix_attempt += 1
         if fix_attempt >= max_attempts:
@@ -889,7 +1142,22 @@ async def fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorr
 
 
 ################### verify toc #########################################################
-async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
+async def check_toc_items(items, page_list, start_index=1, model=None, batch_size=10):
+    if batch_size and batch_size > 1:
+        return await check_title_appearance_batched(items, page_list, start_index, model, max_batch_size=batch_size)
+    tasks = [
+        check_title_appearance(item, page_list, start_index, model)
+        for item in items
+    ]
+    return await asyncio.gather(*tasks)
+
+
+async def verify_toc(page_list, list_result, start_index=1, N=None, model=None, batch_size=10, known_results=None):
+    """
+    known_results is an optional dict of list_index -> check result. Items already in it are
+    not checked again, and new check results are added to it, so a sampled verification can
+    be followed by a full one without repeating LLM calls.
+    """
     print('start verify_toc')
     # Find the last non-None physical_index
     last_physical_index = None
@@ -913,20 +1181,25 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
 
     # Prepare items with their list indices
     indexed_sample_list = []
+    reused_results = []
     for idx in sample_indices:
         item = list_result[idx]
+        if known_results is not None and idx in known_results:
+            reused_results.append(known_results[idx])
+            continue
         # Skip items with None physical_index (these were invalidated by validate_and_truncate_physical_indices)
         if item.get('physical_index') is not None:
             item_with_index = item.copy()
             item_with_index['list_index'] = idx  # Add the original index in list_result
             indexed_sample_list.append(item_with_index)
 
-    # Run checks concurrently
-    tasks = [
-        check_title_appearance(item, page_list, start_index, model)
-        for item in indexed_sample_list
-    ]
-    results = await asyncio.gather(*tasks)
+    # Run checks concurrently, batching items that share a page into one prompt
+    results = await check_toc_items(indexed_sample_list, page_list, start_index, model, batch_size=batch_size)
+
+    if known_results is not None:
+        for result in results:
+            known_results[result['list_index']] = result
+    results = reused_results + list(results)
     
     # Process results
     correct_count = 0
@@ -945,19 +1218,116 @@ async def verify_toc(page_list, list_result, start_index=1, N=None, model=None):
 
 
 
+def wilson_interval(correct, total, z=1.96):
+    """Wilson score interval of a binomial proportion."""
+    if total == 0:
+        return 0.0, 1.0
+    p = correct / total
+    denominator = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+async def verify_toc_sequential(page_list, list_result, start_index=1, model=None, batch_size=10, sample_batch_size=8, threshold=0.6, z=1.96, known_results=None):
+    """
+    Sequential-testing version of verify_toc. Items are checked in random batches while a Wilson
+    interval of the accuracy is kept; checking stops as soon as the interval lies completely below
+    threshold (the caller falls back) or above it. In the latter case the remaining items are still
+    checked, because fix_incorrect_toc needs every incorrect item.
+    Returns (accuracy, incorrect_results) like verify_toc.
+    """
+    print('start verify_toc_sequential')
+    last_physical_index = None
+    for item in reversed(list_result):
+        if item.get('physical_index') is not None:
+            last_physical_index = item['physical_index']
+            break
+
+    if last_physical_index is None or last_physical_index < len(page_list)/2:
+        return 0, []
+
+    if known_results is None:
+        known_results = {}
+    candidate_indices = [idx for idx, item in enumerate(list_result) if item.get('physical_index') is not None]
+    unchecked_indices = [idx for idx in candidate_indices if idx not in known_results]
+    random.shuffle(unchecked_indices)
+
+    async def check(indices):
+        items = []
+        for idx in indices:
+            item_with_index = list_result[idx].copy()
+            item_with_index['list_index'] = idx
+            items.append(item_with_index)
+        for result in await check_toc_items(items, page_list, start_index, model, batch_size=batch_size):
+            known_results[result['list_index']] = result
+
+    decision = None
+    while unchecked_indices:
+        checked = [known_results[idx] for idx in candidate_indices if idx in known_results]
+        if checked:
+            correct_count = sum(1 for result in checked if result['answer'] == 'yes')
+            lower, upper = wilson_interval(correct_count, len(checked), z=z)
+            print(f'checked {len(checked)} items, accuracy interval: [{lower:.2f}, {upper:.2f}]')
+            if lower > threshold:
+                decision = 'accept'
+                break
+            if upper <= threshold:
+                decision = 'reject'
+                break
+        batch, unchecked_indices = unchecked_indices[:sample_batch_size], unchecked_indices[sample_batch_size:]
+        await check(batch)
+
+    if decision == 'accept' and unchecked_indices:
+        print(f'accepted early, checking the remaining {len(unchecked_indices)} items for fixing')
+        await check(unchecked_indices)
+    elif decision == 'reject':
+        print(f'rejected early, skipped {len(unchecked_indices)} items')
+
+    results = [known_results[idx] for idx in candidate_indices if idx in known_results]
+    correct_count = 0
+    incorrect_results = []
+    for result in results:
+        if result['answer'] == 'yes':
+            correct_count += 1
+        else:
+            incorrect_results.append(result)
+
+    accuracy = correct_count / len(results) if results else 0
+    print(f"accuracy: {accuracy*100:.2f}%")
+    return accuracy, incorrect_results
+
+
+async def verify_toc_with_opt(page_list, list_result, start_index=1, opt=None, known_results=None):
+    batch_size = getattr(opt, 'verify_batch_size', 10)
+    with llm_stage('verify'):
+        if getattr(opt, 'verify_mode', 'full') == 'sequential':
+            return await verify_toc_sequential(page_list, list_result, start_index=start_index, model=opt.model, batch_size=batch_size,
+                                               sample_batch_size=getattr(opt, 'sequential_verify_batch_size', 8), known_results=known_results)
+        return await verify_toc(page_list, list_result, start_index=start_index, model=opt.model, batch_size=batch_size, known_results=known_results)
 
 
 ################### main process #########################################################
-async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None):
-    print(mode)
-    print(f'start_index: {start_index}')
-    
-    if mode == 'process_toc_with_page_numbers':
-        toc_with_page_number = process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger)
-    elif mode == 'process_toc_no_page_numbers':
-        toc_with_page_number = process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger)
-    else:
-        toc_with_page_number = process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger)
+FALLBACK_MODES = {
+    'process_toc_with_page_numbers': 'process_toc_no_page_numbers',
+    'process_toc_no_page_numbers': 'process_no_toc',
+}
+
+
+def generate_toc_for_mode(page_list, mode, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None, cache=None, cancel_event=None):
+    def compute():
+        # a cancelled speculative strategy stops before its next LLM request, including nested ones
+        with llm_stage('index_extract'), llm_cancel_check(lambda: raise_if_cancelled(cancel_event)):
+            if mode == 'process_toc_with_page_numbers':
+                return process_toc_with_page_numbers(toc_content, toc_page_list, page_list, toc_check_page_num=opt.toc_check_page_num, model=opt.model, logger=logger, cache=cache, cancel_event=cancel_event)
+            elif mode == 'process_toc_no_page_numbers':
+                return process_toc_no_page_numbers(toc_content, toc_page_list, page_list, model=opt.model, logger=logger, cache=cache, cancel_event=cancel_event)
+            else:
+                return process_no_toc(page_list, start_index=start_index, model=opt.model, logger=logger, cache=cache, cancel_event=cancel_event,
+                                      max_continuations=getattr(opt, 'toc_max_continuations', 3))
+
+    checkpoint = cache.checkpoint if cache is not None else None
+    toc_with_page_number = run_stage(checkpoint, 'index_mapping', compute, key=f'{mode}:{start_index}:{len(page_list)}')
             
     toc_with_page_number = [item for item in toc_with_page_number if item.get('physical_index') is not None] 
     
@@ -967,11 +1337,31 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
         start_index=start_index, 
         logger=logger
     )
+    return toc_with_page_number
+
+
+async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None, cache=None, checkpoint=None, tagged_pages=None):
+    if cache is None:
+        # outermost call: the final (verified and fixed) toc of this page range is one checkpoint entry
+        cache = StrategyCache(checkpoint, tagged_pages=tagged_pages)
+        return await run_stage_async(
+            checkpoint, 'verify_fix',
+            lambda: meta_processor(page_list, mode=mode, toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger, cache=cache),
+            key=f'{mode}:{start_index}:{len(page_list)}'
+        )
+
+    if getattr(opt, 'speculative_fallback', 'no') == 'yes':
+        return await meta_processor_speculative(page_list, mode=mode, toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger, cache=cache)
+
+    print(mode)
+    print(f'start_index: {start_index}')
+
+    toc_with_page_number = await asyncio.to_thread(generate_toc_for_mode, page_list, mode, toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger, cache=cache)
     
-    accuracy, incorrect_results = await verify_toc(page_list, toc_with_page_number, start_index=start_index, model=opt.model)
+    accuracy, incorrect_results = await verify_toc_with_opt(page_list, toc_with_page_number, start_index=start_index, opt=opt)
         
     logger.info({
-        'mode': 'process_toc_with_page_numbers',
+        'mode': mode,
         'accuracy': accuracy,
         'incorrect_results': incorrect_results
     })
@@ -982,44 +1372,206 @@ async def meta_processor(page_list, mode=None, toc_content=None, toc_page_list=N
         return toc_with_page_number
     else:
         if mode == 'process_toc_with_page_numbers':
-            return await meta_processor(page_list, mode='process_toc_no_page_numbers', toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger)
+            return await meta_processor(page_list, mode='process_toc_no_page_numbers', toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index, opt=opt, logger=logger, cache=cache)
         elif mode == 'process_toc_no_page_numbers':
-            return await meta_processor(page_list, mode='process_no_toc', start_index=start_index, opt=opt, logger=logger)
+            return await meta_processor(page_list, mode='process_no_toc', start_index=start_index, opt=opt, logger=logger, cache=cache)
         else:
             raise Exception('Processing failed')
-        
- 
-async def process_large_node_recursively(node, page_list, opt=None, logger=None):
-    node_page_list = page_list[node['start_index']-1:node['end_index']]
-    token_num = sum([page[1] for page in node_page_list])
-    
-    if node['end_index'] - node['start_index'] > opt.max_page_num_each_node and token_num >= opt.max_token_num_each_node:
-        print('large node:', node['title'], 'start_index:', node['start_index'], 'end_index:', node['end_index'], 'token_num:', token_num)
 
-        node_toc_tree = await meta_processor(node_page_list, mode='process_no_toc', start_index=node['start_index'], opt=opt, logger=logger)
-        node_toc_tree = await check_title_appearance_in_start_concurrent(node_toc_tree, page_list, model=opt.model, logger=logger)
-        
+
+async def meta_processor_speculative(page_list, mode=None, toc_content=None, toc_page_list=None, start_index=1, opt=None, logger=None, cache=None):
+    """
+    Same decisions as meta_processor, but the next fallback strategy is started in a worker
+    thread as soon as a small verification sample of the current one looks bad. Strategies are
+    still accepted in fallback order; once one passes, the others are cancelled.
+    """
+    print(f'{mode} (speculative)')
+    print(f'start_index: {start_index}')
+    if cache is None:
+        cache = StrategyCache()
+    strategies = {}
+    sample_size = getattr(opt, 'speculative_sample_size', 5)
+    batch_size = getattr(opt, 'verify_batch_size', 10)
+
+    def launch(strategy_mode):
+        if strategy_mode is None or strategy_mode in strategies:
+            return
+        print(f'launch strategy {strategy_mode}')
+        cancel_event = threading.Event()
+        task = asyncio.create_task(asyncio.to_thread(
+            generate_toc_for_mode, page_list, strategy_mode,
+            toc_content=toc_content, toc_page_list=toc_page_list, start_index=start_index,
+            opt=opt, logger=logger, cache=cache, cancel_event=cancel_event
+        ))
+        strategies[strategy_mode] = (task, cancel_event)
+
+    async def cancel_strategies(keep=None):
+        pending = []
+        for strategy_mode, (task, cancel_event) in strategies.items():
+            if strategy_mode != keep and not task.done():
+                logger.info(f'cancel strategy {strategy_mode}')
+                cancel_event.set()
+                task.cancel()
+                pending.append(task)
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    current_mode = mode
+    launch(current_mode)
+    try:
+        while True:
+            toc_with_page_number = await strategies[current_mode][0]
+            next_mode = FALLBACK_MODES.get(current_mode)
+            known_results = {}
+
+            if next_mode and next_mode not in strategies:
+                with llm_stage('verify'):
+                    sample_accuracy, _ = await verify_toc(page_list, toc_with_page_number, start_index=start_index, N=sample_size, model=opt.model, batch_size=batch_size, known_results=known_results)
+                logger.info({'mode': current_mode, 'sample_accuracy': sample_accuracy})
+                if sample_accuracy <= 0.6:
+                    launch(next_mode)
+
+            accuracy, incorrect_results = await verify_toc_with_opt(page_list, toc_with_page_number, start_index=start_index, opt=opt, known_results=known_results)
+            logger.info({
+                'mode': current_mode,
+                'accuracy': accuracy,
+                'incorrect_results': incorrect_results
+            })
+
+            if accuracy == 1.0 and len(incorrect_results) == 0:
+                await cancel_strategies(keep=current_mode)
+                return toc_with_page_number
+            if accuracy > 0.6 and len(incorrect_results) > 0:
+                await cancel_strategies(keep=current_mode)
+                toc_with_page_number, incorrect_results = await fix_incorrect_toc_with_retries(toc_with_page_number, page_list, incorrect_results, start_index=start_index, max_attempts=3, model=opt.model, logger=logger)
+                return toc_with_page_number
+            if next_mode is None:
+                raise Exception('Processing failed')
+
+            launch(next_mode)
+            current_mode = next_mode
+    finally:
+        await cancel_strategies()
+
+
+def is_large_node(node, token_prefix, opt):
+    token_num = token_prefix[node['end_index']] - token_prefix[node['start_index'] - 1]
+    return node['end_index'] - node['start_index'] > opt.max_page_num_each_node and token_num >= opt.max_token_num_each_node, token_num
+
+
+class LargeNodeSplitter:
+    """
+    Splits nodes that are too large (by pages and tokens) into sub-trees, breadth-first from a work queue.
+
+    A fixed number of workers pull nodes from the queue, so at most large_node_concurrency splits run at
+    once (their LLM calls also go through the global limiter in utils). Tagged page text and token counts
+    are computed once per document and shared by every split. large_node_max_depth bounds how many times
+    a page range is split again, large_node_max_tasks bounds the number of splits per document.
+    """
+    def __init__(self, page_list, opt, logger=None, checkpoint=None, tagged_pages=None):
+        self.page_list = page_list
+        self.opt = opt
+        self.logger = logger
+        self.checkpoint = checkpoint
+        self.tagged_pages = tagged_pages or TaggedPageCache(page_list, opt.model)
+        self.concurrency = max(1, getattr(opt, 'large_node_concurrency', 4))
+        self.max_depth = getattr(opt, 'large_node_max_depth', 4)
+        self.max_tasks = getattr(opt, 'large_node_max_tasks', 64)
+        self.token_prefix = [0]
+        for page in page_list:
+            self.token_prefix.append(self.token_prefix[-1] + page[1])
+        self.split_count = 0
+        self.timings = []
+
+    async def split_node(self, node, depth):
+        node_page_list = self.page_list[node['start_index']-1:node['end_index']]
+        # all LLM calls made while splitting a large node are accounted to the large_node stage
+        with llm_stage('large_node', exclusive=True):
+            node_toc_tree = await meta_processor(node_page_list, mode='process_no_toc', start_index=node['start_index'], opt=self.opt, logger=self.logger, checkpoint=self.checkpoint, tagged_pages=self.tagged_pages)
+            node_toc_tree = await check_title_appearance_in_start_concurrent(node_toc_tree, self.page_list, model=self.opt.model, logger=self.logger, max_batch_size=getattr(self.opt, 'verify_batch_size', 10))
+
         # Filter out items with None physical_index before post_processing
         valid_node_toc_items = [item for item in node_toc_tree if item.get('physical_index') is not None]
-        
+
         if valid_node_toc_items and node['title'].strip() == valid_node_toc_items[0]['title'].strip():
             node['nodes'] = post_processing(valid_node_toc_items[1:], node['end_index'])
             node['end_index'] = valid_node_toc_items[1]['start_index'] if len(valid_node_toc_items) > 1 else node['end_index']
         else:
             node['nodes'] = post_processing(valid_node_toc_items, node['end_index'])
             node['end_index'] = valid_node_toc_items[0]['start_index'] if valid_node_toc_items else node['end_index']
-        
-    if 'nodes' in node and node['nodes']:
-        tasks = [
-            process_large_node_recursively(child_node, page_list, opt, logger=logger)
-            for child_node in node['nodes']
-        ]
-        await asyncio.gather(*tasks)
-    
+
+    async def process(self, node, depth):
+        """Splits the node if needed and returns (children, depth of the children)."""
+        large, token_num = is_large_node(node, self.token_prefix, self.opt)
+        if not large:
+            return node.get('nodes') or [], depth
+        if depth >= self.max_depth or self.split_count >= self.max_tasks:
+            print('large node skipped (limit reached):', node['title'], 'depth:', depth, 'splits:', self.split_count)
+            return node.get('nodes') or [], depth
+
+        self.split_count += 1
+        print('large node:', node['title'], 'start_index:', node['start_index'], 'end_index:', node['end_index'], 'token_num:', token_num)
+        start_page, end_page = node['start_index'], node['end_index']
+        start_time = time.perf_counter()
+        await self.split_node(node, depth)
+        self.timings.append({
+            'title': node['title'],
+            'start_index': start_page,
+            'end_index': end_page,
+            'depth': depth,
+            'token_num': token_num,
+            'children': len(node.get('nodes') or []),
+            'seconds': round(time.perf_counter() - start_time, 3),
+        })
+        return node.get('nodes') or [], depth + 1
+
+    async def run(self, nodes):
+        queue = asyncio.Queue()
+        for node in nodes:
+            queue.put_nowait((node, 0))
+
+        async def worker():
+            while True:
+                node, depth = await queue.get()
+                try:
+                    children, child_depth = await self.process(node, depth)
+                    for child in children:
+                        queue.put_nowait((child, child_depth))
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        all_done = asyncio.create_task(queue.join())
+        try:
+            await asyncio.wait([all_done, *workers], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            all_done.cancel()
+            for task in workers:
+                task.cancel()
+            results = await asyncio.gather(*workers, return_exceptions=True)
+        # re-raise whatever stopped a worker, including BaseExceptions such as jobs.JobCancelled;
+        # CancelledError only comes from the sibling workers cancelled above
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+                raise result
+
+        if self.timings and self.logger:
+            self.logger.info({'large_nodes': self.timings})
+        return nodes
+
+
+async def split_large_nodes(nodes, page_list, opt=None, logger=None, checkpoint=None, tagged_pages=None):
+    """Splits every large node in the given sub-trees, see LargeNodeSplitter."""
+    return await LargeNodeSplitter(page_list, opt, logger=logger, checkpoint=checkpoint, tagged_pages=tagged_pages).run(nodes)
+
+
+async def process_large_node_recursively(node, page_list, opt=None, logger=None, checkpoint=None):
+    await split_large_nodes([node], page_list, opt, logger=logger, checkpoint=checkpoint)
     return node
 
-async def tree_parser(page_list, opt, doc=None, logger=None):
-    check_toc_result = check_toc(page_list, opt)
+async def tree_parser(page_list, opt, doc=None, logger=None, checkpoint=None):
+    tagged_pages = TaggedPageCache(page_list, opt.model)
+    with llm_stage('toc_detect'):
+        check_toc_result = await asyncio.to_thread(run_stage, checkpoint, 'toc_detection', lambda: check_toc(page_list, opt))
     logger.info(check_toc_result)
 
     if check_toc_result.get("toc_content") and check_toc_result["toc_content"].strip() and check_toc_result["page_index_given_in_toc"] == "yes":
@@ -1030,94 +1582,142 @@ async def tree_parser(page_list, opt, doc=None, logger=None):
             toc_content=check_toc_result['toc_content'], 
             toc_page_list=check_toc_result['toc_page_list'], 
             opt=opt,
-            logger=logger)
+            logger=logger,
+            checkpoint=checkpoint,
+            tagged_pages=tagged_pages)
     else:
         toc_with_page_number = await meta_processor(
             page_list, 
             mode='process_no_toc', 
             start_index=1, 
             opt=opt,
-            logger=logger)
+            logger=logger,
+            checkpoint=checkpoint,
+            tagged_pages=tagged_pages)
 
     toc_with_page_number = add_preface_if_needed(toc_with_page_number)
-    toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger)
+    toc_with_page_number = await check_title_appearance_in_start_concurrent(toc_with_page_number, page_list, model=opt.model, logger=logger, max_batch_size=getattr(opt, 'verify_batch_size', 10))
     
     # Filter out items with None physical_index before post_processings
     valid_toc_items = [item for item in toc_with_page_number if item.get('physical_index') is not None]
     
     toc_tree = post_processing(valid_toc_items, len(page_list))
-    tasks = [
-        process_large_node_recursively(node, page_list, opt, logger=logger)
-        for node in toc_tree
-    ]
-    await asyncio.gather(*tasks)
-    
-    return toc_tree
 
+    async def expand_large_nodes():
+        return await split_large_nodes(toc_tree, page_list, opt, logger=logger, checkpoint=checkpoint, tagged_pages=tagged_pages)
 
-def page_index_main(doc, opt=None):
-    logger = JsonLogger(doc)
-    
-    is_valid_pdf = (
-        (isinstance(doc, str) and os.path.isfile(doc) and doc.lower().endswith(".pdf")) or 
-        isinstance(doc, BytesIO)
-    )
-    if not is_valid_pdf:
-        raise ValueError("Unsupported input type. Expected a PDF file path or BytesIO object.")
-
-    print('Parsing PDF...')
-    page_list = get_page_tokens(doc)
-
-    logger.info({'total_page_number': len(page_list)})
-    logger.info({'total_token': sum([page[1] for page in page_list])})
-
-    async def page_index_builder():
-        structure = await tree_parser(page_list, opt, doc=doc, logger=logger)
-        if opt.if_add_node_id == 'yes':
-            write_node_id(structure)    
-        if opt.if_add_node_text == 'yes':
-            add_node_text(structure, page_list)
-        if opt.if_add_node_summary == 'yes':
-            if opt.if_add_node_text == 'no':
+    return await run_stage_async(checkpoint, 'large_nodes', expand_large_nodes)
+
+
+async def page_index_main_async(doc, opt=None, page_list=None):
+    """
+    Async variant of page_index_main, so several documents can share one event loop
+    (and its LLM client pool and limiter). Blocking steps run in worker threads.
+
+    page_list: pages already parsed elsewhere (e.g. by the batch parser processes), parsed here if None
+    """
+    # 整个流程共用一个文档句柄，PDF 只解析一次
+    pdf = PdfDocument.open(doc)
+    logger = JsonLogger(pdf)
+    checkpoint = None
+    try:
+        if getattr(opt, 'if_checkpoint', 'yes') == 'yes':
+            checkpoint = JobCheckpoint.for_document(pdf, opt, resume=getattr(opt, 'resume', 'no') == 'yes')
+            logger.info({'checkpoint_dir': checkpoint.job_dir})
+
+        print('Parsing PDF...')
+        parsed_pages = page_list
+        page_list = await asyncio.to_thread(
+            run_stage, checkpoint, 'page_extraction',
+            (lambda: parsed_pages) if parsed_pages is not None else (lambda: get_page_tokens(pdf)),
+            restore=lambda pages: [tuple(page) for page in pages])
+
+        logger.info({'total_page_number': len(page_list)})
+        logger.info({'total_token': sum([page[1] for page in page_list])})
+
+        # 提示词使用去掉页眉页脚、压缩空白后的文本，节点最终文本仍使用原文
+        prompt_page_list = page_list
+        if getattr(opt, 'if_normalize_pages', 'yes') == 'yes':
+            prompt_page_list, norm_stats = await asyncio.to_thread(
+                normalize_page_list, page_list, model=opt.model, min_repeat_ratio=getattr(opt, 'page_header_repeat_ratio', 0.5))
+            logger.info({'page_normalization': norm_stats})
+            print(f"页面文本规范化: {norm_stats['tokens_before']} -> {norm_stats['tokens_after']} tokens")
+
+        async def build_structure():
+            structure = await tree_parser(prompt_page_list, opt, doc=pdf, logger=logger, checkpoint=checkpoint)
+            if opt.if_add_node_id == 'yes':
+                write_node_id(structure)    
+            if opt.if_add_node_summary == 'yes':
+                add_node_text(structure, prompt_page_list)
+                await SummaryEngine.from_opt(opt, logger=logger).run(structure, page_list=prompt_page_list)
+            if opt.if_add_node_text == 'yes':
                 add_node_text(structure, page_list)
-            await generate_summaries_for_structure(structure, model=opt.model)
-            if opt.if_add_node_text == 'no':
+            else:
                 remove_structure_text(structure)
+
+            doc_description = ""
+            if opt.if_add_doc_description == 'yes':
+                # Create a clean structure without unnecessary fields for description generation
+                clean_structure = create_clean_structure_for_description(structure)
+                doc_description = await asyncio.to_thread(generate_doc_description, clean_structure, model=opt.model)
+            return {'structure': structure, 'doc_description': doc_description}
+
+        async def page_index_builder():
+            built = await run_stage_async(checkpoint, 'summaries', build_structure)
+            structure = built['structure']
+            doc_description = built['doc_description']
+            doc_name = pdf.name
         
-        doc_name = get_pdf_name(doc)
-        doc_description = ""
-        
-        if opt.if_add_doc_description == 'yes':
-            # Create a clean structure without unnecessary fields for description generation
-            clean_structure = create_clean_structure_for_description(structure)
-            doc_description = generate_doc_description(clean_structure, model=opt.model)
-        
-        result = {
-            'doc_name': doc_name,
-            'structure': structure,
-        }
+            result = {
+                'doc_name': doc_name,
+                'structure': structure,
+            }
         
-        if doc_description:
-            result['doc_description'] = doc_description
+            if doc_description:
+                result['doc_description'] = doc_description
+
+            # 记录每页内容哈希，文档更新时用于增量处理
+            result['page_hashes'] = compute_page_hashes(page_list)
         
-        # 构建向量索引（如果启用）
-        if getattr(opt, 'if_build_vector_index', 'yes') == 'yes':
-            try:
-                from .vector_index import build_index_for_document
-                print(f"正在为 {doc_name} 构建向量索引...")
-                node_count = build_index_for_document(doc_name, structure, doc_description)
-                print(f"向量索引构建完成，共 {node_count} 个节点")
-            except Exception as e:
-                print(f"向量索引构建失败: {e}")
+            # 构建向量索引（如果启用）
+            if getattr(opt, 'if_build_vector_index', 'yes') == 'yes':
+                try:
+                    from .vector_index import build_index_for_document
+                    print(f"正在为 {doc_name} 构建向量索引...")
+                    node_count = await asyncio.to_thread(
+                        run_stage, checkpoint, 'vector_index', lambda: build_index_for_document(doc_name, structure, doc_description))
+                    print(f"向量索引构建完成，共 {node_count} 个节点")
+                except Exception as e:
+                    print(f"向量索引构建失败: {e}")
         
+            return result
+
+        with collect_llm_metrics() as metrics:
+            result = await page_index_builder()
+        result['llm_metrics'] = metrics.summary()
+        logger.info({'llm_metrics': result['llm_metrics']})
+        metrics.save(os.path.join(logger.log_dir, f"{os.path.splitext(logger.filename)[0]}_metrics.json"))
+        if checkpoint is not None:
+            # 任务完成，检查点不再需要
+            checkpoint.clear()
         return result
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        logger.close()
+        if pdf is not doc:
+            pdf.close()
+
 
-    return asyncio.run(page_index_builder())
+def page_index_main(doc, opt=None):
+    return run_async(page_index_main_async(doc, opt))
 
 
 def page_index(doc, model=None, toc_check_page_num=None, max_page_num_each_node=None, max_token_num_each_node=None,
                if_add_node_id=None, if_add_node_summary=None, if_add_doc_description=None, if_add_node_text=None,
-               if_build_vector_index=None):
+               if_build_vector_index=None, verify_batch_size=None, speculative_fallback=None, speculative_sample_size=None,
+               verify_mode=None, sequential_verify_batch_size=None, if_checkpoint=None, resume=None,
+               if_normalize_pages=None):
     
     user_opt = {
         arg: value for arg, value in locals().items()
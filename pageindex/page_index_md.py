@@ -22,7 +22,8 @@ async def get_node_summary(node, summary_token_threshold=200, model=None):
 async def generate_summaries_for_structure_md(structure, summary_token_threshold, model=None):
     nodes = structure_to_list(structure)
     tasks = [get_node_summary(node, summary_token_threshold=summary_token_threshold, model=model) for node in nodes]
-    summaries = await asyncio.gather(*tasks)
+    with llm_stage('summary'):
+        summaries = await asyncio.gather(*tasks)
     
     for node, summary in zip(nodes, summaries):
         if not node.get('nodes'):
@@ -281,7 +282,7 @@ async def md_to_tree(md_path, if_thinning=False, min_token_threshold=None, if_ad
             print(f"Generating document description...")
             # Create a clean structure without unnecessary fields for description generation
             clean_structure = create_clean_structure_for_description(tree_structure)
-            doc_description = generate_doc_description(clean_structure, model=model)
+            doc_description = await asyncio.to_thread(generate_doc_description, clean_structure, model=model)
             return {
                 'doc_name': os.path.splitext(os.path.basename(md_path))[0],
                 'doc_description': doc_description,
@@ -307,7 +308,7 @@ async def md_to_tree(md_path, if_thinning=False, min_token_threshold=None, if_ad
         try:
             from .vector_index import build_index_for_document
             print(f"正在为 {doc_name} 构建向量索引...")
-            node_count = build_index_for_document(doc_name, tree_structure, doc_description)
+            node_count = await asyncio.to_thread(build_index_for_document, doc_name, tree_structure, doc_description)
             print(f"向量索引构建完成，共 {node_count} 个节点")
         except Exception as e:
             print(f"向量索引构建失败: {e}")
@@ -0,0 +1,377 @@
+"""
+PageIndex 只读索引快照模块
+
+多进程部署时，只有一个写入进程打开 ChromaDB（导入、删除、重建都在该进程中执行），
+每次向量索引变化后把当前集合导出为一个只读快照目录：
+    embeddings.npy   向量矩阵（float32，查询进程以 mmap 方式打开，多个进程共用同一份页缓存）
+    norms.npy        每行向量的平方范数
+    nodes.json       节点 ID 和元数据
+    documents.bin / document_offsets.npy  节点文本（同样按需 mmap 读取）
+    manifest.json    版本、节点数、维度、来源指纹
+快照目录的 CURRENT 文件记录当前版本，先写好新版本目录再原子替换 CURRENT，查询进程检测到版本变化后热加载，无需重启。
+检索时对全部向量精确计算距离（与 ChromaDB 默认的 l2 距离一致），节点文本和结构仍从 results 目录的 mmap 文本文件读取。
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .utils import lazy_import
+
+np = lazy_import("numpy")
+
+# 快照目录
+SNAPSHOT_DIR = os.getenv("PAGEINDEX_SNAPSHOT_DIR", "./snapshots")
+# 查询进程检查新版本、写入进程检查索引变化的间隔（秒）
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("PAGEINDEX_SNAPSHOT_POLL_INTERVAL", "1"))
+# 保留的历史版本数（正在被查询进程读取的旧版本不会立即删除）
+SNAPSHOT_KEEP = int(os.getenv("PAGEINDEX_SNAPSHOT_KEEP", "3"))
+# 服务角色：all（单进程，直接读写 ChromaDB）、writer（写入进程）、query（只读查询进程）
+SERVE_ROLE = os.getenv("PAGEINDEX_SERVE_ROLE", "all")
+
+CURRENT_FILE = "CURRENT"
+CHROMA_SQLITE_FILE = "chroma.sqlite3"
+EXPORT_BATCH_SIZE = 1000
+
+
+def _write_atomic(path: str, data: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_current_version(snapshot_dir: str = SNAPSHOT_DIR) -> Optional[str]:
+    """当前快照版本，尚未发布时返回 None"""
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def index_fingerprint(persist_dir: str, collection_name: str) -> str:
+    """
+    ChromaDB 持久化目录的指纹（当前集合、chroma.sqlite3 及其 WAL 文件的修改时间和大小）
+
+    ChromaDB 的每次写入都会先落到 sqlite 文件，只需 stat 这两个文件，不遍历整个目录（发布线程每秒调用）
+    """
+    parts = [collection_name]
+    for name in (CHROMA_SQLITE_FILE, CHROMA_SQLITE_FILE + "-wal"):
+        try:
+            stat = os.stat(os.path.join(persist_dir, name))
+        except OSError:
+            parts.append("-")
+            continue
+        parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+    return ":".join(parts)
+
+
+def publish_snapshot(index=None, snapshot_dir: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP) -> Dict[str, Any]:
+    """
+    把向量索引当前集合导出为新的快照版本并切换 CURRENT
+
+    参数:
+        index: 向量索引，默认使用全局实例
+        snapshot_dir: 快照目录
+        keep: 保留的版本数
+
+    返回:
+        新版本的 manifest
+    """
+    from .vector_index import get_vector_index
+    index = index or get_vector_index()
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    tmp_dir = os.path.join(snapshot_dir, version + ".tmp")
+    os.makedirs(tmp_dir)
+    start = time.perf_counter()
+    try:
+        # 导出期间不允许写入，保证快照与指纹一致
+        with index._write_lock:
+            collection = index.collection
+            fingerprint = index_fingerprint(index.persist_dir, collection.name)
+            manifest = _export_collection(collection, tmp_dir)
+        manifest.update(
+            version=version,
+            collection=collection.name,
+            fingerprint=fingerprint,
+            embedding_model=index.embedding_model.model_name,
+            embedding_key=index.embedding_model.embedding_key,
+            created_at=datetime.now().isoformat(timespec="seconds"),
+            seconds=round(time.perf_counter() - start, 3),
+        )
+        _write_atomic(os.path.join(tmp_dir, "manifest.json"), json.dumps(manifest, ensure_ascii=False, indent=2))
+        os.rename(tmp_dir, os.path.join(snapshot_dir, version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    _write_atomic(os.path.join(snapshot_dir, CURRENT_FILE), version)
+    _prune_snapshots(snapshot_dir, keep)
+    print(f"[snapshot] 已发布 {version}: {manifest['count']} 个节点，耗时 {manifest['seconds']}s")
+    return manifest
+
+
+def _export_collection(collection, target_dir: str) -> Dict[str, Any]:
+    total = collection.count()
+    ids: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    offsets = [0]
+    matrix = None
+    dim = 0
+    with open(os.path.join(target_dir, "documents.bin"), "wb") as documents_file:
+        for offset in range(0, total, EXPORT_BATCH_SIZE):
+            batch = collection.get(include=["embeddings", "metadatas", "documents"], limit=EXPORT_BATCH_SIZE,
+                                   offset=offset)
+            embeddings = np.asarray(batch["embeddings"], dtype=np.float32)
+            if matrix is None and len(embeddings):
+                dim = embeddings.shape[1]
+                matrix = np.lib.format.open_memmap(os.path.join(target_dir, "embeddings.npy"), mode="w+",
+                                                   dtype=np.float32, shape=(total, dim))
+            if len(embeddings):
+                matrix[len(ids):len(ids) + len(embeddings)] = embeddings
+            for document in batch["documents"] or [""] * len(batch["ids"]):
+                data = (document or "").encode("utf-8")
+                documents_file.write(data)
+                offsets.append(offsets[-1] + len(data))
+            ids.extend(batch["ids"])
+            metadatas.extend(batch["metadatas"] or [{}] * len(batch["ids"]))
+    if matrix is None:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(target_dir, "embeddings.npy"), matrix)
+        norms = np.zeros(0, dtype=np.float32)
+    else:
+        # 集合在导出过程中不会变化（持有写锁），行数应与 count 一致
+        matrix = matrix[:len(ids)]
+        norms = np.einsum("ij,ij->i", matrix, matrix)
+        matrix.flush()
+    np.save(os.path.join(target_dir, "norms.npy"), norms.astype(np.float32))
+    np.save(os.path.join(target_dir, "document_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(target_dir, "nodes.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "metadatas": metadatas}, f, ensure_ascii=False)
+    return {"count": len(ids), "dim": dim}
+
+
+def _prune_snapshots(snapshot_dir: str, keep: int):
+    current = read_current_version(snapshot_dir)
+    versions = sorted(name for name in os.listdir(snapshot_dir)
+                      if name.startswith("v") and os.path.isdir(os.path.join(snapshot_dir, name)))
+    for name in versions[:-max(1, keep)]:
+        if name != current:
+            shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+class IndexSnapshot:
+    """
+    一个已加载的快照版本（只读）
+
+    参数:
+        path: 版本目录
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest["version"]
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, "norms.npy"))
+        self.document_offsets = np.load(os.path.join(path, "document_offsets.npy"), mmap_mode="r")
+        self.documents = np.memmap(os.path.join(path, "documents.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(path, "documents.bin")) else np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(path, "nodes.json"), "r", encoding="utf-8") as f:
+            nodes = json.load(f)
+        self.ids: List[str] = nodes["ids"]
+        self.metadatas: List[Dict[str, Any]] = nodes["metadatas"]
+        self.doc_names = np.asarray([metadata.get("doc_name", "") for metadata in self.metadatas], dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def document(self, i: int) -> str:
+        start, end = int(self.document_offsets[i]), int(self.document_offsets[i + 1])
+        return bytes(self.documents[start:end]).decode("utf-8")
+
+    def search(self, query_embedding: List[float], top_k: int = 10,
+               doc_filter: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """精确检索：l2 距离 = |e|^2 + |q|^2 - 2 e·q，分数 = 1 - 距离（与 VectorIndex.search 相同）"""
+        if not len(self.ids) or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        distances = self.norms + np.dot(query, query) - 2 * (self.embeddings @ query)
+        if doc_filter:
+            distances = np.where(np.isin(self.doc_names, doc_filter), distances, np.inf)
+        k = min(top_k, len(distances))
+        candidates = np.argpartition(distances, k - 1)[:k]
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        results = []
+        for i in candidates:
+            if not np.isfinite(distances[i]):
+                continue
+            metadata = self.metadatas[i]
+            results.append({
+                "id": self.ids[i],
+                "doc_name": metadata.get("doc_name", ""),
+                "doc_description": metadata.get("doc_description", ""),
+                "node_id": metadata.get("node_id", ""),
+                "title": metadata.get("title", ""),
+                "path": metadata.get("path", ""),
+                "start_index": metadata.get("start_index", ""),
+                "end_index": metadata.get("end_index", ""),
+                "line_num": metadata.get("line_num", ""),
+                "summary": metadata.get("summary", ""),
+                "has_children": metadata.get("has_children", "False") == "True",
+                "score": 1 - float(distances[i]),
+                "document": self.document(int(i))
+            })
+        return results
+
+    def get_all_documents(self) -> List[str]:
+        return sorted({name for name in self.doc_names if name})
+
+
+class SnapshotIndex:
+    """
+    查询进程使用的只读向量索引：读取快照目录的当前版本，检测到新版本时热加载
+
+    提供与 VectorIndex 相同的 search / get_stats / get_all_documents 接口。
+
+    参数:
+        snapshot_dir: 快照目录
+        poll_interval: 检查新版本的最短间隔（秒）
+    """
+
+    def __init__(self, snapshot_dir: str = SNAPSHOT_DIR, poll_interval: float = SNAPSHOT_POLL_INTERVAL):
+        from .vector_index import OllamaEmbedding
+        self.snapshot_dir = snapshot_dir
+        self.poll_interval = poll_interval
+        self.embedding_model = OllamaEmbedding()
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[IndexSnapshot]:
+        """当前快照（按间隔检查 CURRENT，版本变化时加载新版本；尚未发布时返回 None）"""
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.poll_interval:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is None or now - self._checked_at >= self.poll_interval:
+                self._checked_at = now
+                version = read_current_version(self.snapshot_dir)
+                if version and (self._snapshot is None or self._snapshot.version != version):
+                    # 正在检索的请求继续使用旧版本对象，新请求使用新版本
+                    self._snapshot = IndexSnapshot(os.path.join(self.snapshot_dir, version))
+                    # 查询向量与快照中的向量使用同一个接口生成
+                    embedding_key = self._snapshot.manifest.get("embedding_key")
+                    if embedding_key:
+                        self.embedding_model.use_endpoint(embedding_key.rpartition("|")[2])
+                    print(f"[snapshot] 已加载 {version}: {len(self._snapshot)} 个节点")
+        return self._snapshot
+
+    @property
+    def version(self) -> Optional[str]:
+        snapshot = self.current()
+        return snapshot.version if snapshot else None
+
+    def search(self, query: str, top_k: int = 10, doc_filter: List[str] = None) -> List[Dict[str, Any]]:
+        snapshot = self.current()
+        if snapshot is None:
+            return []
+        return snapshot.search(self.embedding_model.embed(query), top_k, doc_filter)
+
+    def get_all_documents(self) -> List[str]:
+        snapshot = self.current()
+        return snapshot.get_all_documents() if snapshot else []
+
+    def get_stats(self) -> Dict[str, Any]:
+        snapshot = self.current()
+        if snapshot is None:
+            return {"total_nodes": 0, "total_documents": 0, "documents": [], "snapshot": None}
+        documents = snapshot.get_all_documents()
+        return {
+            "total_nodes": len(snapshot),
+            "total_documents": len(documents),
+            "documents": documents,
+            "snapshot": snapshot.version
+        }
+
+
+class SnapshotPublisher:
+    """
+    写入进程中的快照发布线程：收到通知或定期检查到向量索引变化（指纹不同）时发布新快照
+
+    参数:
+        index: 向量索引，默认使用全局实例
+        snapshot_dir: 快照目录
+        interval: 定期检查的间隔（秒）
+    """
+
+    def __init__(self, index=None, snapshot_dir: str = SNAPSHOT_DIR, interval: float = SNAPSHOT_POLL_INTERVAL):
+        self.index = index
+        self.snapshot_dir = snapshot_dir
+        self.interval = max(0.1, interval)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _published_fingerprint(self) -> Optional[str]:
+        version = read_current_version(self.snapshot_dir)
+        if not version:
+            return None
+        try:
+            with open(os.path.join(self.snapshot_dir, version, "manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("fingerprint")
+        except (OSError, ValueError):
+            return None
+
+    def publish_if_changed(self) -> Optional[Dict[str, Any]]:
+        """向量索引与当前快照不一致时发布新快照，返回新版本的 manifest"""
+        from .vector_index import get_vector_index
+        self.index = self.index or get_vector_index()
+        fingerprint = index_fingerprint(self.index.persist_dir, self.index.collection.name)
+        if fingerprint == self._published_fingerprint():
+            return None
+        return publish_snapshot(self.index, self.snapshot_dir)
+
+    def notify(self):
+        """索引可能已变化（导入、删除、重建完成后调用）"""
+        self._wake.set()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="pageindex-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.publish_if_changed()
+            except Exception as e:
+                print(f"[snapshot] 发布失败: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+# 查询进程的全局快照索引
+_snapshot_index_instance = None
+_snapshot_index_lock = threading.Lock()
+
+
+def get_snapshot_index() -> SnapshotIndex:
+    """获取全局快照索引实例（单例模式）"""
+    global _snapshot_index_instance
+    with _snapshot_index_lock:
+        if _snapshot_index_instance is None:
+            _snapshot_index_instance = SnapshotIndex()
+        return _snapshot_index_instance
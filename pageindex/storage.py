@@ -0,0 +1,481 @@
+"""
+PageIndex 结果存储模块
+
+节点文本较多时（if_add_node_text=yes，以及 Markdown 文档），结果拆分为两个文件保存：
+    <文档名>_structure.json: 骨架（标题、node_id、页码范围、摘要等），节点文本替换为 text_spans
+        （"偏移:长度,偏移:长度"，文本文件中的字节片段）
+    <文档名>_structure.<内容哈希>.text: UTF-8 文本，每段文本只保存一次
+
+父节点文本通常由自身开头部分和子节点文本组成（PDF 相邻节点还可能共用边界页），
+因此父节点只保存子节点没有覆盖的部分，其余部分引用子节点的文本片段，读取时按需拼接。
+文本文件通过 mmap 读取，加载骨架时不解析文本。
+
+骨架可以保存为 JSON（默认）或 msgpack 二进制格式（PAGEINDEX_RESULT_FORMAT=msgpack，<文档名>_structure.msgpack），
+调用方始终使用 <文档名>_structure.json 作为结构文件的逻辑路径，读取时自动选择实际存在的格式。
+结果目录中的清单文件记录每个文档的名称、描述、节点数和文件信息，列出文档时不需要逐个解析结构文件。
+"""
+
+import os
+import io
+import re
+import glob
+import json
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # 未安装时只能读写 JSON 格式
+    msgpack = None
+
+# 是否拆分保存节点文本
+SPLIT_TEXT = os.getenv("PAGEINDEX_SPLIT_TEXT", "yes").lower() == "yes"
+TEXT_SIDECAR_SUFFIX = ".text"
+# 同时保持打开的文本文件数
+TEXT_STORE_CACHE_SIZE = 64
+
+# 骨架格式："json" 或 "msgpack"
+RESULT_FORMAT = os.getenv("PAGEINDEX_RESULT_FORMAT", "json").lower()
+STRUCTURE_SUFFIX = "_structure.json"
+FORMAT_EXTENSIONS = {"json": ".json", "msgpack": ".msgpack"}
+# 结果目录清单
+MANIFEST_NAME = ".results_manifest"
+
+
+def _check_format(fmt: str) -> str:
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"不支持的结果格式: {fmt}")
+    if fmt == "msgpack" and msgpack is None:
+        raise ImportError("保存 msgpack 格式需要安装 msgpack（pip install msgpack）")
+    return fmt
+
+
+def format_path(path: str, fmt: str) -> str:
+    """逻辑路径（.json）对应的指定格式文件路径"""
+    return os.path.splitext(path)[0] + FORMAT_EXTENSIONS[fmt]
+
+
+def resolve_result_path(path: str) -> Optional[str]:
+    """
+    返回逻辑路径对应的实际结构文件（两种格式都存在时取较新的），不存在时返回 None
+    """
+    candidates = [candidate for candidate in (format_path(path, fmt) for fmt in FORMAT_EXTENSIONS)
+                  if os.path.exists(candidate)]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda candidate: os.stat(candidate).st_mtime_ns)
+
+
+def result_exists(path: str) -> bool:
+    return resolve_result_path(path) is not None
+
+
+def _encode(data: Any, fmt: str) -> bytes:
+    if fmt == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _read_file(path: str) -> Any:
+    if path.endswith(FORMAT_EXTENSIONS["msgpack"]):
+        if msgpack is None:
+            raise ImportError(f"读取 {path} 需要安装 msgpack（pip install msgpack）")
+        with open(path, "rb") as f:
+            return msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def text_sidecar_path(path: str, text_data: bytes) -> str:
+    """
+    结构文件对应的文本文件路径
+
+    文件名包含内容哈希，重新保存时写入新文件并保留上一版本的文本文件，正在读取旧骨架的请求仍然读到匹配的旧文本
+    """
+    digest = hashlib.sha1(text_data).hexdigest()[:12]
+    return f"{os.path.splitext(path)[0]}.{digest}{TEXT_SIDECAR_SUFFIX}"
+
+
+def _remove_stale_sidecars(path: str, keep: Optional[str] = None, keep_previous: bool = False):
+    """删除结构文件的文本文件，保留 keep；keep_previous 为 True 时另外保留最近修改的一个（上一版本）"""
+    stem = os.path.splitext(path)[0]
+    name_pattern = re.compile(re.escape(os.path.basename(stem)) + r"\.[0-9a-f]{12}" + re.escape(TEXT_SIDECAR_SUFFIX) + "$")
+    stale = []
+    for sidecar in glob.glob(f"{glob.escape(stem)}.*{TEXT_SIDECAR_SUFFIX}"):
+        if not name_pattern.match(os.path.basename(sidecar)):
+            continue
+        if keep is None or os.path.abspath(sidecar) != os.path.abspath(keep):
+            stale.append((os.stat(sidecar).st_mtime_ns, sidecar))
+    stale.sort(reverse=True)
+    for _, sidecar in stale[1 if keep_previous else 0:]:
+        os.remove(sidecar)
+
+
+class _SpanWriter:
+    """顺序写入文本片段，相同内容只写一次"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self._seen: Dict[bytes, List[int]] = {}
+
+    def add(self, data: bytes) -> List[List[int]]:
+        if not data:
+            return []
+        digest = hashlib.sha1(data).digest()
+        span = self._seen.get(digest)
+        if span is None:
+            span = [self.buffer.tell(), len(data)]
+            self.buffer.write(data)
+            self._seen[digest] = span
+        return [list(span)]
+
+
+def _append_spans(spans: List[List[int]], new_spans: List[List[int]]):
+    """追加片段，与前一个片段相邻时合并"""
+    for offset, length in new_spans:
+        if spans and spans[-1][0] + spans[-1][1] == offset:
+            spans[-1][1] += length
+        else:
+            spans.append([offset, length])
+
+
+def _skip_bytes(spans: List[List[int]], skip: int) -> List[List[int]]:
+    """去掉片段列表开头的 skip 个字节"""
+    result = []
+    for offset, length in spans:
+        if skip >= length:
+            skip -= length
+            continue
+        result.append([offset + skip, length - skip])
+        skip = 0
+    return result
+
+
+def format_spans(spans: List[List[int]]) -> str:
+    """片段列表 -> "偏移:长度,偏移:长度" 字符串（骨架保持紧凑）"""
+    return ",".join(f"{offset}:{length}" for offset, length in spans)
+
+
+def parse_spans(value: str) -> List[List[int]]:
+    """format_spans 的逆操作"""
+    return [[int(part) for part in item.split(":")] for item in value.split(",") if item]
+
+
+def _encode_node(node: Dict[str, Any], writer: _SpanWriter):
+    """
+    后序处理节点：去掉 text 并写入 text_spans
+
+    返回:
+        (文本的 UTF-8 字节, 片段列表)，节点没有文本时为 (None, None)
+    """
+    children = [_encode_node(child, writer) for child in node.get("nodes") or [] if isinstance(child, dict)]
+    text = node.pop("text", None)
+    node.pop("text_spans", None)
+    if text is None:
+        return None, None
+
+    data = text.encode("utf-8")
+    spans: List[List[int]] = []
+    cursor = 0
+    search_from = 0
+    for child_data, child_spans in children:
+        if not child_data:
+            continue
+        # 允许与前一个子节点重叠（PDF 相邻节点共用边界页）
+        pos = data.find(child_data, search_from)
+        if pos < 0 or pos + len(child_data) <= cursor:
+            continue
+        if pos > cursor:
+            _append_spans(spans, writer.add(data[cursor:pos]))
+        _append_spans(spans, _skip_bytes(child_spans, max(0, cursor - pos)))
+        cursor = pos + len(child_data)
+        search_from = pos + 1
+    _append_spans(spans, writer.add(data[cursor:]))
+    node["text_spans"] = format_spans(spans)
+    return data, spans
+
+
+def split_structure_text(structure: Any) -> bytes:
+    """
+    把结构中的节点文本移到文本缓冲区（原地修改：text 替换为 text_spans）
+
+    返回:
+        文本文件内容
+    """
+    writer = _SpanWriter()
+    for node in structure if isinstance(structure, list) else [structure]:
+        if isinstance(node, dict):
+            _encode_node(node, writer)
+    return writer.buffer.getvalue()
+
+
+def _has_text(structure: Any) -> bool:
+    if isinstance(structure, dict):
+        return "text" in structure or _has_text(structure.get("nodes"))
+    if isinstance(structure, list):
+        return any(_has_text(item) for item in structure)
+    return False
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def save_result(result: Dict[str, Any], path: str, split_text: Optional[bool] = None, fmt: Optional[str] = None):
+    """
+    保存处理结果
+
+    参数:
+        result: page_index / md_to_tree 的结果（不会被修改）
+        path: 结构文件的逻辑路径（<文档名>_structure.json）
+        split_text: 是否拆分保存节点文本，默认由环境变量 PAGEINDEX_SPLIT_TEXT 决定（默认拆分）
+        fmt: 骨架格式（"json" 或 "msgpack"），默认由环境变量 PAGEINDEX_RESULT_FORMAT 决定（默认 JSON）
+
+    返回:
+        {"path": 实际写入的骨架文件路径, "text_file": 文本文件路径（未拆分时为 None）}
+    """
+    split_text = SPLIT_TEXT if split_text is None else split_text
+    fmt = _check_format((fmt or RESULT_FORMAT).lower())
+    path = format_path(path, "json")
+    structure = result.get("structure")
+    output = {key: value for key, value in result.items() if key != "text_file"}
+    sidecar = None
+    if split_text and _has_text(structure):
+        structure = json.loads(json.dumps(structure, ensure_ascii=False))
+        text_data = split_structure_text(structure)
+        sidecar = text_sidecar_path(path, text_data)
+        output["structure"] = structure
+        output["text_file"] = os.path.basename(sidecar)
+        # 先写文本文件，再替换骨架
+        _write_atomic(sidecar, text_data)
+    target = format_path(path, fmt)
+    _write_atomic(target, _encode(output, fmt))
+    for other in FORMAT_EXTENSIONS:
+        if other != fmt and os.path.exists(format_path(path, other)):
+            os.remove(format_path(path, other))
+    # 上一版本的文本文件保留到下次保存，已加载旧骨架的请求仍可读取节点文本
+    _remove_stale_sidecars(path, keep=sidecar, keep_previous=True)
+    update_manifest_entry(os.path.dirname(path), os.path.basename(path), output, target)
+    return {"path": target, "text_file": sidecar}
+
+
+def delete_result(path: str):
+    """删除结构文件（所有格式）、文本文件和清单条目"""
+    path = format_path(path, "json")
+    for fmt in FORMAT_EXTENSIONS:
+        if os.path.exists(format_path(path, fmt)):
+            os.remove(format_path(path, fmt))
+    _remove_stale_sidecars(path)
+    remove_manifest_entry(os.path.dirname(path), os.path.basename(path))
+
+
+class TextStore:
+    """
+    通过 mmap 读取的文本文件
+
+    参数:
+        path: 文本文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def text(self, spans) -> str:
+        """拼接片段（片段列表或 format_spans 字符串）并解码"""
+        if isinstance(spans, str):
+            spans = parse_spans(spans)
+        return b"".join(self._mmap[offset:offset + length] for offset, length in spans).decode("utf-8")
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+
+_store_cache: "OrderedDict[tuple, TextStore]" = OrderedDict()
+_store_lock = threading.Lock()
+
+
+def open_text_store(path: str) -> TextStore:
+    """打开文本文件（按路径和修改时间缓存，文件被替换后自动重新打开）"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _store_lock:
+        store = _store_cache.get(key)
+        if store is not None:
+            _store_cache.move_to_end(key)
+            return store
+        store = TextStore(path)
+        _store_cache[key] = store
+        # 旧版本和超出数量的文件不再使用后由垃圾回收关闭，正在读取的引用不受影响
+        for old_key in [k for k in _store_cache if k[0] == key[0] and k != key]:
+            del _store_cache[old_key]
+        while len(_store_cache) > TEXT_STORE_CACHE_SIZE:
+            _store_cache.popitem(last=False)
+        return store
+
+
+def _inline_text(structure: Any, store: TextStore):
+    for node in structure if isinstance(structure, list) else [structure]:
+        if not isinstance(node, dict):
+            continue
+        spans = node.pop("text_spans", None)
+        if spans is not None:
+            node["text"] = store.text(spans)
+        _inline_text(node.get("nodes") or [], store)
+
+
+def load_result(path: str, with_text: bool = False) -> Dict[str, Any]:
+    """
+    读取结构文件（兼容节点文本内嵌的旧格式）
+
+    参数:
+        path: 结构文件的逻辑路径（<文档名>_structure.json），也可以直接是 .msgpack 文件
+        with_text: 是否把拆分保存的节点文本还原为 text 字段（增量处理需要完整结果时使用）；
+            为 False 时节点保留 text_spans，用 get_node_text 按需读取
+
+    返回:
+        处理结果，拆分保存时 text_file 为文本文件的完整路径
+    """
+    actual_path = resolve_result_path(path)
+    if actual_path is None:
+        raise FileNotFoundError(path)
+    result = _read_file(actual_path)
+    if result.get("text_file"):
+        result["text_file"] = os.path.join(os.path.dirname(path), os.path.basename(result["text_file"]))
+        if with_text:
+            _inline_text(result.get("structure", []), open_text_store(result["text_file"]))
+            result.pop("text_file")
+    return result
+
+
+def get_node_text(result: Dict[str, Any], node: Dict[str, Any]) -> str:
+    """
+    获取节点文本：优先使用内嵌的 text，否则从文本文件读取
+
+    参数:
+        result: load_result 返回的结果
+        node: 结果中的节点
+    """
+    if node.get("text"):
+        return node["text"]
+    spans = node.get("text_spans")
+    if spans and result.get("text_file"):
+        return open_text_store(result["text_file"]).text(spans)
+    return ""
+
+
+def _count_nodes(structure: Any) -> int:
+    if isinstance(structure, dict):
+        return 1 + _count_nodes(structure.get("nodes") or [])
+    if isinstance(structure, list):
+        return sum(_count_nodes(item) for item in structure)
+    return 0
+
+
+def _manifest_entry(name: str, result: Dict[str, Any], actual_path: str) -> Dict[str, Any]:
+    stat = os.stat(actual_path)
+    return {
+        "file": name,
+        "format": "msgpack" if actual_path.endswith(FORMAT_EXTENSIONS["msgpack"]) else "json",
+        "doc_name": result.get("doc_name", name[:-len(STRUCTURE_SUFFIX)]),
+        "doc_description": result.get("doc_description", ""),
+        "node_count": _count_nodes(result.get("structure", [])),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+_manifest_lock = threading.Lock()
+
+
+def _manifest_path(results_dir: str, fmt: str) -> str:
+    return os.path.join(results_dir, MANIFEST_NAME + FORMAT_EXTENSIONS[fmt])
+
+
+def _read_manifest(results_dir: str) -> Dict[str, Dict[str, Any]]:
+    paths = [_manifest_path(results_dir, fmt) for fmt in FORMAT_EXTENSIONS]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return {}
+    try:
+        return _read_file(max(paths, key=lambda path: os.stat(path).st_mtime_ns)).get("files", {})
+    except Exception:
+        return {}
+
+
+def _write_manifest(results_dir: str, entries: Dict[str, Dict[str, Any]]):
+    fmt = RESULT_FORMAT if RESULT_FORMAT in FORMAT_EXTENSIONS and (RESULT_FORMAT != "msgpack" or msgpack) else "json"
+    _write_atomic(_manifest_path(results_dir, fmt), _encode({"files": entries}, fmt))
+    for other in FORMAT_EXTENSIONS:
+        if other != fmt and os.path.exists(_manifest_path(results_dir, other)):
+            os.remove(_manifest_path(results_dir, other))
+
+
+def update_manifest_entry(results_dir: str, name: str, result: Dict[str, Any], actual_path: str):
+    """保存结果后更新清单条目"""
+    results_dir = results_dir or "."
+    with _manifest_lock:
+        entries = _read_manifest(results_dir)
+        entries[name] = _manifest_entry(name, result, actual_path)
+        _write_manifest(results_dir, entries)
+
+
+def remove_manifest_entry(results_dir: str, name: str):
+    results_dir = results_dir or "."
+    with _manifest_lock:
+        entries = _read_manifest(results_dir)
+        if entries.pop(name, None) is not None:
+            _write_manifest(results_dir, entries)
+
+
+def list_result_files(results_dir: str) -> List[str]:
+    """结果目录中的结构文件（逻辑文件名 <文档名>_structure.json，两种格式合并）"""
+    if not os.path.isdir(results_dir):
+        return []
+    names = set()
+    for filename in os.listdir(results_dir):
+        stem, ext = os.path.splitext(filename)
+        if ext in FORMAT_EXTENSIONS.values() and stem.endswith(STRUCTURE_SUFFIX[:-len(".json")]):
+            names.add(stem + ".json")
+    return sorted(names)
+
+
+def load_manifest(results_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    读取结果目录清单：{逻辑文件名: {"doc_name", "doc_description", "node_count", "format", "size", "mtime_ns"}}
+
+    清单只是缓存：缺失或过期（文件大小、修改时间不一致）的条目会重新读取结构文件并写回，
+    已删除的文件会从清单中移除，因此其他进程直接写入结果目录也不影响正确性。
+    """
+    with _manifest_lock:
+        entries = _read_manifest(results_dir)
+        current = {}
+        changed = False
+        for name in list_result_files(results_dir):
+            actual_path = resolve_result_path(os.path.join(results_dir, name))
+            if actual_path is None:
+                continue
+            stat = os.stat(actual_path)
+            entry = entries.get(name)
+            if (entry is None or entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns
+                    or not actual_path.endswith(FORMAT_EXTENSIONS.get(entry.get("format"), ""))):
+                try:
+                    entry = _manifest_entry(name, _read_file(actual_path), actual_path)
+                except Exception as e:
+                    print(f"读取结构文件失败 {actual_path}: {e}")
+                    continue
+                changed = True
+            current[name] = entry
+        if changed or set(current) != set(entries):
+            _write_manifest(results_dir, current)
+        return current
@@ -0,0 +1,247 @@
+"""
+PageIndex 节点摘要模块
+
+自底向上生成节点摘要：叶子节点先生成摘要，父节点根据子节点摘要和自身开头文本生成摘要，
+避免把整章全文发送给模型。并发数有上限，超过 token 上限的文本会被截断或分块汇总（map-reduce），
+低于阈值的短节点不调用模型（直接使用原文或抽取式摘要），并统计每个文档的 token 用量（取自 LLM 调用统计的 summary 阶段）。
+"""
+
+import re
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+from .utils import ChatGPT_API_async, count_tokens, lazy_import
+from .metrics import llm_stage, collect_llm_metrics, current_llm_metrics
+
+tiktoken = lazy_import("tiktoken")
+
+
+LEAF_SUMMARY_PROMPT = """You are given a part of a document, your task is to generate a description of the partial document about what are main points covered in the partial document.
+
+    Partial Document Text: {text}
+
+    Directly return the description, do not include any other text.
+    """
+
+PARENT_SUMMARY_PROMPT = """You are given the opening text of a section of a document and the descriptions of its subsections, your task is to generate a description of the whole section about what are main points covered in the section.
+
+    Section Title: {title}
+
+    Section Opening Text: {prefix}
+
+    Subsection Descriptions:
+    {children}
+
+    Directly return the description, do not include any other text.
+    """
+
+REDUCE_SUMMARY_PROMPT = """You are given the descriptions of consecutive parts of a document section, your task is to combine them into one description of the section about what are main points covered in the section.
+
+    Section Title: {title}
+
+    Part Descriptions:
+    {parts}
+
+    Directly return the description, do not include any other text.
+    """
+
+
+def _get_encoding(model=None):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model=None) -> str:
+    """将文本截断到不超过 max_tokens 个 token"""
+    if not text:
+        return ""
+    enc = _get_encoding(model)
+    tokens = enc.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens])
+
+
+def extractive_summary(title: str, text: str, lead_sentences: int = 3) -> str:
+    """
+    抽取式摘要：节点标题 + 正文开头的若干句
+
+    参数:
+        title: 节点标题
+        text: 节点文本
+        lead_sentences: 抽取的句子数
+    """
+    text = " ".join((text or "").split())
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?。！？；;])\s*", text) if sentence.strip()]
+    lead = " ".join(sentences[:lead_sentences])
+    title = (title or "").strip()
+    if not title or lead.startswith(title):
+        return lead
+    return f"{title}: {lead}" if lead else title
+
+
+def split_by_tokens(text: str, chunk_tokens: int, model=None) -> List[str]:
+    """按 token 数将文本切分为若干块"""
+    enc = _get_encoding(model)
+    tokens = enc.encode(text or "")
+    return [enc.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens), chunk_tokens)]
+
+
+class SummaryEngine:
+    """
+    有界并发、自底向上的摘要生成器
+
+    参数:
+        model: 使用的模型
+        concurrency: 同时进行的 LLM 调用数上限
+        max_tokens: 单次发送给模型的节点文本 token 上限
+        prefix_tokens: 父节点自身开头文本的 token 上限
+        long_text_strategy: 超长文本处理方式，"map_reduce"（分块汇总）或 "truncate"（截断）
+        token_threshold: 低于该 token 数的节点不调用模型
+        short_node_mode: 短节点摘要方式，"text"（使用原文，与 Markdown 流程一致）或 "extractive"（抽取式摘要）
+        lead_sentences: 抽取式摘要的句子数
+        logger: 日志记录器（可选）
+    """
+
+    def __init__(self, model=None, concurrency=8, max_tokens=8000, prefix_tokens=1000,
+                 long_text_strategy="map_reduce", token_threshold=200, short_node_mode="extractive",
+                 lead_sentences=3, logger=None):
+        self.model = model
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.max_tokens = max_tokens
+        self.prefix_tokens = prefix_tokens
+        self.long_text_strategy = long_text_strategy
+        self.token_threshold = token_threshold or 0
+        self.short_node_mode = short_node_mode
+        self.lead_sentences = lead_sentences
+        self.logger = logger
+        self.usage = {
+            "llm_calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "summarized_nodes": 0,
+            "reused_summaries": 0,
+            "short_nodes": 0,
+            "truncated_nodes": 0,
+            "map_reduced_nodes": 0,
+        }
+
+    @classmethod
+    def from_opt(cls, opt, logger=None) -> "SummaryEngine":
+        """根据处理配置创建摘要生成器"""
+        return cls(
+            model=opt.model,
+            concurrency=getattr(opt, "summary_concurrency", 8),
+            max_tokens=getattr(opt, "summary_max_tokens", 8000),
+            prefix_tokens=getattr(opt, "summary_prefix_tokens", 1000),
+            long_text_strategy=getattr(opt, "summary_long_text_strategy", "map_reduce"),
+            token_threshold=getattr(opt, "summary_token_threshold", 200),
+            short_node_mode=getattr(opt, "summary_short_node_mode", "extractive"),
+            lead_sentences=getattr(opt, "summary_lead_sentences", 3),
+            logger=logger,
+        )
+
+    async def _call(self, prompt: str) -> str:
+        async with self.semaphore:
+            return await ChatGPT_API_async(self.model, prompt)
+
+    async def summarize_text(self, text: str, title: str = "") -> str:
+        """为一段文本生成摘要，超过 token 上限时截断或分块汇总"""
+        if count_tokens(text, model=self.model) <= self.max_tokens:
+            return await self._call(LEAF_SUMMARY_PROMPT.format(text=text))
+
+        if self.long_text_strategy != "map_reduce":
+            self.usage["truncated_nodes"] += 1
+            return await self._call(LEAF_SUMMARY_PROMPT.format(text=truncate_to_tokens(text, self.max_tokens, self.model)))
+
+        self.usage["map_reduced_nodes"] += 1
+        chunks = split_by_tokens(text, self.max_tokens, self.model)
+        part_summaries = await asyncio.gather(*[
+            self._call(LEAF_SUMMARY_PROMPT.format(text=chunk)) for chunk in chunks
+        ])
+        parts = "\n".join(f"{i + 1}. {summary}" for i, summary in enumerate(part_summaries))
+        return await self._call(REDUCE_SUMMARY_PROMPT.format(
+            title=title, parts=truncate_to_tokens(parts, self.max_tokens, self.model)))
+
+    async def summarize_parent(self, node: Dict[str, Any], child_summaries: List[str]) -> str:
+        """根据父节点开头文本和子节点摘要生成父节点摘要"""
+        prefix = truncate_to_tokens(node.get("text", ""), self.prefix_tokens, self.model)
+        children = "\n".join(
+            f"- {child.get('title', '')}: {summary}"
+            for child, summary in zip(node["nodes"], child_summaries)
+        )
+        children = truncate_to_tokens(children, self.max_tokens, self.model)
+        return await self._call(PARENT_SUMMARY_PROMPT.format(
+            title=node.get("title", ""), prefix=prefix, children=children))
+
+    def _node_tokens(self, node: Dict[str, Any], page_list) -> int:
+        # 优先复用 get_page_tokens 已算好的每页 token 数
+        start, end = node.get("start_index"), node.get("end_index")
+        if page_list and start is not None and end is not None:
+            return sum(page[1] for page in page_list[start - 1:end])
+        return count_tokens(node.get("text", ""), model=self.model)
+
+    async def _summarize_node(self, node: Dict[str, Any], needs_summary: Callable[[Dict[str, Any]], bool], page_list=None) -> str:
+        child_summaries = []
+        if node.get("nodes"):
+            child_summaries = await asyncio.gather(*[
+                self._summarize_node(child, needs_summary, page_list) for child in node["nodes"]
+            ])
+
+        if node.get("summary") and not needs_summary(node):
+            self.usage["reused_summaries"] += 1
+            return node["summary"]
+
+        if self._node_tokens(node, page_list) < self.token_threshold:
+            text = node.get("text", "")
+            if self.short_node_mode == "text":
+                summary = text
+            else:
+                summary = extractive_summary(node.get("title", ""), text, self.lead_sentences)
+            node["summary"] = summary
+            self.usage["short_nodes"] += 1
+            return summary
+
+        if child_summaries:
+            summary = await self.summarize_parent(node, child_summaries)
+        else:
+            summary = await self.summarize_text(node.get("text", ""), title=node.get("title", ""))
+        node["summary"] = summary
+        self.usage["summarized_nodes"] += 1
+        return summary
+
+    async def run(self, structure: Any, needs_summary: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                  page_list=None) -> Dict[str, int]:
+        """
+        为结构中的节点生成摘要（节点需已包含 text 字段）
+
+        参数:
+            structure: 树结构
+            needs_summary: 判断已有摘要的节点是否需要重新生成，默认全部重新生成
+            page_list: (页面文本, token 数量) 列表，提供时用于判断短节点，避免重新计算 token
+
+        返回:
+            token 用量统计（接口返回的 usage，与 llm_metrics 中 summary 阶段的统计一致）
+        """
+        if needs_summary is None:
+            needs_summary = lambda node: True
+        roots = structure if isinstance(structure, list) else [structure]
+        # 用量取自 LLM 调用统计：记录本次运行前后 summary 阶段的差值（未在收集统计时单独收集）
+        metrics = current_llm_metrics()
+        with collect_llm_metrics(metrics) as metrics:
+            before = metrics.stage_usage("summary")
+            with llm_stage("summary"):
+                await asyncio.gather(*[self._summarize_node(node, needs_summary, page_list) for node in roots])
+            after = metrics.stage_usage("summary")
+        self.usage["llm_calls"] = after["calls"] - before["calls"]
+        self.usage["prompt_tokens"] = after["prompt_tokens"] - before["prompt_tokens"]
+        self.usage["completion_tokens"] = after["completion_tokens"] - before["completion_tokens"]
+        self.usage["total_tokens"] = self.usage["prompt_tokens"] + self.usage["completion_tokens"]
+        if self.logger:
+            self.logger.info({"summary_usage": self.usage})
+        print(f"摘要生成完成: {self.usage['summarized_nodes']} 个节点, {self.usage['short_nodes']} 个短节点未调用模型, "
+              f"{self.usage['llm_calls']} 次调用, "
+              f"{self.usage['total_tokens']} tokens")
+        return self.usage
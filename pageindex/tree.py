@@ -0,0 +1,228 @@
+"""
+PageIndex 紧凑树结构模块
+
+DocumentTree 把嵌套的 {"title", "node_id", ..., "nodes": [...]} 结构按先序展开为并列数组
+（父节点、第一个子节点、下一个兄弟节点、深度、起止页码、标题等），
+遍历、按 node_id 查找、判断叶子节点都不需要递归或复制节点，并且可以无损地转换回原来的 JSON 结构。
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+# 数组中表示"没有该节点"的下标
+NO_NODE = -1
+
+
+class DocumentTree:
+    """
+    以并列数组存储的文档树
+
+    节点按先序编号（与 write_node_id 的编号顺序一致），下标 i 的节点：
+        parent[i] / first_child[i] / next_sibling[i]: 父节点、第一个子节点、下一个兄弟节点的下标（没有时为 NO_NODE）
+        depth[i]: 深度（根节点为 0）
+        subtree_end[i]: 子树最后一个节点的下标 + 1，子树为 [i, subtree_end[i])
+        start_index[i] / end_index[i]: 起止页码（没有时为 None）
+        node_ids[i] / titles[i]: node_id 和标题
+        fields[i]: 节点除 "nodes" 外的字段（与原结构共用字段值，不复制 text）
+
+    用法:
+        tree = DocumentTree.from_structure(result["structure"])
+        node = tree.get("0007")
+        for i in tree.leaves():
+            print(tree.titles[i])
+        structure = tree.to_structure()
+    """
+
+    __slots__ = ("parent", "first_child", "next_sibling", "depth", "subtree_end", "start_index", "end_index",
+                 "node_ids", "titles", "fields", "roots", "_key_order", "_id_index", "_single_root")
+
+    def __init__(self):
+        self.parent: List[int] = []
+        self.first_child: List[int] = []
+        self.next_sibling: List[int] = []
+        self.depth: List[int] = []
+        self.subtree_end: List[int] = []
+        self.start_index: List[Optional[int]] = []
+        self.end_index: List[Optional[int]] = []
+        self.node_ids: List[Optional[str]] = []
+        self.titles: List[str] = []
+        self.fields: List[Dict[str, Any]] = []
+        self.roots: List[int] = []
+        # 原节点的键顺序（含 "nodes" 的位置），用于无损还原
+        self._key_order: List[tuple] = []
+        self._id_index: Dict[str, int] = {}
+        self._single_root = False
+
+    @classmethod
+    def from_structure(cls, structure: Any) -> "DocumentTree":
+        """
+        从嵌套结构（节点字典或节点列表）构建
+
+        参数:
+            structure: page_index / md_to_tree 返回的 structure
+        """
+        tree = cls()
+        tree._single_root = isinstance(structure, dict)
+        roots = structure if isinstance(structure, list) else [structure]
+        # 显式栈代替递归：(节点, 父节点下标, 深度)
+        stack = [(node, NO_NODE, 0) for node in reversed(roots) if isinstance(node, dict)]
+        last_child: Dict[int, int] = {}
+        while stack:
+            node, parent, depth = stack.pop()
+            i = tree._append(node, parent, depth)
+            if parent == NO_NODE:
+                if tree.roots:
+                    tree.next_sibling[tree.roots[-1]] = i
+                tree.roots.append(i)
+            else:
+                previous = last_child.get(parent, NO_NODE)
+                if previous == NO_NODE:
+                    tree.first_child[parent] = i
+                else:
+                    tree.next_sibling[previous] = i
+                last_child[parent] = i
+            children = node.get("nodes") or []
+            stack.extend((child, i, depth + 1) for child in reversed(children) if isinstance(child, dict))
+
+        # 先序编号下，子树结束位置是下一个深度不大于当前节点的节点
+        n = len(tree.parent)
+        tree.subtree_end = [n] * n
+        open_nodes: List[int] = []
+        for i in range(n):
+            while open_nodes and tree.depth[open_nodes[-1]] >= tree.depth[i]:
+                tree.subtree_end[open_nodes.pop()] = i
+            open_nodes.append(i)
+        return tree
+
+    def _append(self, node: Dict[str, Any], parent: int, depth: int) -> int:
+        i = len(self.parent)
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.depth.append(depth)
+        self.start_index.append(node.get("start_index"))
+        self.end_index.append(node.get("end_index"))
+        node_id = node.get("node_id")
+        self.node_ids.append(node_id)
+        self.titles.append(node.get("title", ""))
+        self.fields.append({key: value for key, value in node.items() if key != "nodes"})
+        self._key_order.append(tuple(node.keys()))
+        if node_id is not None:
+            self._id_index.setdefault(node_id, i)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def index_of(self, node_id: str) -> int:
+        """node_id 对应的下标，不存在时抛出 KeyError"""
+        return self._id_index[node_id]
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._id_index
+
+    def __getitem__(self, node_id: str) -> Dict[str, Any]:
+        """按 node_id 返回节点字段，不存在时抛出 KeyError"""
+        return self.fields[self._id_index[node_id]]
+
+    def get(self, node_id: str, default: Any = None) -> Optional[Dict[str, Any]]:
+        """按 node_id 返回节点字段（不含子节点，不复制）"""
+        i = self._id_index.get(node_id)
+        return self.fields[i] if i is not None else default
+
+    def is_leaf(self, node_id: str) -> bool:
+        """指定 node_id 的节点是否为叶子节点（节点不存在时返回 False）"""
+        i = self._id_index.get(node_id)
+        return i is not None and self.first_child[i] == NO_NODE
+
+    def children(self, i: int) -> Iterator[int]:
+        """子节点下标"""
+        child = self.first_child[i]
+        while child != NO_NODE:
+            yield child
+            child = self.next_sibling[child]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """按先序返回节点字段"""
+        return iter(self.fields)
+
+    def leaves(self) -> Iterator[int]:
+        """叶子节点下标（先序）"""
+        return (i for i in range(len(self.parent)) if self.first_child[i] == NO_NODE)
+
+    def descendants(self, i: int) -> range:
+        """子树中除自身以外的节点下标"""
+        return range(i + 1, self.subtree_end[i])
+
+    def ancestors(self, i: int) -> Iterator[int]:
+        """从父节点到根节点的下标"""
+        i = self.parent[i]
+        while i != NO_NODE:
+            yield i
+            i = self.parent[i]
+
+    def path(self, i: int, separator: str = "/") -> str:
+        """从根节点到该节点的标题路径"""
+        titles = [self.titles[j] for j in reversed(list(self.ancestors(i)))]
+        titles.append(self.titles[i])
+        return separator.join(titles)
+
+    def page_range(self, i: int) -> tuple:
+        """(起始页码, 结束页码)"""
+        return self.start_index[i], self.end_index[i]
+
+    def write_node_ids(self, start: int = 0) -> int:
+        """按先序重新编号 node_id（与 write_node_id 相同），返回下一个可用编号"""
+        self._id_index = {}
+        for i, fields in enumerate(self.fields):
+            node_id = str(start + i).zfill(4)
+            fields["node_id"] = node_id
+            self.node_ids[i] = node_id
+            self._id_index[node_id] = i
+            if "node_id" not in self._key_order[i]:
+                self._key_order[i] = self._key_order[i] + ("node_id",)
+        return start + len(self.fields)
+
+    def to_structure(self, exclude: Iterable[str] = (), order: Optional[Sequence[str]] = None) -> Any:
+        """
+        转换回嵌套结构（新的字典，字段值与本树共用）
+
+        参数:
+            exclude: 不输出的字段，例如 ["text"]
+            order: 字段顺序（同 format_structure，指定时省略空的 "nodes"）
+
+        返回:
+            与 from_structure 的输入形式相同：根节点列表，或单个根节点
+        """
+        exclude = set(exclude)
+        n = len(self.parent)
+        built: List[Optional[Dict[str, Any]]] = [None] * n
+        # 逆先序构建，处理父节点时子节点已就绪
+        for i in range(n - 1, -1, -1):
+            fields = self.fields[i]
+            children = [built[child] for child in self.children(i)]
+            keys = self._key_order[i]
+            node = {}
+            if order:
+                for key in order:
+                    if key == "nodes":
+                        if children:
+                            node["nodes"] = children
+                    elif key in fields and key not in exclude:
+                        node[key] = fields[key]
+            else:
+                for key in keys:
+                    if key == "nodes":
+                        node["nodes"] = children
+                    elif key in fields and key not in exclude:
+                        node[key] = fields[key]
+                # 原结构之后新增的字段放在最后
+                for key, value in fields.items():
+                    if key not in node and key not in exclude:
+                        node[key] = value
+                if children and "nodes" not in node:
+                    node["nodes"] = children
+            built[i] = node
+        roots = [built[i] for i in self.roots]
+        if self._single_root:
+            return roots[0] if roots else {}
+        return roots
@@ -10,28 +10,175 @@ PageIndex 工具函数模块
 - 配置加载
 """
 
-import tiktoken
-import openai
 import logging
 import os
+import re
 from datetime import datetime
 import time
 import json
-import PyPDF2
 import copy
+import mmap
+import queue
+import hashlib
 import asyncio
-import pymupdf
+import weakref
+import importlib
+import threading
+import contextvars
+from contextlib import contextmanager
 from io import BytesIO
 from dotenv import load_dotenv
 load_dotenv()
 import logging
-import yaml
 from pathlib import Path
 from types import SimpleNamespace as config
+from .metrics import record_llm_call, record_json_parse, llm_stage, current_stage
+
+
+class LazyModule:
+    """
+    首次访问属性时才导入的模块
+
+    openai、tiktoken、PDF 解析库等导入耗时较长，延迟到真正使用时再导入，
+    只读取结果或只做检索的进程（命令行脚本、导入线程、API 工作进程）启动时不再为此付出开销。
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attr):
+        # import_module 在模块已导入时只是一次 sys.modules 查找
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """返回延迟导入的模块"""
+    return LazyModule(name)
+
+
+tiktoken = lazy_import("tiktoken")
+openai = lazy_import("openai")
+PyPDF2 = lazy_import("PyPDF2")
+pymupdf = lazy_import("pymupdf")
+yaml = lazy_import("yaml")
 
 CHATGPT_API_KEY = os.getenv("CHATGPT_API_KEY")
 CHATGPT_API_BASE = os.getenv("CHATGPT_API_BASE", "https://api.openai.com/v1")
 
+# 进程内同时进行的 LLM 请求数上限，所有阶段（含大节点拆分、摘要）共用
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("PAGEINDEX_MAX_CONCURRENT_LLM_CALLS", "16"))
+_sync_llm_limiter = threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+_async_llm_limiters = weakref.WeakKeyDictionary()
+
+
+def async_llm_limiter():
+    """当前事件循环的 LLM 并发限制器（asyncio.Semaphore 只能在创建它的事件循环中使用）"""
+    loop = asyncio.get_running_loop()
+    limiter = _async_llm_limiters.get(loop)
+    if limiter is None:
+        limiter = _async_llm_limiters[loop] = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+    return limiter
+
+
+# 按 (API 密钥, 接口地址) 复用客户端及其连接池；异步客户端绑定事件循环，按事件循环分别缓存
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+_async_openai_clients = weakref.WeakKeyDictionary()
+
+
+def get_openai_client(api_key=None, api_base=None):
+    """获取共享的同步 OpenAI 客户端（线程安全）"""
+    key = (api_key, api_base)
+    with _openai_clients_lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            client = _openai_clients[key] = openai.OpenAI(api_key=api_key, base_url=api_base)
+    return client
+
+
+def get_async_openai_client(api_key=None, api_base=None):
+    """获取当前事件循环共享的异步 OpenAI 客户端"""
+    clients = _async_openai_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (api_key, api_base)
+    if key not in clients:
+        clients[key] = openai.AsyncOpenAI(api_key=api_key, base_url=api_base)
+    return clients[key]
+
+
+async def close_async_openai_clients():
+    """关闭当前事件循环中创建的异步客户端（事件循环结束前调用）"""
+    clients = _async_openai_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+def run_async(coro):
+    """asyncio.run 的封装，结束前关闭该事件循环中共享的异步 LLM 客户端"""
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_async_openai_clients()
+    return asyncio.run(runner())
+
+
+# 当前上下文的取消检查函数：每次发送 LLM 请求前调用，需要取消时由它抛出异常
+# （contextvars 会随 asyncio 任务和 asyncio.to_thread 传递到嵌套的调用中）
+_llm_cancel_check = contextvars.ContextVar("pageindex_llm_cancel_check", default=None)
+
+
+@contextmanager
+def llm_cancel_check(check):
+    """
+    在代码块内的每次 LLM 请求（包括重试）之前调用 check()
+
+    参数:
+        check: 无参函数，需要停止时抛出异常（例如推测执行中落选的策略、已取消的导入任务）
+    """
+    token = _llm_cancel_check.set(check)
+    try:
+        yield
+    finally:
+        _llm_cancel_check.reset(token)
+
+
+def raise_if_llm_cancelled():
+    """执行当前上下文的取消检查"""
+    check = _llm_cancel_check.get()
+    if check is not None:
+        check()
+
+
+# 不支持 response_format 的 (接口地址, 模型)，首次请求被拒绝后记录，之后不再发送该参数
+_JSON_MODE_UNSUPPORTED = set()
+
+
+def _json_mode_kwargs(json_mode, model, api_base):
+    """JSON 模式请求参数；可通过环境变量 PAGEINDEX_JSON_MODE=off 关闭"""
+    if not json_mode or os.getenv("PAGEINDEX_JSON_MODE", "auto") == "off" or (api_base, model) in _JSON_MODE_UNSUPPORTED:
+        return {}
+    return {"response_format": {"type": "json_object"}}
+
+
+def _is_response_format_error(error):
+    """400 错误是否由 response_format 参数引起（上下文超长、内容审核等其他 400 错误不算）"""
+    if getattr(error, "param", None) == "response_format":
+        return True
+    message = f"{getattr(error, 'code', '') or ''} {getattr(error, 'message', '') or error}".lower()
+    return "response_format" in message or "json_object" in message
+
+
+def _disable_json_mode_on_error(error, request_kwargs, model, api_base):
+    """接口拒绝 response_format 参数时记录下来，返回 True 表示应立即不带该参数重试（不计入重试次数）"""
+    if request_kwargs and isinstance(error, openai.BadRequestError) and _is_response_format_error(error):
+        logging.warning(f"接口不支持 JSON 模式，已关闭: {api_base} {model}")
+        _JSON_MODE_UNSUPPORTED.add((api_base, model))
+        return True
+    return False
+
 
 def count_tokens(text, model=None):
     """
@@ -55,7 +202,7 @@ def count_tokens(text, model=None):
     return len(tokens)
 
 
-def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, api_base=None, chat_history=None):
+def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, api_base=None, chat_history=None, json_mode=False):
     """
     调用 ChatGPT API 并返回完成原因
     
@@ -65,6 +212,7 @@ def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, api_base=None, c
         api_key: API 密钥（可选）
         api_base: API 基础地址（可选）
         chat_history: 聊天历史（可选）
+        json_mode: 要求接口返回 JSON 对象（接口不支持时自动退回普通模式）
     
     返回:
         (响应内容, 完成原因) 元组
@@ -72,8 +220,12 @@ def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, api_base=None, c
     if api_key is None: api_key = os.getenv("CHATGPT_API_KEY")
     if api_base is None: api_base = os.getenv("CHATGPT_API_BASE", "https://api.openai.com/v1")
     max_retries = 10
-    client = openai.OpenAI(api_key=api_key, base_url=api_base)
-    for i in range(max_retries):
+    client = get_openai_client(api_key, api_base)
+    start_time = time.perf_counter()
+    i = 0
+    while i < max_retries:
+        raise_if_llm_cancelled()
+        request_kwargs = _json_mode_kwargs(json_mode, model, api_base)
         try:
             if chat_history:
                 messages = chat_history
@@ -81,27 +233,34 @@ def ChatGPT_API_with_finish_reason(model, prompt, api_key=None, api_base=None, c
             else:
                 messages = [{"role": "user", "content": prompt}]
             
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-            )
+            with _sync_llm_limiter:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    **request_kwargs,
+                )
+            record_llm_call(model, response.usage, time.perf_counter() - start_time, retries=i)
             if response.choices[0].finish_reason == "length":
                 return response.choices[0].message.content, "max_output_reached"
             else:
                 return response.choices[0].message.content, "finished"
 
         except Exception as e:
+            if _disable_json_mode_on_error(e, request_kwargs, model, api_base):
+                continue
             print('************* 正在重试 *************')
             logging.error(f"错误: {e}")
             if i < max_retries - 1:
                 time.sleep(1)  # 重试前等待 1 秒
             else:
                 logging.error('已达到最大重试次数，提示词: ' + prompt)
+                record_llm_call(model, None, time.perf_counter() - start_time, retries=i, error=True)
                 return "Error"
+        i += 1
 
 
-def ChatGPT_API(model, prompt, api_key=None, api_base=None, chat_history=None):
+def ChatGPT_API(model, prompt, api_key=None, api_base=None, chat_history=None, json_mode=False):
     """
     调用 ChatGPT API
     
@@ -111,6 +270,7 @@ def ChatGPT_API(model, prompt, api_key=None, api_base=None, chat_history=None):
         api_key: API 密钥（可选）
         api_base: API 基础地址（可选）
         chat_history: 聊天历史（可选）
+        json_mode: 要求接口返回 JSON 对象（接口不支持时自动退回普通模式）
     
     返回:
         响应内容
@@ -118,8 +278,12 @@ def ChatGPT_API(model, prompt, api_key=None, api_base=None, chat_history=None):
     if api_key is None: api_key = os.getenv("CHATGPT_API_KEY")
     if api_base is None: api_base = os.getenv("CHATGPT_API_BASE", "https://api.openai.com/v1")
     max_retries = 10
-    client = openai.OpenAI(api_key=api_key, base_url=api_base)
-    for i in range(max_retries):
+    client = get_openai_client(api_key, api_base)
+    start_time = time.perf_counter()
+    i = 0
+    while i < max_retries:
+        raise_if_llm_cancelled()
+        request_kwargs = _json_mode_kwargs(json_mode, model, api_base)
         try:
             if chat_history:
                 messages = chat_history
@@ -127,24 +291,31 @@ def ChatGPT_API(model, prompt, api_key=None, api_base=None, chat_history=None):
             else:
                 messages = [{"role": "user", "content": prompt}]
             
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-            )
+            with _sync_llm_limiter:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    **request_kwargs,
+                )
+            record_llm_call(model, response.usage, time.perf_counter() - start_time, retries=i)
    
             return response.choices[0].message.content
         except Exception as e:
+            if _disable_json_mode_on_error(e, request_kwargs, model, api_base):
+                continue
             print('************* 正在重试 *************')
             logging.error(f"错误: {e}")
             if i < max_retries - 1:
                 time.sleep(1)  # 重试前等待 1 秒
             else:
                 logging.error('已达到最大重试次数，提示词: ' + prompt)
+                record_llm_call(model, None, time.perf_counter() - start_time, retries=i, error=True)
                 return "Error"
+        i += 1
             
 
-async def ChatGPT_API_async(model, prompt, api_key=None, api_base=None):
+async def ChatGPT_API_async(model, prompt, api_key=None, api_base=None, json_mode=False):
     """
     异步调用 ChatGPT API
     
@@ -153,6 +324,7 @@ async def ChatGPT_API_async(model, prompt, api_key=None, api_base=None):
         prompt: 提示词
         api_key: API 密钥（可选）
         api_base: API 基础地址（可选）
+        json_mode: 要求接口返回 JSON 对象（接口不支持时自动退回普通模式）
     
     返回:
         响应内容
@@ -161,23 +333,34 @@ async def ChatGPT_API_async(model, prompt, api_key=None, api_base=None):
     if api_base is None: api_base = os.getenv("CHATGPT_API_BASE", "https://api.openai.com/v1")
     max_retries = 10
     messages = [{"role": "user", "content": prompt}]
-    for i in range(max_retries):
+    start_time = time.perf_counter()
+    i = 0
+    while i < max_retries:
+        raise_if_llm_cancelled()
+        request_kwargs = _json_mode_kwargs(json_mode, model, api_base)
         try:
-            async with openai.AsyncOpenAI(api_key=api_key, base_url=api_base) as client:
+            client = get_async_openai_client(api_key, api_base)
+            async with async_llm_limiter():
                 response = await client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=0,
+                    **request_kwargs,
                 )
-                return response.choices[0].message.content
+            record_llm_call(model, response.usage, time.perf_counter() - start_time, retries=i)
+            return response.choices[0].message.content
         except Exception as e:
+            if _disable_json_mode_on_error(e, request_kwargs, model, api_base):
+                continue
             print('************* 正在重试 *************')
             logging.error(f"错误: {e}")
             if i < max_retries - 1:
                 await asyncio.sleep(1)  # 重试前等待 1 秒
             else:
                 logging.error('已达到最大重试次数，提示词: ' + prompt)
-                return "Error"  
+                record_llm_call(model, None, time.perf_counter() - start_time, retries=i, error=True)
+                return "Error"
+        i += 1
             
             
 def get_json_content(response):
@@ -203,47 +386,202 @@ def get_json_content(response):
     return json_content
          
 
+_JSON_LITERALS = {'None': 'null', 'null': 'null', 'True': 'true', 'true': 'true', 'False': 'false', 'false': 'false'}
+_JSON_CLOSERS = {'{': '}', '[': ']'}
+
+
+def _strip_code_fence(content):
+    start_idx = content.find("```")
+    if start_idx == -1:
+        return content
+    content = content[start_idx + 3:]
+    if content[:4].lower() == 'json':
+        content = content[4:]
+    end_idx = content.rfind("```")
+    return content[:end_idx] if end_idx != -1 else content
+
+
+def _repair_json(text):
+    """
+    单遍扫描修复常见的 JSON 问题，返回 (修复后的文本候选列表, 是否做过修复)
+
+    处理：尾随逗号、缺失的逗号、Python 字面量（None/True/False）、单引号字符串、
+    未加引号的键和值、被截断的输出（回退到最后一个完整元素后补齐括号）
+    """
+    start = min((i for i in (text.find('{'), text.find('[')) if i != -1), default=-1)
+    if start == -1:
+        return [], False
+
+    out = []
+    stack = []
+    checkpoints = []  # (逗号前的输出长度, 当时的括号栈)
+    after_value = False
+    repaired = False
+    truncated_string = False
+    i, n = start, len(text)
+
+    def next_char(pos):
+        while pos < n and text[pos].isspace():
+            pos += 1
+        return text[pos] if pos < n else ''
+
+    def begin_value():
+        nonlocal repaired
+        if after_value and stack:
+            out.append(',')
+            repaired = True
+
+    while i < n and (stack or not out):
+        ch = text[i]
+        if ch.isspace():
+            i += 1
+        elif ch in '"\'':
+            begin_value()
+            quote = ch
+            j = i + 1
+            chars = []
+            while j < n and text[j] != quote:
+                if text[j] == '\\' and j + 1 < n:
+                    chars.append(text[j:j + 2] if not (quote == "'" and text[j + 1] == "'") else "'")
+                    j += 2
+                    continue
+                chars.append('\\"' if text[j] == '"' and quote == "'" else text[j])
+                j += 1
+            if quote == "'":
+                repaired = True
+            out.append('"' + ''.join(chars) + ('"' if j < n else ''))
+            truncated_string = j >= n
+            after_value = True
+            i = j + 1
+        elif ch in '{[':
+            begin_value()
+            stack.append(ch)
+            out.append(ch)
+            after_value = False
+            i += 1
+        elif ch in '}]':
+            if out and out[-1] == ',':
+                out.pop()
+                repaired = True
+            if stack:
+                out.append(_JSON_CLOSERS[stack.pop()])
+            after_value = True
+            i += 1
+        elif ch == ',':
+            if not after_value:
+                repaired = True
+            else:
+                checkpoints.append((len(out), list(stack)))
+                out.append(',')
+            after_value = False
+            i += 1
+        elif ch == ':':
+            out.append(':')
+            after_value = False
+            i += 1
+        elif ch in '-0123456789':
+            begin_value()
+            match = re.match(r'-?\d+(\.\d+)?([eE][+-]?\d+)?', text[i:])
+            out.append(match.group(0) if match and match.group(0) != '-' else '0')
+            after_value = True
+            i += max(1, len(match.group(0)) if match else 1)
+        else:
+            begin_value()
+            match = re.match(r'[A-Za-z_][\w]*', text[i:])
+            if match and match.group(0) in _JSON_LITERALS:
+                word = match.group(0)
+                out.append(_JSON_LITERALS[word])
+                repaired = repaired or word != _JSON_LITERALS[word]
+                i += len(word)
+            elif match and next_char(i + len(match.group(0))) == ':':
+                out.append(json.dumps(match.group(0)))
+                repaired = True
+                i += len(match.group(0))
+            else:
+                # 未加引号的值（例如 <physical_index_3>），读到分隔符为止
+                match = re.match(r'[^,\]}\n]*', text[i:])
+                out.append(json.dumps(match.group(0).strip()))
+                repaired = True
+                i += max(1, len(match.group(0)))
+            after_value = True
+
+    if not stack:
+        return [''.join(out)], repaired
+
+    # 输出被截断：优先回退到数组中最后一个完整元素（丢弃不完整的记录），其次回退到最后一个完整字段，最后直接补齐
+    candidates = []
+    array_checkpoints = [cp for cp in checkpoints if cp[1][-1] == '[']
+    for length, cp_stack in array_checkpoints[-1:] + checkpoints[-1:]:
+        candidates.append(''.join(out[:length]) + ''.join(_JSON_CLOSERS[c] for c in reversed(cp_stack)))
+    tail = list(out)
+    if truncated_string:
+        tail[-1] += '"'
+    while tail and tail[-1] in (',', ':'):
+        if tail.pop() == ':':
+            tail.append(':null')
+            break
+    candidates.append(''.join(tail) + ''.join(_JSON_CLOSERS[c] for c in reversed(stack)))
+    return candidates, True
+
+
+def parse_json(content):
+    """
+    解析模型返回的 JSON，必要时在本地修复（不再请求模型）
+
+    参数:
+        content: 模型返回的文本
+
+    返回:
+        (解析结果, 是否做过修复)
+
+    异常:
+        ValueError: 无法解析
+    """
+    text = _strip_code_fence(content or '').strip()
+    try:
+        return json.loads(text, strict=False), False
+    except json.JSONDecodeError:
+        pass
+    candidates, repaired = _repair_json(text)
+    for candidate in candidates:
+        try:
+            return json.loads(candidate, strict=False), repaired
+        except json.JSONDecodeError:
+            continue
+    raise ValueError(f"无法解析 JSON: {text[:200]}")
+
+
 def extract_json(content):
     """
     从内容中提取并解析 JSON
-    
+
     参数:
         content: 包含 JSON 的字符串
-    
+
     返回:
         解析后的 JSON 对象，解析失败返回空字典
     """
     try:
-        # 首先尝试提取 ```json 和 ``` 之间的 JSON
-        start_idx = content.find("```json")
-        if start_idx != -1:
-            start_idx += 7  # 调整索引到分隔符之后
-            end_idx = content.rfind("```")
-            json_content = content[start_idx:end_idx].strip()
-        else:
-            # 如果没有分隔符，假设整个内容可能是 JSON
-            json_content = content.strip()
-
-        # 清理可能导致解析错误的常见问题
-        json_content = json_content.replace('None', 'null')  # 将 Python None 替换为 JSON null
-        json_content = json_content.replace('\n', ' ').replace('\r', ' ')  # 移除换行符
-        json_content = ' '.join(json_content.split())  # 规范化空白字符
-
-        # 尝试解析并返回 JSON 对象
-        return json.loads(json_content)
-    except json.JSONDecodeError as e:
+        result, repaired = parse_json(content)
+    except ValueError as e:
         logging.error(f"JSON 提取失败: {e}")
-        # 如果初始解析失败，尝试进一步清理内容
-        try:
-            # 移除闭合括号前的尾随逗号
-            json_content = json_content.replace(',]', ']').replace(',}', '}')
-            return json.loads(json_content)
-        except:
-            logging.error("清理后仍无法解析 JSON")
-            return {}
-    except Exception as e:
-        logging.error(f"提取 JSON 时发生意外错误: {e}")
+        record_json_parse(failed=True)
         return {}
+    if repaired:
+        record_json_parse(repaired=True)
+    return result
+
+
+def extract_json_list(content, key=None):
+    """
+    解析模型返回的 JSON 数组；部分模型会把数组包在对象中（或在 JSON 模式下只能返回对象），此时取其中的数组字段
+    """
+    result = extract_json(content)
+    if isinstance(result, dict):
+        if key is not None and isinstance(result.get(key), list):
+            return result[key]
+        return next((value for value in result.values() if isinstance(value, list)), [])
+    return result if isinstance(result, list) else []
 
 
 def write_node_id(data, node_id=0):
@@ -277,11 +615,10 @@ def get_nodes(structure):
         structure: 树结构
     
     返回:
-        节点列表
+        节点列表（浅拷贝，字段值与原结构共用；需要反复遍历或查找时使用 tree.DocumentTree）
     """
     if isinstance(structure, dict):
-        structure_node = copy.deepcopy(structure)
-        structure_node.pop('nodes', None)
+        structure_node = {key: value for key, value in structure.items() if key != 'nodes'}
         nodes = [structure_node]
         for key in list(structure.keys()):
             if 'nodes' in key:
@@ -325,13 +662,11 @@ def get_leaf_nodes(structure):
         structure: 树结构
     
     返回:
-        叶子节点列表
+        叶子节点列表（浅拷贝，字段值与原结构共用）
     """
     if isinstance(structure, dict):
-        if not structure['nodes']:
-            structure_node = copy.deepcopy(structure)
-            structure_node.pop('nodes', None)
-            return [structure_node]
+        if not structure.get('nodes'):
+            return [{key: value for key, value in structure.items() if key != 'nodes'}]
         else:
             leaf_nodes = []
             for key in list(structure.keys()):
@@ -347,7 +682,7 @@ def get_leaf_nodes(structure):
 
 def is_leaf_node(data, node_id):
     """
-    检查指定 node_id 的节点是否为叶子节点
+    检查指定 node_id 的节点是否为叶子节点（每次调用遍历整棵树，多次查询时使用 tree.DocumentTree.is_leaf）
     
     参数:
         data: 树结构数据
@@ -387,16 +722,165 @@ def get_last_node(structure):
     return structure[-1]
 
 
+class PdfDocument:
+    """
+    PDF 文档句柄
+
+    只打开和解析一次 PDF（文件路径通过 mmap 映射，BytesIO 直接复用内存），
+    元数据、页数、每页文本和 token 数按需计算并缓存，在整个处理流程中传递使用。
+    """
+    def __init__(self, source):
+        """
+        参数:
+            source: PDF 文件路径或 BytesIO 对象
+        """
+        self.path = source if isinstance(source, str) else None
+        self._file = None
+        self._mmap = None
+        if self.path is not None:
+            self._file = open(self.path, "rb")
+            if os.fstat(self._file.fileno()).st_size > 0:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._stream = self._mmap
+            else:
+                self._stream = self._file
+        else:
+            self._stream = source
+        self._reader = None
+        self._metadata = None
+        self._page_texts = {}
+        self._page_tokens = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, doc):
+        """
+        获取文档句柄：已是 PdfDocument 时直接返回，否则校验输入并打开
+
+        参数:
+            doc: PDF 文件路径、BytesIO 对象或 PdfDocument
+        """
+        if isinstance(doc, PdfDocument):
+            return doc
+        is_valid_pdf = (
+            (isinstance(doc, str) and os.path.isfile(doc) and doc.lower().endswith(".pdf")) or
+            isinstance(doc, BytesIO)
+        )
+        if not is_valid_pdf:
+            raise ValueError("Unsupported input type. Expected a PDF file path or BytesIO object.")
+        return cls(doc)
+
+    @property
+    def reader(self):
+        """PyPDF2 阅读器（首次访问时解析）"""
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    self._stream.seek(0)
+                    self._reader = PyPDF2.PdfReader(self._stream)
+        return self._reader
+
+    @property
+    def buffer(self):
+        """文档原始字节（不复制）"""
+        if self._mmap is not None:
+            return memoryview(self._mmap)
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return self._stream.getbuffer()
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = self.reader.metadata
+        return self._metadata
+
+    @property
+    def title(self):
+        meta = self.metadata
+        return meta.title if meta and meta.title else 'Untitled'
+
+    @property
+    def name(self):
+        if self.path is not None:
+            return os.path.basename(self.path)
+        return sanitize_filename(self.title)
+
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def page_text(self, page_num):
+        """获取第 page_num 页（从 0 开始）的文本"""
+        if page_num not in self._page_texts:
+            self._page_texts[page_num] = self.reader.pages[page_num].extract_text()
+        return self._page_texts[page_num]
+
+    def text(self):
+        """获取全部文本"""
+        return "".join(self.page_text(i) for i in range(self.page_count))
+
+    def page_tokens(self, model="gpt-4o-2024-11-20", pdf_parser="PyPDF2"):
+        """
+        获取每页的 (文本, token 数量) 列表，结果按模型和解析器缓存
+
+        参数:
+            model: 用于 token 计数的模型
+            pdf_parser: PDF 解析器（PyPDF2 或 PyMuPDF）
+        """
+        key = (model, pdf_parser)
+        if key in self._page_tokens:
+            return self._page_tokens[key]
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # 对于不支持的模型（如 gemini），使用 cl100k_base 编码
+            enc = tiktoken.get_encoding("cl100k_base")
+        if pdf_parser == "PyPDF2":
+            texts = [self.page_text(i) for i in range(self.page_count)]
+        elif pdf_parser == "PyMuPDF":
+            if self.path is not None:
+                doc = pymupdf.open(self.path)
+            else:
+                doc = pymupdf.open(stream=self._stream, filetype="pdf")
+            texts = [page.get_text() for page in doc]
+            doc.close()
+        else:
+            raise ValueError(f"不支持的 PDF 解析器: {pdf_parser}")
+        page_list = [(text, len(enc.encode(text))) for text in texts]
+        self._page_tokens[key] = page_list
+        return page_list
+
+    def close(self):
+        """释放 mmap 和文件句柄"""
+        self._reader = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def extract_text_from_pdf(pdf_path):
     """
     从 PDF 文件中提取所有文本
     
     参数:
-        pdf_path: PDF 文件路径
+        pdf_path: PDF 文件路径或 PdfDocument
     
     返回:
         提取的文本字符串
     """
+    if isinstance(pdf_path, PdfDocument):
+        return pdf_path.text()
     pdf_reader = PyPDF2.PdfReader(pdf_path)
     # 返回文本而非列表
     text=""
@@ -411,11 +895,13 @@ def get_pdf_title(pdf_path):
     获取 PDF 文件的标题
     
     参数:
-        pdf_path: PDF 文件路径
+        pdf_path: PDF 文件路径或 PdfDocument
     
     返回:
         PDF 标题，如果没有则返回 'Untitled'
     """
+    if isinstance(pdf_path, PdfDocument):
+        return pdf_path.title
     pdf_reader = PyPDF2.PdfReader(pdf_path)
     meta = pdf_reader.metadata
     title = meta.title if meta and meta.title else 'Untitled'
@@ -427,7 +913,7 @@ def get_text_of_pages(pdf_path, start_page, end_page, tag=True):
     获取 PDF 指定页面范围的文本
     
     参数:
-        pdf_path: PDF 文件路径
+        pdf_path: PDF 文件路径或 PdfDocument
         start_page: 起始页码（从 1 开始）
         end_page: 结束页码
         tag: 是否添加页码标签
@@ -435,11 +921,12 @@ def get_text_of_pages(pdf_path, start_page, end_page, tag=True):
     返回:
         提取的文本
     """
-    pdf_reader = PyPDF2.PdfReader(pdf_path)
+    if not isinstance(pdf_path, PdfDocument):
+        with PdfDocument(pdf_path) as pdf:
+            return get_text_of_pages(pdf, start_page, end_page, tag)
     text = ""
     for page_num in range(start_page-1, end_page):
-        page = pdf_reader.pages[page_num]
-        page_text = page.extract_text()
+        page_text = pdf_path.page_text(page_num)
         if tag:
             text += f"<start_index_{page_num+1}>\n{page_text}\n<end_index_{page_num+1}>\n"
         else:
@@ -489,13 +976,15 @@ def get_pdf_name(pdf_path):
     获取 PDF 文件名
     
     参数:
-        pdf_path: PDF 文件路径或 BytesIO 对象
+        pdf_path: PDF 文件路径、BytesIO 对象或 PdfDocument
     
     返回:
         PDF 文件名
     """
     # 提取 PDF 名称
-    if isinstance(pdf_path, str):
+    if isinstance(pdf_path, PdfDocument):
+        pdf_name = pdf_path.name
+    elif isinstance(pdf_path, str):
         pdf_name = os.path.basename(pdf_path)
     elif isinstance(pdf_path, BytesIO):
         pdf_reader = PyPDF2.PdfReader(pdf_path)
@@ -507,30 +996,45 @@ def get_pdf_name(pdf_path):
 
 class JsonLogger:
     """
-    JSON 格式的日志记录器
-    
-    将日志消息以 JSON 格式保存到文件
+    JSONL 格式的日志记录器
+
+    每条日志序列化为一行 JSON，由后台写线程追加写入文件（定期刷新，超过大小上限时轮转），
+    记录中包含时间、耗时、级别、文档名和当前阶段等结构化字段。处理结束后需调用 close()。
     """
-    def __init__(self, file_path):
+    def __init__(self, file_path, log_dir="./logs", flush_interval=1.0, max_bytes=10 * 1024 * 1024, backup_count=5):
         # 提取 PDF 名称作为日志名称
-        pdf_name = get_pdf_name(file_path)
-            
+        self.document = get_pdf_name(file_path)
+
         current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.filename = f"{pdf_name}_{current_time}.json"
-        os.makedirs("./logs", exist_ok=True)
-        # 初始化空列表以存储所有消息
-        self.log_data = []
+        self.filename = f"{self.document}_{current_time}.jsonl"
+        self.log_dir = log_dir
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._start_time = time.perf_counter()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name=f"JsonLogger-{self.document}", daemon=True)
+        self._writer.start()
 
     def log(self, level, message, **kwargs):
+        if self._closed:
+            return
+        record = {
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'elapsed': round(time.perf_counter() - self._start_time, 3),
+            'level': level,
+            'document': self.document,
+            'stage': kwargs.pop('stage', None) or current_stage(),
+        }
+        record.update(kwargs)
         if isinstance(message, dict):
-            self.log_data.append(message)
+            record.update(message)
         else:
-            self.log_data.append({'message': message})
-        # 将新消息添加到日志数据
-        
-        # 将整个日志数据写入文件
-        with open(self._filepath(), "w") as f:
-            json.dump(self.log_data, f, indent=2)
+            record['message'] = message
+        # 在调用线程中序列化，保存的是此刻的内容（调用方之后可能继续修改被记录的对象）
+        self._queue.put(json.dumps(record, ensure_ascii=False, default=str))
 
     def info(self, message, **kwargs):
         self.log("INFO", message, **kwargs)
@@ -545,9 +1049,57 @@ class JsonLogger:
         kwargs["exception"] = True
         self.log("ERROR", message, **kwargs)
 
+    def close(self):
+        """写入所有剩余日志并停止后台写线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_loop(self):
+        f = open(self._filepath(), "a", encoding="utf-8")
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    line = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    line = ''
+                if line is None:
+                    break
+                if line:
+                    f.write(line + "\n")
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = time.monotonic()
+                    if self.max_bytes and f.tell() >= self.max_bytes:
+                        f.close()
+                        self._rotate()
+                        f = open(self._filepath(), "a", encoding="utf-8")
+        finally:
+            f.close()
+
+    def _rotate(self):
+        # xxx.jsonl -> xxx.jsonl.1 -> xxx.jsonl.2 ...，最多保留 backup_count 个旧文件
+        path = self._filepath()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
     def _filepath(self):
-        return os.path.join("logs", self.filename)
-    
+        return os.path.join(self.log_dir, self.filename)
+
 
 
 def list_to_tree(data):
@@ -632,13 +1184,15 @@ def get_page_tokens(pdf_path, model="gpt-4o-2024-11-20", pdf_parser="PyPDF2"):
     获取 PDF 每页的文本和 token 数量
     
     参数:
-        pdf_path: PDF 文件路径或 BytesIO 对象
+        pdf_path: PDF 文件路径、BytesIO 对象或 PdfDocument
         model: 用于 token 计数的模型
         pdf_parser: PDF 解析器（PyPDF2 或 PyMuPDF）
     
     返回:
         (页面文本, token 数量) 元组的列表
     """
+    if isinstance(pdf_path, PdfDocument):
+        return pdf_path.page_tokens(model=model, pdf_parser=pdf_parser)
     try:
         enc = tiktoken.encoding_for_model(model)
     except KeyError:
@@ -668,6 +1222,123 @@ def get_page_tokens(pdf_path, model="gpt-4o-2024-11-20", pdf_parser="PyPDF2"):
     else:
         raise ValueError(f"不支持的 PDF 解析器: {pdf_parser}")
 
+
+def compute_page_hashes(page_list):
+    """
+    计算每页文本的内容哈希（忽略空白差异），用于增量更新时比对页面
+
+    参数:
+        page_list: (页面文本, token 数量) 元组的列表
+
+    返回:
+        与页面一一对应的哈希字符串列表
+    """
+    hashes = []
+    for page_text, _ in page_list:
+        normalized = ' '.join((page_text or '').split())
+        hashes.append(hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16])
+    return hashes
+
+
+_ROMAN_NUMERAL = r'(?=[ivxlcdm])m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})'
+_PAGE_NUMBER_DECOR = r'[\s\-–—·•|\[\]()（）]*'
+# 带页码标记的行："Page 3"、"p. iv"、"Page 3 of 20"、"第 3 页"、"第3页 共20页"
+_PAGE_NUMBER_LINE = re.compile(
+    rf'^{_PAGE_NUMBER_DECOR}(?:(?:page|p\.)\s*(?:\d+|{_ROMAN_NUMERAL})(?:\s*(?:of|/)\s*\d+)?'
+    rf'|第\s*\d+\s*页(?:\s*[,，/]?\s*共\s*\d+\s*页)?){_PAGE_NUMBER_DECOR}$',
+    re.IGNORECASE)
+# 只有页码的行："3"、"- 3 -"、"3 / 20"、"iv"；罗马数字只认小写且不超过 89（大写的 "III" 多为章节编号），
+# 只在页面第一个或最后一个非空行检查
+_BARE_PAGE_NUMBER_LINE = re.compile(
+    rf'^{_PAGE_NUMBER_DECOR}(?:\d{{1,4}}(?:\s*/\s*\d{{1,4}})?|(?=[ivxl])(?:xc|xl|l?x{{0,3}})(?:ix|iv|v?i{{0,3}}))'
+    rf'{_PAGE_NUMBER_DECOR}$')
+
+
+def _is_page_number_line(line, outermost):
+    line = line.strip()
+    return bool(_PAGE_NUMBER_LINE.match(line) or (outermost and _BARE_PAGE_NUMBER_LINE.match(line)))
+
+
+def _header_footer_keys(line, page_index):
+    """
+    返回 (原文键, 数字模板键, 页码偏移)：
+    带页码的页眉页脚（如 "Report 2024 - 12"）每页数字不同，但数字与页序号的差值保持不变
+    """
+    text = ' '.join(line.split()).lower()
+    numbers = re.findall(r'\d+', text)
+    if not numbers:
+        return text, None, None
+    return text, re.sub(r'\d+', '#', text), int(numbers[-1]) - page_index
+
+
+def _compact_text(text):
+    # 合并跨行断词（只合并字母之间的连字符，"2020-\n2021" 这类范围保持不变），压缩行内空白和多余空行
+    text = re.sub(r'([^\W\d_])-\n\s*([^\W\d_])', r'\1\2', text)
+    text = re.sub(r'[ \t\u00a0\u3000]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def normalize_page_list(page_list, model=None, edge_lines=3, min_repeat_ratio=0.5):
+    """
+    规范化页面文本以减少提示词 token：去除跨页重复的页眉页脚和页码行，合并断词并压缩空白
+
+    参数:
+        page_list: (页面文本, token 数量) 元组的列表
+        model: 用于 token 计数的模型
+        edge_lines: 每页开头和结尾各检查多少个非空行
+        min_repeat_ratio: 在至少该比例的页面中重复出现的首尾行视为页眉页脚
+
+    返回:
+        (规范化后的 page_list, 统计信息)，页数与原列表一致
+    """
+    try:
+        enc = tiktoken.encoding_for_model(model)
+    except KeyError:
+        enc = tiktoken.get_encoding("cl100k_base")
+
+    pages_lines = []
+    exact_counts = {}
+    numbered_counts = {}
+    for page_index, (page_text, _) in enumerate(page_list):
+        lines = (page_text or '').split('\n')
+        non_empty = [i for i, line in enumerate(lines) if line.strip()]
+        edge = {i: _header_footer_keys(lines[i], page_index) for i in set(non_empty[:edge_lines] + non_empty[-edge_lines:])}
+        outermost = {non_empty[0], non_empty[-1]} if non_empty else set()
+        pages_lines.append((lines, edge, outermost))
+        for exact_key, numbered_key, offset in set(edge.values()):
+            exact_counts[exact_key] = exact_counts.get(exact_key, 0) + 1
+            if numbered_key is not None:
+                numbered_counts[(numbered_key, offset)] = numbered_counts.get((numbered_key, offset), 0) + 1
+
+    # 页数太少时无法可靠判断页眉页脚
+    min_repeats = max(3, int(len(page_list) * min_repeat_ratio))
+    repeated = {key for key, count in exact_counts.items() if count >= min_repeats}
+    repeated_numbered = {key for key, count in numbered_counts.items() if count >= min_repeats}
+
+    normalized = []
+    removed_lines = 0
+    for lines, edge, outermost in pages_lines:
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edge:
+                exact_key, numbered_key, offset = edge[i]
+                if exact_key in repeated or (numbered_key, offset) in repeated_numbered or _is_page_number_line(line, i in outermost):
+                    removed_lines += 1
+                    continue
+            kept.append(line)
+        text = _compact_text('\n'.join(kept))
+        normalized.append((text, len(enc.encode(text))))
+
+    stats = {
+        'pages': len(page_list),
+        'tokens_before': sum(page[1] for page in page_list),
+        'tokens_after': sum(page[1] for page in normalized),
+        'removed_header_footer_lines': removed_lines,
+    }
+    return normalized, stats
+
         
 
 def get_text_of_pdf_pages(pdf_pages, start_page, end_page):
@@ -688,6 +1359,8 @@ def get_text_of_pdf_pages_with_labels(pdf_pages, start_page, end_page):
 
 def get_number_of_pages(pdf_path):
     """获取 PDF 的总页数"""
+    if isinstance(pdf_path, PdfDocument):
+        return pdf_path.page_count
     pdf_reader = PyPDF2.PdfReader(pdf_path)
     num = len(pdf_reader.pages)
     return num
@@ -907,7 +1580,8 @@ async def generate_node_summary(node, model=None):
     
     Directly return the description, do not include any other text.
     """
-    response = await ChatGPT_API_async(model, prompt)
+    with llm_stage('summary'):
+        response = await ChatGPT_API_async(model, prompt)
     return response
 
 
@@ -978,7 +1652,8 @@ def generate_doc_description(structure, model=None):
     
     Directly return the description, do not include any other text.
     """
-    response = ChatGPT_API(model, prompt)
+    with llm_stage('description'):
+        response = ChatGPT_API(model, prompt)
     return response
 
 
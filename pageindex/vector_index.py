@@ -8,36 +8,61 @@ PageIndex 向量索引模块
 import os
 import json
 import time
+import hashlib
+import threading
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-import chromadb
-from chromadb.config import Settings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
+from .utils import lazy_import
 
 load_dotenv()
 
+# chromadb 导入耗时较长，创建向量索引时才导入
+chromadb = lazy_import("chromadb")
+
 # Embedding 模型配置
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "bge-m3:latest")
 EMBEDDING_MODEL_API_URL = os.getenv("EMBEDDING_MODEL_API_URL", "http://10.20.2.135:11434")
 EMBEDDING_MODEL_TYPE = os.getenv("EMBEDDING_MODEL_TYPE", "ollama")
+# 批量接口每次请求的文本数
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# 到 Embedding 服务的最大连接数（多个文档并行生成 embedding 时共用）
+EMBEDDING_MAX_CONNECTIONS = int(os.getenv("EMBEDDING_MAX_CONNECTIONS", "4"))
 
 # ChromaDB 存储路径
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+# 默认集合名称；重建索引时写入新集合，完成后切换，当前集合名称记录在持久化目录的 ACTIVE_COLLECTION_FILE 中
+COLLECTION_NAME = "pageindex_nodes"
+ACTIVE_COLLECTION_FILE = "active_collection.json"
+# 重建索引时并行处理的文档数
+INDEX_REBUILD_WORKERS = int(os.getenv("PAGEINDEX_INDEX_REBUILD_WORKERS", "4"))
 
 
 class OllamaEmbedding:
     """
     Ollama Embedding 模型封装类
     
-    调用 Ollama API 生成文本的向量表示
+    调用 Ollama API 生成文本的向量表示。优先使用批量接口 /api/embed（一次请求多个文本），
+    服务不支持时（旧版 Ollama 返回 404）退回逐条调用 /api/embeddings。
+    两个接口返回的向量不完全一致（/api/embed 做了归一化），因此单条文本也走同一个接口，
+    并通过 embedding_key 区分不同接口生成的向量。已有向量的集合通过 endpoint / use_endpoint
+    固定使用生成这些向量的接口，新集合在 probe 时探测。
     """
     
-    def __init__(self, model_name: str = None, api_url: str = None):
+    def __init__(self, model_name: str = None, api_url: str = None, batch_size: int = None, endpoint: str = None):
         self.model_name = model_name or EMBEDDING_MODEL_NAME
         self.api_url = api_url or EMBEDDING_MODEL_API_URL
         self.embed_endpoint = f"{self.api_url.rstrip('/')}/api/embeddings"
+        self.batch_endpoint = f"{self.api_url.rstrip('/')}/api/embed"
+        self.batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
+        # 是否使用批量接口，None 表示尚未探测（见 probe）
+        self.batch_supported = None
+        if endpoint:
+            self.use_endpoint(endpoint)
         
         # 创建带有重试机制的 session
         self.session = requests.Session()
@@ -46,9 +71,73 @@ class OllamaEmbedding:
             backoff_factor=1,
             status_forcelist=[429, 500, 502, 503, 504],
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=1, pool_maxsize=1)
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=1, pool_maxsize=EMBEDDING_MAX_CONNECTIONS)
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
+
+    def use_endpoint(self, endpoint: str):
+        """固定使用 /api/embed（"embed"）或 /api/embeddings（"embeddings"），不再探测"""
+        if endpoint not in ("embed", "embeddings"):
+            raise ValueError(f"未知的 Embedding 接口: {endpoint}")
+        self.batch_supported = endpoint == "embed"
+
+    @property
+    def endpoint(self) -> Optional[str]:
+        """当前使用的接口，尚未探测时为 None"""
+        if self.batch_supported is None:
+            return None
+        return "embed" if self.batch_supported else "embeddings"
+
+    @property
+    def embedding_key(self) -> Optional[str]:
+        """标识生成向量的模型和接口，不同 key 的向量不能混用；接口尚未确定时为 None（不发起请求）"""
+        if self.endpoint is None:
+            return None
+        return f"{self.model_name}|{self.endpoint}"
+
+    def probe(self, max_retries: int = 1) -> str:
+        """
+        确定使用的接口（尚未确定时请求一次批量接口），在预热或首次写入前显式调用
+
+        返回:
+            embedding_key
+        """
+        if self.batch_supported is None:
+            self._embed_many(["ping"], max_retries)
+        return self.embedding_key
+
+    def _embed_many(self, texts: List[str], max_retries: int = 3) -> Optional[List[List[float]]]:
+        """调用批量接口，服务不支持时返回 None"""
+        if self.batch_supported is False:
+            return None
+        for attempt in range(max_retries):
+            try:
+                response = self.session.post(
+                    self.batch_endpoint,
+                    json={
+                        "model": self.model_name,
+                        "input": texts
+                    },
+                    timeout=120
+                )
+                if response.status_code == 404 and self.batch_supported is None:
+                    print("Embedding 服务不支持批量接口 /api/embed，改为逐条调用 /api/embeddings")
+                    self.batch_supported = False
+                    return None
+                response.raise_for_status()
+                embeddings = response.json().get("embeddings", [])
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"返回 {len(embeddings)} 个 embedding，期望 {len(texts)} 个")
+                self.batch_supported = True
+                return embeddings
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    wait_time = (attempt + 1) * 2  # 递增等待时间
+                    print(f"批量 Embedding 生成失败 (尝试 {attempt + 1}/{max_retries}): {e}, {wait_time}秒后重试...")
+                    time.sleep(wait_time)
+                else:
+                    print(f"批量 Embedding 生成失败: {e}")
+                    raise
     
     def embed(self, text: str, max_retries: int = 3) -> List[float]:
         """
@@ -61,6 +150,9 @@ class OllamaEmbedding:
         返回:
             embedding 向量
         """
+        embeddings = self._embed_many([text], max_retries)
+        if embeddings is not None:
+            return embeddings[0]
         for attempt in range(max_retries):
             try:
                 response = self.session.post(
@@ -89,17 +181,26 @@ class OllamaEmbedding:
         
         参数:
             texts: 文本列表
-            batch_delay: 每个请求之间的延迟（秒），避免连接池耗尽
+            batch_delay: 逐条调用时每个请求之间的延迟（秒），避免连接池耗尽
         
         返回:
             embedding 向量列表
         """
         embeddings = []
-        for i, text in enumerate(texts):
+        start = 0
+        while start < len(texts):
+            batch = self._embed_many(texts[start:start + self.batch_size])
+            if batch is None:
+                break
+            embeddings.extend(batch)
+            start += self.batch_size
+
+        remaining = texts[start:]
+        for i, text in enumerate(remaining):
             embedding = self.embed(text)
             embeddings.append(embedding)
             # 添加小延迟，避免连接池问题
-            if i < len(texts) - 1 and batch_delay > 0:
+            if i < len(remaining) - 1 and batch_delay > 0:
                 time.sleep(batch_delay)
         return embeddings
 
@@ -123,14 +224,73 @@ class VectorIndex:
         # 初始化 ChromaDB 客户端（持久化模式）
         self.client = chromadb.PersistentClient(path=self.persist_dir)
         
-        # 获取或创建集合
-        self.collection = self.client.get_or_create_collection(
-            name="pageindex_nodes",
-            metadata={"description": "PageIndex 文档节点向量索引"}
-        )
+        # 获取或创建当前使用的集合
+        self.collection = self._get_collection(self._read_active_collection())
         
-        # 初始化 Embedding 模型
+        # 初始化 Embedding 模型，沿用生成当前集合向量的接口
         self.embedding_model = OllamaEmbedding()
+        self.embedding_warning = None
+        self._pin_embedding_endpoint()
+
+        # 写操作锁；重建期间记录被修改的文档，切换集合前同步到新集合
+        self._write_lock = threading.RLock()
+        self._rebuild_dirty = None
+
+    def _get_collection(self, name: str):
+        return self.client.get_or_create_collection(
+            name=name,
+            metadata={"description": "PageIndex 文档节点向量索引"}
+        )
+
+    def _read_active_collection(self) -> str:
+        path = os.path.join(self.persist_dir, ACTIVE_COLLECTION_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("collection") or COLLECTION_NAME
+        except (OSError, ValueError):
+            return COLLECTION_NAME
+
+    def _write_active_collection(self, name: str):
+        # 先写临时文件再替换，避免进程中断时留下不完整的文件
+        path = os.path.join(self.persist_dir, ACTIVE_COLLECTION_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"collection": name, "updated_at": datetime.now().isoformat(timespec="seconds")}, f)
+        os.replace(tmp_path, path)
+
+    def _node_embedding_key(self, metadata: Dict[str, Any]) -> str:
+        # 早期版本写入的节点没有 embedding_key，这些向量都由 /api/embeddings 生成
+        return metadata.get("embedding_key") or f"{self.embedding_model.model_name}|embeddings"
+
+    def _pin_embedding_endpoint(self):
+        """
+        按当前集合中向量的 embedding_key 固定检索和写入使用的接口（空集合在首次写入前探测），
+        集合混有多种向量或模型与配置不一致时记录 embedding_warning，提示重建索引
+        """
+        try:
+            results = self.collection.get(include=["metadatas"])
+        except Exception as e:
+            print(f"读取集合的 embedding_key 失败: {e}")
+            return
+        counts = {}
+        for metadata in results["metadatas"] or []:
+            key = self._node_embedding_key(metadata)
+            counts[key] = counts.get(key, 0) + 1
+        self.embedding_warning = None
+        if not counts:
+            return
+        key = max(counts, key=counts.get)
+        model_name, _, endpoint = key.rpartition("|")
+        self.embedding_model.use_endpoint(endpoint)
+        if len(counts) > 1 or model_name != self.embedding_model.model_name:
+            self.embedding_warning = (f"当前集合的向量来自 {', '.join(sorted(counts))}，当前使用 "
+                                      f"{self.embedding_model.embedding_key}，"
+                                      f"检索结果不可靠，请调用 POST /index/rebuild 重建索引")
+            print(f"[vector_index] {self.embedding_warning}")
+
+    def _mark_dirty(self, doc_name: str):
+        if self._rebuild_dirty is not None:
+            self._rebuild_dirty.add(doc_name)
     
     def _get_node_text(self, node: Dict[str, Any]) -> str:
         """
@@ -193,38 +353,21 @@ class VectorIndex:
         traverse(structure)
         return nodes
     
-    def add_document(self, doc_name: str, structure: Any, doc_description: str = "") -> int:
+    def _build_entries(self, doc_name: str, structure: Any, doc_description: str = "") -> Dict[str, Any]:
         """
-        将文档添加到向量索引
-        
-        参数:
-            doc_name: 文档名称
-            structure: 文档的树结构
-            doc_description: 文档描述
-        
+        生成文档写入集合的条目
+
         返回:
-            添加的节点数量
+            {"ids", "texts", "metadatas", "content_hash"}；content_hash 由条目内容和 embedding_key 计算，
+            保存在每个节点的元数据中，重建索引时用于跳过未变化的文档
         """
-        # 先删除该文档的旧索引
-        self.delete_document(doc_name)
-        
-        # 扁平化结构
         nodes = self._flatten_structure(structure, doc_name)
-        
-        if not nodes:
-            return 0
-        
-        # 准备数据
         ids = []
         texts = []
         metadatas = []
-        
         for node in nodes:
-            node_id = f"{doc_name}_{node['node_id']}"
-            text = self._get_node_text(node)
-            
-            ids.append(node_id)
-            texts.append(text)
+            ids.append(f"{doc_name}_{node['node_id']}")
+            texts.append(self._get_node_text(node))
             metadatas.append({
                 "doc_name": doc_name,
                 "doc_description": doc_description,
@@ -237,22 +380,138 @@ class VectorIndex:
                 "has_children": str(node["has_children"]),
                 "summary": node.get("summary", "")[:500]  # 限制摘要长度
             })
+
+        embedding_key = self.embedding_model.probe() if nodes else ""
+        digest = hashlib.sha256(
+            json.dumps([embedding_key, ids, texts, metadatas], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        for metadata in metadatas:
+            metadata["content_hash"] = digest
+            metadata["embedding_key"] = embedding_key
+        return {"ids": ids, "texts": texts, "metadatas": metadatas, "content_hash": digest}
+
+    def _existing_embeddings(self, collection, doc_name: str) -> Dict[str, Any]:
+        """
+        读取集合中文档已有的 embedding
+
+        返回:
+            {"content_hash": 文档内容哈希（节点不一致时为 None）, "count": 节点数,
+             "ids", "embeddings", "by_text": 文本 -> embedding（仅当前 embedding_key 生成的向量）}
+        """
+        existing = {"content_hash": None, "count": 0, "ids": [], "embeddings": [], "by_text": {}}
+        try:
+            results = collection.get(
+                where={"doc_name": doc_name},
+                include=["embeddings", "documents", "metadatas"]
+            )
+        except Exception as e:
+            print(f"读取已有 embedding 失败，将全部重新生成: {e}")
+            return existing
+        if not results or not results["ids"]:
+            return existing
+
+        embedding_key = self.embedding_model.embedding_key
+        hashes = {metadata.get("content_hash") for metadata in results["metadatas"]}
+        existing.update(
+            content_hash=hashes.pop() if len(hashes) == 1 else None,
+            count=len(results["ids"]),
+            ids=list(results["ids"]),
+            embeddings=[list(embedding) for embedding in results["embeddings"]],
+        )
+        for document, embedding, metadata in zip(results["documents"], existing["embeddings"], results["metadatas"]):
+            if self._node_embedding_key(metadata) == embedding_key:
+                existing["by_text"][document] = embedding
+        return existing
+
+    def _embed_entries(self, entries: Dict[str, Any], existing: Dict[str, Any], doc_name: str) -> Dict[str, Any]:
+        """
+        为条目生成 embedding：内容哈希一致时整体复用，否则只为文本变化的节点生成
+
+        返回:
+            {"embeddings": 向量列表, "reused": 复用数, "embedded": 新生成数}
+        """
+        texts = entries["texts"]
+        if existing["content_hash"] == entries["content_hash"] and existing["ids"] == entries["ids"]:
+            return {"embeddings": existing["embeddings"], "reused": len(texts), "embedded": 0}
+
+        by_text = existing["by_text"]
+        missing = [i for i, text in enumerate(texts) if text not in by_text]
+        print(f"正在为 {doc_name} 生成 {len(missing)} 个节点的 embedding（复用 {len(texts) - len(missing)} 个）...")
+        new_embeddings = self.embedding_model.embed_batch([texts[i] for i in missing])
+        embedded = dict(zip(missing, new_embeddings))
+        embeddings = [embedded[i] if i in embedded else by_text[text] for i, text in enumerate(texts)]
+        return {"embeddings": embeddings, "reused": len(texts) - len(missing), "embedded": len(missing)}
+
+    def add_document(self, doc_name: str, structure: Any, doc_description: str = "") -> int:
+        """
+        将文档添加到向量索引
+        
+        参数:
+            doc_name: 文档名称
+            structure: 文档的树结构
+            doc_description: 文档描述
+        
+        返回:
+            添加的节点数量
+        """
+        entries = self._build_entries(doc_name, structure, doc_description)
         
         # 生成 embeddings
-        print(f"正在为 {doc_name} 生成 {len(texts)} 个节点的 embedding...")
+        texts = entries["texts"]
+        if texts:
+            print(f"正在为 {doc_name} 生成 {len(texts)} 个节点的 embedding...")
         embeddings = self.embedding_model.embed_batch(texts)
+
+        with self._write_lock:
+            # 先删除该文档的旧索引
+            self.delete_document(doc_name)
+            if not texts:
+                return 0
+        
+            # 添加到 ChromaDB
+            self.collection.add(
+                ids=entries["ids"],
+                embeddings=embeddings,
+                metadatas=entries["metadatas"],
+                documents=texts
+            )
         
-        # 添加到 ChromaDB
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            documents=texts
-        )
-        
-        print(f"已将 {len(nodes)} 个节点添加到向量索引")
-        return len(nodes)
-    
+        print(f"已将 {len(texts)} 个节点添加到向量索引")
+        return len(texts)
+
+    def update_document(self, doc_name: str, structure: Any, doc_description: str = "") -> Dict[str, int]:
+        """
+        增量更新文档的向量索引
+
+        文本表示（标题 + 摘要）未变化的节点复用已有 embedding，只为新增或变化的节点生成 embedding。
+
+        参数:
+            doc_name: 文档名称
+            structure: 文档的新树结构
+            doc_description: 文档描述
+
+        返回:
+            {"nodes": 节点总数, "reused": 复用的 embedding 数, "embedded": 新生成的 embedding 数}
+        """
+        entries = self._build_entries(doc_name, structure, doc_description)
+        existing = self._existing_embeddings(self.collection, doc_name)
+        if not entries["ids"]:
+            self.delete_document(doc_name)
+            return {"nodes": 0, "reused": 0, "embedded": 0}
+
+        result = self._embed_entries(entries, existing, doc_name)
+        with self._write_lock:
+            self.delete_document(doc_name)
+            self.collection.add(
+                ids=entries["ids"],
+                embeddings=result["embeddings"],
+                metadatas=entries["metadatas"],
+                documents=entries["texts"]
+            )
+
+        print(f"已将 {len(entries['ids'])} 个节点更新到向量索引")
+        return {"nodes": len(entries["ids"]), "reused": result["reused"], "embedded": result["embedded"]}
+
     def search(self, query: str, top_k: int = 10, doc_filter: List[str] = None) -> List[Dict[str, Any]]:
         """
         向量相似度检索
@@ -321,17 +580,19 @@ class VectorIndex:
             删除的节点数量
         """
         try:
-            # 查询该文档的所有节点
-            results = self.collection.get(
-                where={"doc_name": doc_name},
-                include=["metadatas"]
-            )
+            with self._write_lock:
+                self._mark_dirty(doc_name)
+                # 查询该文档的所有节点
+                results = self.collection.get(
+                    where={"doc_name": doc_name},
+                    include=["metadatas"]
+                )
             
-            if results and results["ids"]:
-                # 删除这些节点
-                self.collection.delete(ids=results["ids"])
-                print(f"已删除 {doc_name} 的 {len(results['ids'])} 个节点索引")
-                return len(results["ids"])
+                if results and results["ids"]:
+                    # 删除这些节点
+                    self.collection.delete(ids=results["ids"])
+                    print(f"已删除 {doc_name} 的 {len(results['ids'])} 个节点索引")
+                    return len(results["ids"])
             
             return 0
         except Exception as e:
@@ -392,15 +653,228 @@ class VectorIndex:
             return {
                 "total_nodes": total_count,
                 "total_documents": len(documents),
-                "documents": documents
+                "documents": documents,
+                "embedding_key": self.embedding_model.embedding_key,
+                "embedding_warning": self.embedding_warning
             }
         except Exception as e:
             print(f"获取统计信息失败: {e}")
             return {"total_nodes": 0, "total_documents": 0, "documents": []}
 
+    def begin_rebuild(self):
+        """
+        开始重建：创建新集合并开始记录重建期间被修改的文档，检索继续使用当前集合
+
+        返回:
+            新集合
+        """
+        with self._write_lock:
+            active = self.collection.name
+            # 清理上次中断的重建留下的集合
+            for collection in self.client.list_collections():
+                name = getattr(collection, "name", collection)
+                if name != active and name.startswith(f"{COLLECTION_NAME}_"):
+                    self.client.delete_collection(name)
+            self._rebuild_dirty = set()
+            return self._get_collection(f"{COLLECTION_NAME}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
+
+    def _copy_document(self, source, target, doc_name: str) -> int:
+        results = source.get(where={"doc_name": doc_name}, include=["embeddings", "documents", "metadatas"])
+        target.delete(where={"doc_name": doc_name})
+        if not results or not results["ids"]:
+            return 0
+        target.add(
+            ids=results["ids"],
+            embeddings=[list(embedding) for embedding in results["embeddings"]],
+            metadatas=results["metadatas"],
+            documents=results["documents"]
+        )
+        return len(results["ids"])
+
+    def finish_rebuild(self, new_collection, rebuilt_docs) -> Dict[str, int]:
+        """
+        完成重建：把重建期间被修改的文档和未参与重建的文档从当前集合复制到新集合，然后切换到新集合
+
+        参数:
+            new_collection: begin_rebuild 返回的集合
+            rebuilt_docs: 已重建的文档名称
+
+        返回:
+            {"synced": 同步的修改文档数, "carried_over": 保留的未重建文档数}
+        """
+        with self._write_lock:
+            old_collection = self.collection
+            dirty = self._rebuild_dirty or set()
+            carried_over = [doc for doc in self.get_all_documents() if doc not in rebuilt_docs and doc not in dirty]
+            for doc_name in list(dirty) + carried_over:
+                self._copy_document(old_collection, new_collection, doc_name)
+            self._write_active_collection(new_collection.name)
+            self.collection = new_collection
+            self._rebuild_dirty = None
+            self._pin_embedding_endpoint()
+        try:
+            self.client.delete_collection(old_collection.name)
+        except Exception as e:
+            print(f"删除旧集合失败: {e}")
+        return {"synced": len(dirty), "carried_over": len(carried_over)}
+
+    def abort_rebuild(self, new_collection):
+        """放弃重建，继续使用当前集合"""
+        with self._write_lock:
+            self._rebuild_dirty = None
+        try:
+            self.client.delete_collection(new_collection.name)
+        except Exception as e:
+            print(f"删除重建集合失败: {e}")
+
+
+def load_structure_file(path: str):
+    """
+    读取结构文件（JSON 或 msgpack 格式）
+
+    返回:
+        (文档名称, 树结构, 文档描述)
+    """
+    from .storage import load_result
+    data = load_result(path)
+    filename = os.path.basename(path)
+    doc_name = data.get("doc_name", filename.replace("_structure.json", ""))
+    return doc_name, data.get("structure", []), data.get("doc_description", "")
+
+
+class IndexRebuilder:
+    """
+    后台重建向量索引
+
+    多个文档并行生成 embedding（走批量接口），内容哈希未变化的文档直接复用当前集合中的向量；
+    结果写入新集合，全部完成后再切换，重建期间检索不受影响。同一时间只运行一个重建任务。
+
+    参数:
+        index: 向量索引，默认使用全局实例
+        workers: 并行处理的文档数
+        catalog: 文档目录，切换后记录各文档的索引节点数，默认使用全局实例
+    """
+
+    def __init__(self, index: VectorIndex = None, workers: int = INDEX_REBUILD_WORKERS, catalog=None):
+        self.index = index
+        self.workers = max(1, workers)
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = {"state": "idle"}
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            status = dict(self._status)
+            if "errors" in status:
+                status["errors"] = list(status["errors"])
+        return status
+
+    def _update(self, **changes):
+        with self._lock:
+            self._status.update(changes)
+
+    def _increment(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._status[key] = self._status.get(key, 0) + value
+
+    def start(self, structure_files: List[str]) -> bool:
+        """
+        在后台线程中开始重建
+
+        返回:
+            是否已开始（已有重建任务在运行时返回 False）
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._status = {"state": "queued", "total": len(structure_files)}
+            self._thread = threading.Thread(target=self.run, args=(structure_files,), name="pageindex-index-rebuild",
+                                            daemon=True)
+            self._thread.start()
+        return True
+
+    def _rebuild_document(self, path: str, old_collection, new_collection, add_lock: threading.Lock) -> Optional[tuple]:
+        index = self.index
+        try:
+            doc_name, structure, doc_description = load_structure_file(path)
+            entries = index._build_entries(doc_name, structure, doc_description)
+            existing = index._existing_embeddings(old_collection, doc_name)
+            result = index._embed_entries(entries, existing, doc_name)
+            if entries["ids"]:
+                with add_lock:
+                    new_collection.upsert(
+                        ids=entries["ids"],
+                        embeddings=result["embeddings"],
+                        metadatas=entries["metadatas"],
+                        documents=entries["texts"]
+                    )
+            self._increment(
+                processed=1,
+                skipped=1 if entries["ids"] and result["embedded"] == 0 else 0,
+                nodes=len(entries["ids"]),
+                embedded_nodes=result["embedded"],
+                reused_nodes=result["reused"],
+            )
+            print(f"已重建 {doc_name} 的索引，共 {len(entries['ids'])} 个节点（新生成 {result['embedded']} 个）")
+            return doc_name, len(entries["ids"])
+        except Exception as e:
+            self._increment(processed=1, failed=1)
+            with self._lock:
+                self._status["errors"].append(f"{os.path.basename(path)}: {e}")
+            return None
+
+    def run(self, structure_files: List[str]) -> Dict[str, Any]:
+        """
+        重建索引（阻塞执行）
+
+        参数:
+            structure_files: _structure.json 文件路径列表
+
+        返回:
+            重建状态
+        """
+        if self.index is None:
+            self.index = get_vector_index()
+        index = self.index
+        start = time.perf_counter()
+        self._update(state="running", total=len(structure_files), processed=0, skipped=0, failed=0, nodes=0,
+                     embedded_nodes=0, reused_nodes=0, errors=[], workers=self.workers,
+                     started_at=datetime.now().isoformat(timespec="seconds"), finished_at=None)
+        new_collection = None
+        try:
+            old_collection = index.collection
+            new_collection = index.begin_rebuild()
+            self._update(collection=new_collection.name)
+            add_lock = threading.Lock()
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                rebuilt = list(pool.map(
+                    lambda path: self._rebuild_document(path, old_collection, new_collection, add_lock), structure_files))
+            index_nodes = dict(doc for doc in rebuilt if doc)
+            swap = index.finish_rebuild(new_collection, set(index_nodes))
+            self._update(state="succeeded", **swap)
+            try:
+                from .catalog import get_catalog
+                (self.catalog or get_catalog()).mark_indexed(index_nodes)
+            except Exception as e:
+                print(f"更新文档目录失败: {e}")
+        except Exception as e:
+            if new_collection is not None:
+                index.abort_rebuild(new_collection)
+            self._update(state="failed", error=str(e))
+        self._update(finished_at=datetime.now().isoformat(timespec="seconds"),
+                     seconds=round(time.perf_counter() - start, 3))
+        status = self.get_status()
+        print(f"向量索引重建{'完成' if status['state'] == 'succeeded' else '失败'}: "
+              f"{status['processed']}/{status['total']} 个文档，跳过未变化 {status['skipped']} 个，耗时 {status['seconds']}s")
+        return status
+
+
 
 # 全局向量索引实例
 _vector_index_instance = None
+_vector_index_lock = threading.Lock()
 
 
 def get_vector_index() -> VectorIndex:
@@ -411,8 +885,10 @@ def get_vector_index() -> VectorIndex:
         VectorIndex 实例
     """
     global _vector_index_instance
-    if _vector_index_instance is None:
-        _vector_index_instance = VectorIndex()
+    # 预热线程和请求可能同时首次调用，只创建一个客户端
+    with _vector_index_lock:
+        if _vector_index_instance is None:
+            _vector_index_instance = VectorIndex()
     return _vector_index_instance
 
 
@@ -432,6 +908,22 @@ def build_index_for_document(doc_name: str, structure: Any, doc_description: str
     return index.add_document(doc_name, structure, doc_description)
 
 
+def update_index_for_document(doc_name: str, structure: Any, doc_description: str = "") -> Dict[str, int]:
+    """
+    增量更新文档向量索引的便捷函数（复用未变化节点的 embedding）
+
+    参数:
+        doc_name: 文档名称
+        structure: 文档的新树结构
+        doc_description: 文档描述
+
+    返回:
+        节点数、复用数和新生成数
+    """
+    index = get_vector_index()
+    return index.update_document(doc_name, structure, doc_description)
+
+
 def search_documents(query: str, top_k: int = 10, doc_filter: List[str] = None) -> List[Dict[str, Any]]:
     """
     搜索文档的便捷函数
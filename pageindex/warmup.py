@@ -0,0 +1,149 @@
+"""
+PageIndex 预热模块
+
+openai、tiktoken、chromadb 等依赖延迟到首次使用时才导入，命令行脚本和工作进程启动更快；
+常驻服务则在启动时调用 warmup()，提前加载分词器、向量索引和文档目录并发出一次预热 embedding 请求，
+避免由第一个请求承担这些开销。BackgroundWarmup 在后台线程中预热，供就绪探针查询。
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Sequence
+
+
+def _run_step(timings: Dict[str, Any], name: str, func: Callable[[], Any]):
+    """执行一个预热步骤并记录耗时；失败时记录错误，不影响其他步骤（请求到来时会再次尝试加载）"""
+    start = time.perf_counter()
+    try:
+        func()
+        timings[name] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        timings.setdefault("errors", {})[name] = f"{type(e).__name__}: {e}"
+
+
+def warmup(model: Optional[str] = None, tokenizer: bool = True, vector_index: bool = True, catalog: bool = True,
+           results_dir: Optional[str] = None, upload_dir: Optional[str] = None, embedding: bool = False,
+           snapshot: bool = False) -> Dict[str, Any]:
+    """
+    预加载常驻服务需要的资源
+
+    参数:
+        model: 分词器对应的模型，默认取环境变量 CHATGPT_MODEL（与 API 服务相同，默认 gpt-4o）
+        tokenizer: 是否加载 tiktoken 分词器（首次加载需要读取 BPE 文件）
+        vector_index: 是否创建向量索引（导入 chromadb 并打开持久化集合）
+        catalog: 是否打开文档目录
+        results_dir: 指定时，打开文档目录后与该结果目录同步
+        upload_dir: 同步时查找原始文件的目录
+        embedding: 是否确定 embedding 接口并发出一次预热请求（Ollama 首次调用时才加载模型）
+        snapshot: 是否加载只读索引快照（多进程部署的查询进程），尚未发布快照时该步骤失败
+
+    返回:
+        各步骤耗时（秒）；失败的步骤记录在 "errors" 中
+    """
+    timings: Dict[str, Any] = {}
+
+    def load_tokenizer():
+        from .utils import count_tokens
+        count_tokens("warmup", model=model or os.getenv("CHATGPT_MODEL", "gpt-4o"))
+
+    def load_vector_index():
+        from .vector_index import get_vector_index
+        get_vector_index()
+
+    def load_snapshot():
+        from .snapshot import get_snapshot_index
+        if get_snapshot_index().current() is None:
+            raise RuntimeError("写入进程尚未发布索引快照")
+
+    def load_embedding_model():
+        if snapshot:
+            from .snapshot import get_snapshot_index
+            index = get_snapshot_index()
+        else:
+            from .vector_index import get_vector_index
+            index = get_vector_index()
+        index.embedding_model.probe()
+        index.embedding_model.embed("warmup", max_retries=1)
+
+    def load_catalog():
+        from .catalog import get_catalog
+        document_catalog = get_catalog()
+        if results_dir:
+            document_catalog.sync(results_dir, upload_dir)
+
+    if tokenizer:
+        _run_step(timings, "tokenizer", load_tokenizer)
+    if vector_index:
+        _run_step(timings, "vector_index", load_vector_index)
+    if snapshot:
+        _run_step(timings, "snapshot", load_snapshot)
+    if catalog:
+        _run_step(timings, "catalog", load_catalog)
+    if embedding:
+        _run_step(timings, "embedding", load_embedding_model)
+    return timings
+
+
+class BackgroundWarmup:
+    """
+    在后台线程中执行 warmup()，记录预热状态
+
+    服务启动后立即可以响应存活探针，预热完成（且必需的步骤都成功）后就绪探针才返回就绪；
+    必需步骤失败时可以再次调用 start() 重试。
+
+    参数:
+        required: 必需成功的步骤，其余步骤（如分词器、预热 embedding）失败只记录在状态中
+        **options: 传给 warmup() 的参数
+    """
+
+    def __init__(self, required: Sequence[str] = ("vector_index", "catalog"), **options):
+        self.required = tuple(required)
+        self.options = options
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status: Dict[str, Any] = {"state": "pending"}
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._status["state"] == "ready"
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._status)
+
+    def start(self) -> bool:
+        """
+        开始预热
+
+        返回:
+            是否已开始（正在预热或已就绪时返回 False）
+        """
+        with self._lock:
+            if self._status["state"] == "ready" or (self._thread is not None and self._thread.is_alive()):
+                return False
+            self._status = {"state": "running", "attempts": self._status.get("attempts", 0) + 1,
+                            "started_at": datetime.now().isoformat(timespec="seconds")}
+            self._thread = threading.Thread(target=self.run, name="pageindex-warmup", daemon=True)
+            self._thread.start()
+        return True
+
+    def run(self) -> Dict[str, Any]:
+        """执行预热（阻塞）并返回状态"""
+        start = time.perf_counter()
+        timings = warmup(**self.options)
+        errors = timings.pop("errors", {})
+        failed = [step for step in self.required if step in errors]
+        with self._lock:
+            self._status.update(
+                state="failed" if failed else "ready",
+                steps=timings,
+                errors=errors,
+                seconds=round(time.perf_counter() - start, 3),
+                finished_at=datetime.now().isoformat(timespec="seconds"),
+            )
+            status = dict(self._status)
+        print(f"[warmup] {'预热完成' if not failed else '预热失败'}: {timings}" + (f", 错误: {errors}" if errors else ""))
+        return status
@@ -3,12 +3,21 @@ import os
 import json
 from pageindex import *
 from pageindex.page_index_md import md_to_tree
+from pageindex.incremental import page_index_incremental
+from pageindex.storage import load_result, result_exists
+from pageindex.catalog import get_catalog
 
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Process PDF or Markdown document and generate structure')
     parser.add_argument('--pdf_path', type=str, help='Path to the PDF file')
     parser.add_argument('--md_path', type=str, help='Path to the Markdown file')
+    parser.add_argument('--input', type=str, nargs='+',
+                      help='Directories, glob patterns or files to ingest in one batch (PDF and Markdown)')
+    parser.add_argument('--workers', type=int, default=4,
+                      help='Number of documents processed concurrently in batch mode')
+    parser.add_argument('--parse-processes', type=int, default=None,
+                      help='Number of processes used to parse PDFs in batch mode (defaults to --workers)')
 
     parser.add_argument('--model', type=str, default='gpt-4o-2024-11-20', help='Model to use')
 
@@ -35,15 +44,47 @@ if __name__ == "__main__":
                       help='Minimum token threshold for thinning (markdown only)')
     parser.add_argument('--summary-token-threshold', type=int, default=200,
                       help='Token threshold for generating summaries (markdown only)')
+
+    # Checkpoint arguments
+    parser.add_argument('--resume', action='store_true',
+                      help='Resume from the last completed stage of a previous interrupted run (PDF only)')
+    parser.add_argument('--no-checkpoint', action='store_true',
+                      help='Disable stage checkpoints (PDF only)')
+    parser.add_argument('--incremental', action='store_true',
+                      help='Update the existing result in ./results, reprocessing only changed pages (PDF only)')
     args = parser.parse_args()
     
-    # Validate that exactly one file type is specified
-    if not args.pdf_path and not args.md_path:
-        raise ValueError("Either --pdf_path or --md_path must be specified")
-    if args.pdf_path and args.md_path:
-        raise ValueError("Only one of --pdf_path or --md_path can be specified")
+    # Validate that exactly one input type is specified
+    if sum(bool(path) for path in (args.pdf_path, args.md_path, args.input)) != 1:
+        raise ValueError("Exactly one of --pdf_path, --md_path or --input must be specified")
     
-    if args.pdf_path:
+    if args.input:
+        from pageindex.batch import ingest_documents
+        opt = config(
+            model=args.model,
+            toc_check_page_num=args.toc_check_pages,
+            max_page_num_each_node=args.max_pages_per_node,
+            max_token_num_each_node=args.max_tokens_per_node,
+            if_add_node_id=args.if_add_node_id,
+            if_add_node_summary=args.if_add_node_summary,
+            if_add_doc_description=args.if_add_doc_description,
+            if_add_node_text=args.if_add_node_text,
+            if_checkpoint='no' if args.no_checkpoint else 'yes',
+            resume='yes' if args.resume else 'no'
+        )
+        ingest_documents(
+            args.input, opt,
+            workers=args.workers,
+            parse_processes=args.parse_processes,
+            output_dir='./results',
+            md_options={
+                'if_thinning': args.if_thinning.lower() == 'yes',
+                'min_token_threshold': args.thinning_threshold,
+                'summary_token_threshold': args.summary_token_threshold,
+            }
+        )
+
+    elif args.pdf_path:
         # Validate PDF file
         if not args.pdf_path.lower().endswith('.pdf'):
             raise ValueError("PDF file must have .pdf extension")
@@ -60,21 +101,30 @@ if __name__ == "__main__":
             if_add_node_id=args.if_add_node_id,
             if_add_node_summary=args.if_add_node_summary,
             if_add_doc_description=args.if_add_doc_description,
-            if_add_node_text=args.if_add_node_text
+            if_add_node_text=args.if_add_node_text,
+            if_checkpoint='no' if args.no_checkpoint else 'yes',
+            resume='yes' if args.resume else 'no'
         )
 
-        # Process the PDF
-        toc_with_page_number = page_index_main(args.pdf_path, opt)
-        print('Parsing done, saving to file...')
-        
-        # Save results
+        # Output paths
         pdf_name = os.path.splitext(os.path.basename(args.pdf_path))[0]    
         output_dir = './results'
         output_file = f'{output_dir}/{pdf_name}_structure.json'
         os.makedirs(output_dir, exist_ok=True)
+
+        # Process the PDF
+        if args.incremental and result_exists(output_file):
+            previous_result = load_result(output_file, with_text=True)
+            toc_with_page_number, diff_report = page_index_incremental(args.pdf_path, previous_result, opt)
+            diff_file = f'{output_dir}/{pdf_name}_diff.json'
+            with open(diff_file, 'w', encoding='utf-8') as f:
+                json.dump(diff_report, f, indent=2, ensure_ascii=False)
+            print(f'Diff report saved to: {diff_file}')
+        else:
+            toc_with_page_number = page_index_main(args.pdf_path, opt)
+        print('Parsing done, saving to file...')
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(toc_with_page_number, f, indent=2)
+        get_catalog().save_document(toc_with_page_number, output_file, source_path=args.pdf_path)
         
         print(f'Tree structure saved to: {output_file}')
             
@@ -127,7 +177,6 @@ if __name__ == "__main__":
         output_file = f'{output_dir}/{md_name}_structure.json'
         os.makedirs(output_dir, exist_ok=True)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(toc_with_page_number, f, indent=2, ensure_ascii=False)
+        get_catalog().save_document(toc_with_page_number, output_file, source_path=args.md_path)
         
         print(f'Tree structure saved to: {output_file}')
\ No newline at end of file